@@ -0,0 +1,63 @@
+import asyncio
+import json
+import os
+import signal
+import threading
+
+from bundle import SharedTraceStore
+from log import logger
+from metrics import Metrics
+from registers import MAX_UNITS, RegisterMap, RegisterUpdater
+from scenario import Scenario
+from scheduler import read_traces
+from server import ModbusServer
+
+MODBUS_HOST = os.getenv("MODBUS_HOST", "0.0.0.0")
+# First port, devices that do not fit in it are served on the next ones
+MODBUS_PORT = int(os.getenv("MODBUS_PORT", "502"))
+UNITS_PER_PORT = int(os.getenv("UNITS_PER_PORT", str(MAX_UNITS)))
+# Where the register of every trace is written for the clients, if set
+REGISTER_MAP = os.getenv("REGISTER_MAP")
+# Trace bundle published by another device, read from disk if missing
+SHARED_STORE = os.getenv("SHARED_STORE")
+# Makes the noise added to the traces reproducible
+NOISE_SEED = int(os.environ["NOISE_SEED"]) if os.getenv("NOISE_SEED") else None
+# Json file of events overlaid on the traces, read again when it changes
+SCENARIO = os.getenv("SCENARIO")
+
+
+def run():
+    traces = read_traces()
+    register_map = RegisterMap(traces, units_per_port=UNITS_PER_PORT)
+    if REGISTER_MAP:
+        with open(REGISTER_MAP, "w") as f:
+            json.dump({"registers": register_map.describe(MODBUS_PORT)}, f, indent=2)
+        logger.info(f"Register map written to {REGISTER_MAP}")
+
+    metrics = Metrics()
+    updater = RegisterUpdater(
+        register_map,
+        traces=traces,
+        store=SharedTraceStore.attach(SHARED_STORE),
+        metrics=metrics,
+        seed=NOISE_SEED,
+        scenario=Scenario(SCENARIO) if SCENARIO else None,
+    )
+    server = ModbusServer(register_map, MODBUS_HOST, MODBUS_PORT, metrics=metrics)
+
+    updater_thread = threading.Thread(target=updater.start, daemon=True)
+    updater_thread.start()
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        updater.stop()
+        updater_thread.join()
+    finally:
+        logger.info(f"Metrics: {Metrics.format(metrics.snapshot())}")
+
+
+if __name__ == "__main__":
+    logger.info("Starting..")
+    # `docker stop` sends SIGTERM, stop on it like on Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    run()
@@ -0,0 +1,125 @@
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from clock import Clock
+from log import logger
+from metrics import Metrics
+from scenario import Scenario
+from scheduler import Scheduler
+from store import TraceStore
+
+# Valid unit IDs of a Modbus server, 0 is broadcast and 248-255 are reserved
+MAX_UNITS = 247
+# Each value is a big-endian float32 in two consecutive registers
+REGISTERS_PER_VALUE = 2
+
+
+def device_of(topic: str) -> str:
+    """`grid/asset` of a `grid/asset/attribute` topic"""
+    return topic.rsplit("/", 1)[0]
+
+
+class RegisterMap:
+    """Registers of every simulated device, computed once from the traces.
+
+    Each device (a `grid/asset` topic prefix) gets its own unit ID, with its
+    attributes at consecutive addresses in the order of traces.json. A port
+    serves at most `units_per_port` devices, the next ones go to the next
+    port. Registers are swapped whole on every update so a poll never sees
+    half of a tick.
+    """
+
+    def __init__(self, traces: List[dict], units_per_port: int = MAX_UNITS) -> None:
+        if not 1 <= units_per_port <= MAX_UNITS:
+            raise ValueError(f"Units per port must be in [1, {MAX_UNITS}]")
+        self.units_per_port = units_per_port
+        devices: Dict[str, int] = {}
+        addresses: Dict[str, int] = {}
+        self.locations: List[Tuple[int, int, int]] = []
+        for trace in traces:
+            device = device_of(trace["topic"])
+            index = devices.setdefault(device, len(devices))
+            address = addresses.get(device, 0)
+            addresses[device] = address + REGISTERS_PER_VALUE
+            port, unit = divmod(index, units_per_port)
+            self.locations.append((port, unit + 1, address))
+        self.topics = [trace["topic"] for trace in traces]
+        self.devices = len(devices)
+        self.ports = -(-self.devices // units_per_port)
+        size = max(addresses.values(), default=0)
+        locations = np.array(self.locations, dtype=np.intp).reshape(-1, 3)
+        self._port, self._unit, self._address = locations.T
+        # Port, unit ID and address, stored big-endian as sent on the wire
+        self.registers = np.zeros((self.ports, MAX_UNITS + 1, size), dtype=">u2")
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def update(self, values: np.ndarray, found: Optional[np.ndarray] = None) -> None:
+        """Writes the value of every trace, keeping the last one when not found"""
+        positions = np.arange(len(self)) if found is None else np.flatnonzero(found)
+        words = values[positions].astype(">f4").view(">u2").reshape(-1, 2)
+        port, unit = self._port[positions], self._unit[positions]
+        address = self._address[positions]
+        registers = self.registers.copy()
+        registers[port, unit, address] = words[:, 0]
+        registers[port, unit, address + 1] = words[:, 1]
+        self.registers = registers
+
+    def read(self, port: int, unit: int, address: int, count: int) -> Optional[bytes]:
+        """Registers as sent in a response, None if out of the map"""
+        registers = self.registers
+        if address + count > registers.shape[2]:
+            return None
+        return registers[port, unit, address : address + count].tobytes()
+
+    def has_unit(self, port: int, unit: int) -> bool:
+        if not 0 <= port < self.ports or not 1 <= unit <= self.units_per_port:
+            return False
+        return port * self.units_per_port + unit <= self.devices
+
+    def describe(self, base_port: int) -> List[dict]:
+        """Where each trace is served, for the configuration of the clients"""
+        return [
+            {
+                "topic": topic,
+                "port": base_port + port,
+                "unit_id": unit,
+                "address": address,
+                "type": "float32",
+            }
+            for topic, (port, unit, address) in zip(self.topics, self.locations)
+        ]
+
+
+class RegisterUpdater(Scheduler):
+    """Scheduler writing the values of each tick to a register map"""
+
+    def __init__(
+        self,
+        register_map: RegisterMap,
+        traces: Optional[List[dict]] = None,
+        store: Optional[TraceStore] = None,
+        metrics: Optional[Metrics] = None,
+        clock: Optional[Clock] = None,
+        seed: Optional[int] = None,
+        scenario: Optional[Scenario] = None,
+    ) -> None:
+        super().__init__(
+            None,
+            traces=traces,
+            store=store,
+            metrics=metrics,
+            clock=clock,
+            seed=seed,
+            scenario=scenario,
+        )
+        self.register_map = register_map
+
+    def tick(self, now: datetime):
+        values, found, _ = self.sample(now)
+        self.register_map.update(values, found)
+        self.metrics.incr("updated", int(found.sum()))
+        self.metrics.incr("no_data", int((~found).sum()))
+        logger.debug(f"Updated {int(found.sum())} values at {now}")
@@ -0,0 +1,107 @@
+import asyncio
+import struct
+from typing import List, Optional
+
+from log import logger
+from metrics import Metrics
+from registers import RegisterMap
+
+READ_HOLDING_REGISTERS = 3
+READ_INPUT_REGISTERS = 4
+# Most registers a single read can ask for
+MAX_COUNT = 125
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+GATEWAY_TARGET_FAILED = 11
+
+# Transaction ID, protocol ID, length and unit ID
+MBAP = struct.Struct(">HHHB")
+
+
+class ModbusServer:
+    """Read-only Modbus TCP server of a register map.
+
+    Holding and input registers hold the same values. Every port of the map
+    is served from one event loop, with any number of connections and
+    requests answered in order per connection.
+    """
+
+    def __init__(
+        self,
+        register_map: RegisterMap,
+        host: str = "0.0.0.0",
+        port: int = 502,
+        metrics: Optional[Metrics] = None,
+    ) -> None:
+        self.register_map = register_map
+        self.host, self.port = host, port
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.servers: List[asyncio.AbstractServer] = []
+
+    async def start(self) -> None:
+        for index in range(self.register_map.ports):
+            server = await asyncio.start_server(
+                lambda reader, writer, index=index: self.handle(index, reader, writer),
+                self.host,
+                self.port + index,
+            )
+            self.servers.append(server)
+        logger.info(
+            f"Serving {self.register_map.devices} devices on ports "
+            f"{self.port} to {self.port + len(self.servers) - 1}"
+        )
+
+    async def serve(self) -> None:
+        await self.start()
+        await asyncio.gather(*(server.serve_forever() for server in self.servers))
+
+    async def stop(self) -> None:
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+
+    async def handle(
+        self, index: int, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.metrics.incr("connections")
+        try:
+            while True:
+                header = await reader.readexactly(MBAP.size)
+                transaction, protocol, length, unit = MBAP.unpack(header)
+                if length < 2:
+                    break
+                pdu = await reader.readexactly(length - 1)
+                if protocol != 0:
+                    continue
+                response = self.respond(index, unit, pdu)
+                writer.write(
+                    MBAP.pack(transaction, 0, len(response) + 1, unit) + response
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def respond(self, index: int, unit: int, pdu: bytes) -> bytes:
+        function = pdu[0]
+        if function not in (READ_HOLDING_REGISTERS, READ_INPUT_REGISTERS):
+            return self.exception(function, ILLEGAL_FUNCTION)
+        if not self.register_map.has_unit(index, unit):
+            return self.exception(function, GATEWAY_TARGET_FAILED)
+        if len(pdu) != 5:
+            return self.exception(function, ILLEGAL_DATA_VALUE)
+        address, count = struct.unpack(">HH", pdu[1:])
+        if not 1 <= count <= MAX_COUNT:
+            return self.exception(function, ILLEGAL_DATA_VALUE)
+        data = self.register_map.read(index, unit, address, count)
+        if data is None:
+            return self.exception(function, ILLEGAL_DATA_ADDRESS)
+        self.metrics.incr("reads")
+        return bytes((function, len(data))) + data
+
+    def exception(self, function: int, code: int) -> bytes:
+        self.metrics.incr("exceptions")
+        return bytes((function | 0x80, code))
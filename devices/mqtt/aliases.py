@@ -0,0 +1,81 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+# Aliases asked for when connecting, brokers may allow fewer
+TOPIC_ALIASES = 1000
+
+
+class PackedProperties(Properties):
+    """PUBLISH properties packed once.
+
+    The client packs the properties of every publish again, walking all
+    the properties MQTT v5 defines, which costs more than the rest of the
+    packet.
+    """
+
+    def __init__(self, alias: int) -> None:
+        super().__init__(PacketTypes.PUBLISH)
+        self.TopicAlias = alias
+        object.__setattr__(self, "packed", super().pack())
+
+    def pack(self) -> bytes:
+        return self.packed
+
+
+class TopicAliases:
+    """Topic aliases of an MQTT v5 connection.
+
+    The first message of a topic is sent with the topic and its alias, the
+    next ones with the alias only. When every alias is taken, the least
+    recently used one moves to the new topic. Aliases only last as long as
+    the connection, so the table is `reset` on every connect.
+    """
+
+    def __init__(self, maximum: int = TOPIC_ALIASES) -> None:
+        self.maximum = maximum
+        self.limit = maximum
+        self._aliases: "OrderedDict[str, int]" = OrderedDict()
+        # Highest alias given so far and the ones given back by forgotten topics
+        self._highest = 0
+        self._free: List[int] = []
+        self._properties: List[PackedProperties] = [
+            PackedProperties(alias) for alias in range(1, maximum + 1)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._aliases)
+
+    def reset(self, limit: int) -> None:
+        """Forgets every alias, the broker allows `limit` of them"""
+        self._aliases.clear()
+        self._highest = 0
+        self._free.clear()
+        self.limit = min(limit, self.maximum)
+
+    def lookup(self, topic: str) -> Tuple[str, Optional[Properties]]:
+        """Topic and properties to publish `topic` with, the topic is empty
+        when the broker already knows its alias"""
+        alias = self._aliases.get(topic)
+        if alias is not None:
+            self._aliases.move_to_end(topic)
+            return "", self._properties[alias - 1]
+        if not self.limit:
+            return topic, None
+        if self._free:
+            alias = self._free.pop()
+        elif self._highest < self.limit:
+            self._highest += 1
+            alias = self._highest
+        else:
+            _, alias = self._aliases.popitem(last=False)
+        self._aliases[topic] = alias
+        return topic, self._properties[alias - 1]
+
+    def forget(self, topic: str) -> None:
+        """Drops the alias of a message that did not reach the broker"""
+        alias = self._aliases.pop(topic, None)
+        if alias is not None:
+            self._free.append(alias)
@@ -0,0 +1,176 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from encoding import EncodedValues
+from log import logger
+from store import TRACES_PATH, TraceFile, TraceStore
+
+# Compiled next to the trace files by compiler.py
+BUNDLE_NAME = "traces.bundle"
+MAGIC = b"SPLTRC01"
+# Magic and length of the JSON catalog that follows
+HEADER = struct.Struct("<8sQ")
+# Arrays start at multiples of a cache line
+ALIGN = 64
+ARRAYS = ("timestamps", "wall", "booleans")
+
+
+def _align(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+
+def default_bundle_path() -> str:
+    """A file in shared memory when the system has it"""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(directory, f"splight-traces-{os.getpid()}.bundle")
+
+
+def write_bundle(
+    files: Dict[str, TraceFile],
+    path: str,
+    traces: Optional[List[dict]] = None,
+    encode: bool = True,
+) -> int:
+    """Writes the arrays of every file after a catalog of where they are, and
+    the resolved trace definitions if given. With `encode` the values of
+    every file are written compressed.
+
+    The file is written next to `path` and renamed, so processes attaching
+    never see a partial bundle. Returns the size in bytes.
+    """
+    catalog = {}
+    arrays = []
+    offset = 0
+
+    def place(named: Dict[str, np.ndarray]) -> Dict[str, dict]:
+        nonlocal offset
+        specs = {}
+        for name, array in named.items():
+            array = np.ascontiguousarray(array)
+            offset = _align(offset)
+            specs[name] = {
+                "offset": offset,
+                "dtype": array.dtype.str,
+                "shape": list(array.shape),
+            }
+            arrays.append((offset, array))
+            offset += array.nbytes
+        return specs
+
+    for filename, trace_file in files.items():
+        if encode:
+            trace_file = trace_file.encode()
+        named = {name: getattr(trace_file, name) for name in ARRAYS}
+        if trace_file.encoded is None:
+            named["values"] = trace_file.values
+        entry = {"columns": trace_file.columns, "arrays": place(named)}
+        if trace_file.encoded is not None:
+            entry["encoded"] = place(trace_file.encoded.arrays())
+        catalog[filename] = entry
+    header = json.dumps({"files": catalog, "traces": traces}).encode()
+    start = _align(HEADER.size + len(header))
+
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(header)) + header)
+        for array_offset, array in arrays:
+            f.seek(start + array_offset)
+            f.write(array.tobytes())
+        f.truncate(start + offset)
+    os.replace(temporary, path)
+    return start + offset
+
+
+def _read_catalog(path: str, buffer) -> Tuple[dict, int]:
+    """Catalog of a bundle and where its arrays start"""
+    magic, length = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a trace bundle")
+    catalog = json.loads(buffer[HEADER.size : HEADER.size + length])
+    return catalog, _align(HEADER.size + length)
+
+
+def read_trace_table(path: str) -> Optional[List[dict]]:
+    """Resolved trace definitions of a compiled bundle"""
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        _, length = HEADER.unpack(header)
+        catalog, _ = _read_catalog(path, header + f.read(length))
+    return catalog["traces"]
+
+
+def read_bundle(path: str) -> Dict[str, TraceFile]:
+    """Trace files of a bundle, as read-only arrays over a shared mapping"""
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    catalog, start = _read_catalog(path, buffer)
+
+    def view(specs: Dict[str, dict]) -> Dict[str, np.ndarray]:
+        arrays = {}
+        for name, spec in specs.items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            if count:
+                array = np.frombuffer(
+                    buffer, dtype, count=count, offset=start + spec["offset"]
+                )
+            else:
+                array = np.empty(0, dtype)
+            arrays[name] = array.reshape(spec["shape"])
+        return arrays
+
+    files = {}
+    for filename, entry in catalog["files"].items():
+        arrays = view(entry["arrays"])
+        if "encoded" in entry:
+            arrays["encoded"] = EncodedValues(
+                len(arrays["timestamps"]), **view(entry["encoded"])
+            )
+        files[filename] = TraceFile(columns=entry["columns"], **arrays)
+    return files
+
+
+class SharedTraceStore(TraceStore):
+    """Trace store attached to a bundle published by another process.
+
+    Every process attached to the same bundle shares one copy of the arrays
+    in the page cache. Files missing from the bundle, or changed after it was
+    written, are read from `path`.
+    """
+
+    def __init__(self, bundle_path: str, path: str = TRACES_PATH) -> None:
+        super().__init__(path, encode=True)
+        self.bundle_path = bundle_path
+        written = os.path.getmtime(bundle_path)
+        for filename, trace_file in read_bundle(bundle_path).items():
+            source = os.path.join(path, filename)
+            if os.path.exists(source) and os.path.getmtime(source) > written:
+                logger.warning(f"{filename} changed after {bundle_path} was written")
+                continue
+            self._files[filename] = trace_file
+        logger.info(f"Attached to {len(self)} trace files in {bundle_path}")
+
+    @classmethod
+    def attach(
+        cls, bundle_path: Optional[str], path: str = TRACES_PATH
+    ) -> Optional["SharedTraceStore"]:
+        """The store of `bundle_path` if it has been published"""
+        if not bundle_path or not os.path.exists(bundle_path):
+            return None
+        return cls(bundle_path, path)
+
+
+def publish(store: TraceStore, path: str) -> None:
+    size = write_bundle(store.files(), path)
+    logger.info(f"Published {len(store)} trace files in {path} ({size} bytes)")
+
+
+def open_store(path: str = TRACES_PATH) -> TraceStore:
+    """Store of the bundle compiled in `path`, of the csv files if there is none"""
+    store = SharedTraceStore.attach(os.path.join(path, BUNDLE_NAME), path)
+    return store if store is not None else TraceStore(path, encode=True)
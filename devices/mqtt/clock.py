@@ -0,0 +1,70 @@
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterator, Optional
+
+TICK_INTERVAL = 60
+
+
+class Clock:
+    """Real time clock, yields the current time once every `interval` seconds.
+
+    Ticks are aware datetimes in the local timezone, so periodic traces follow
+    the local wall clock and absolute ones are matched by the real UTC time.
+    """
+
+    def __init__(self, interval: float = TICK_INTERVAL) -> None:
+        self.interval = interval
+        # Seconds the last tick came after it was due
+        self.lateness = 0.0
+
+    def ticks(self, stopped: Optional[threading.Event] = None) -> Iterator[datetime]:
+        """Ticks until `stopped` is set, which also ends the wait for the next one"""
+        stopped = stopped if stopped is not None else threading.Event()
+        next_tick = time.monotonic()
+        while not stopped.is_set():
+            yield datetime.now().astimezone()
+            next_tick += self.interval
+            if stopped.wait(max(0.0, next_tick - time.monotonic())):
+                return
+            self.lateness = max(0.0, time.monotonic() - next_tick)
+
+
+class VirtualClock(Clock):
+    """Clock running over [start, end) at `speed` times real time.
+
+    A `speed` of None (or 0) goes as fast as the consumer of the ticks allows,
+    which is what a historical backfill wants.
+    """
+
+    def __init__(
+        self,
+        start: datetime,
+        end: datetime,
+        speed: Optional[float] = None,
+        interval: float = TICK_INTERVAL,
+    ) -> None:
+        super().__init__(interval)
+        if end <= start:
+            raise ValueError(f"Replay end {end} must be after start {start}")
+        self.start = start
+        self.end = end
+        self.speed = speed or None
+
+    def ticks(self, stopped: Optional[threading.Event] = None) -> Iterator[datetime]:
+        stopped = stopped if stopped is not None else threading.Event()
+        step = timedelta(seconds=self.interval)
+        wall_start = time.monotonic()
+        current = self.start
+        while current < self.end and not stopped.is_set():
+            yield current
+            current += step
+            if self.speed:
+                due = wall_start + (current - self.start).total_seconds() / self.speed
+                if stopped.wait(max(0.0, due - time.monotonic())):
+                    return
+                self.lateness = max(0.0, time.monotonic() - due)
+
+    def __len__(self) -> int:
+        return math.ceil((self.end - self.start).total_seconds() / self.interval)
@@ -0,0 +1,217 @@
+import argparse
+import inspect
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from bundle import BUNDLE_NAME, write_bundle
+from log import logger
+from noise import NoiseBuffer
+from scenario import Event, Overlay, read_scenario
+from scheduler import Trace
+from store import (
+    PERIODS,
+    TRACES_PATH,
+    Lookup,
+    TimeUnit,
+    TraceFile,
+    from_timestamp,
+)
+
+# Fields a trace definition can have
+TRACE_FIELDS = frozenset(inspect.signature(Trace).parameters)
+
+
+class Compiled(NamedTuple):
+    traces: List[dict]
+    files: Dict[str, TraceFile]
+    errors: List[str]
+    warnings: List[str]
+
+
+def missing_minutes(trace_file: TraceFile, unit: TimeUnit) -> int:
+    """Minutes of the period of `unit` without a sample in the file"""
+    keys, _ = trace_file.keys(unit)
+    return PERIODS[unit] // 60 - len(np.unique(keys // 60))
+
+
+def compile_traces(definitions: List[dict], path: str = TRACES_PATH) -> Compiled:
+    """Checks every trace against its file and resolves it for the scheduler.
+
+    Each file is read once, however many traces use it. Resolved traces
+    carry their lookup and the index of their column, so nothing is looked
+    up by name when the device starts.
+    """
+    traces, errors, warnings = [], [], []
+    files: Dict[str, TraceFile] = {}
+    broken: Dict[str, str] = {}
+    topics: Dict[str, str] = {}
+    for position, definition in enumerate(definitions):
+        label = f"Trace {position} ({definition.get('name', 'unnamed')})"
+        unknown = set(definition) - TRACE_FIELDS
+        if unknown:
+            errors.append(
+                f"{label}: unknown fields {', '.join(sorted(unknown))} on topic "
+                f"{definition.get('topic')}"
+            )
+            continue
+        try:
+            trace = Trace(**definition)
+            # The noise settings are checked by the buffer that uses them
+            NoiseBuffer(
+                1.0,
+                trace.noise_model,
+                correlation=trace.noise_correlation,
+                bound=trace.noise_bound,
+            )
+        except (TypeError, ValueError) as e:
+            errors.append(f"{label}: {e}")
+            continue
+
+        filename = trace.filename
+        if filename not in files and filename not in broken:
+            try:
+                files[filename] = TraceFile.from_csv(os.path.join(path, filename))
+            except FileNotFoundError:
+                broken[filename] = f"file {filename} not found"
+            except (ValueError, StopIteration) as e:
+                broken[filename] = f"file {filename} can not be read: {e or 'empty'}"
+        if filename in broken:
+            errors.append(f"{label}: {broken[filename]}")
+            continue
+        trace_file = files[filename]
+        if trace.target_value not in trace_file.columns:
+            errors.append(
+                f"{label}: column {trace.target_value} not in {filename}, "
+                f"columns are {', '.join(trace_file.columns)}"
+            )
+            continue
+
+        if trace.topic in topics:
+            warnings.append(
+                f"{label}: topic {trace.topic} also used by {topics[trace.topic]}"
+            )
+        topics[trace.topic] = label
+        unit = trace.match_timestamp_by
+        if unit != TimeUnit.ABSOLUTE and trace.lookup == Lookup.EXACT:
+            missing = missing_minutes(trace_file, unit)
+            if missing:
+                warnings.append(
+                    f"{label}: {missing} minutes of each {unit} period have no "
+                    f"data in {filename}, set a lookup to fill them"
+                )
+        traces.append(
+            {
+                **definition,
+                "match_timestamp_by": str(unit),
+                "lookup": str(trace.lookup),
+                "column": trace_file.index(trace.target_value),
+            }
+        )
+    used = {trace["filename"] for trace in traces}
+    files = {name: trace_file for name, trace_file in files.items() if name in used}
+    return Compiled(traces, files, errors, warnings)
+
+
+def overlay_files(
+    compiled: Compiled, events: List[Event]
+) -> Tuple[Set[str], List[Event]]:
+    """Overlays `events` on the trace files at the time of each row, as if
+    they had been recorded in them. Returns the targets without traces, and
+    the events that touch traces but none of the rows of their files.
+
+    Periodic files repeat their rows, and so the events written in them. A
+    column read by several traces gets the events of the first one. Rows
+    are matched by the time written in the file, so an event dated another
+    day than the one a daily file covers is written nowhere.
+    """
+    topics: Dict[str, Dict[int, str]] = {}
+    for trace in compiled.traces:
+        topics.setdefault(trace["filename"], {}).setdefault(
+            trace["column"], trace["topic"]
+        )
+    unmatched = {event.target for event in events}
+    # Events touching some trace, and those touching some row of its file
+    touching: Set[int] = set()
+    written: Set[int] = set()
+    for filename, trace_file in compiled.files.items():
+        columns = sorted(topics[filename])
+        file_topics = [topics[filename][column] for column in columns]
+        booleans = trace_file.booleans[columns]
+        overlay = Overlay(events, file_topics, booleans)
+        unmatched &= overlay.unmatched
+        if not len(overlay):
+            continue
+        for index, event in enumerate(events):
+            if index in written or not len(Overlay([event], file_topics, booleans)):
+                continue
+            touching.add(index)
+            wall = trace_file.wall
+            if ((wall >= event.start) & (wall < event.end)).any():
+                written.add(index)
+        values = trace_file.values[:, columns]
+        overlay.apply(values, None, trace_file.wall)
+        trace_file.values[:, columns] = values
+    return unmatched, [events[index] for index in sorted(touching - written)]
+
+
+def compile_bundle(
+    path: str = TRACES_PATH,
+    output: Optional[str] = None,
+    scenarios: Sequence[str] = (),
+) -> Compiled:
+    """Compiles traces.json in `path` with the events of `scenarios` overlaid,
+    the bundle is only written without errors"""
+    with open(os.path.join(path, "traces.json")) as f:
+        definitions = json.load(f)["traces"]
+    compiled = compile_traces(definitions, path)
+    for scenario in scenarios:
+        if compiled.errors:
+            break
+        try:
+            events = read_scenario(scenario)
+        except (OSError, ValueError, KeyError) as e:
+            compiled.errors.append(f"Scenario {scenario}: {e}")
+            continue
+        unmatched, outside = overlay_files(compiled, events)
+        for target in sorted(unmatched):
+            compiled.warnings.append(
+                f"Scenario {scenario}: no trace matches the target {target}"
+            )
+        for event in outside:
+            compiled.errors.append(
+                f"Scenario {scenario}: the event on {event.target} at "
+                f"{from_timestamp(event.start).isoformat()} is outside the "
+                "times written in its trace files, date it within them"
+            )
+    for warning in compiled.warnings:
+        logger.warning(warning)
+    for error in compiled.errors:
+        logger.error(error)
+    if compiled.errors:
+        return compiled
+    output = output or os.path.join(path, BUNDLE_NAME)
+    size = write_bundle(compiled.files, output, compiled.traces)
+    logger.info(
+        f"Compiled {len(compiled.traces)} traces from {len(compiled.files)} files "
+        f"in {output} ({size} bytes)"
+    )
+    return compiled
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compiles traces.json into a bundle")
+    parser.add_argument("path", nargs="?", default=TRACES_PATH)
+    parser.add_argument("--output", help="bundle file, traces.bundle in path")
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        default=[],
+        help="scenario file overlaid on the traces, can be repeated",
+    )
+    args = parser.parse_args()
+    compiled = compile_bundle(args.path, args.output, args.scenario)
+    if compiled.errors:
+        logger.error(f"{len(compiled.errors)} errors, no bundle written")
+        exit(1)
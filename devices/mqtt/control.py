@@ -0,0 +1,65 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from log import logger
+
+# Gets the query parameters, returns the status and a JSON serializable body
+Route = Callable[[Dict[str, str]], Tuple[int, object]]
+
+
+class ControlServer:
+    """Local HTTP endpoint to inspect and drive the device while it runs.
+
+    It listens on localhost only, every route answers GET and POST with JSON.
+    """
+
+    def __init__(self, port: int, host: str = "127.0.0.1") -> None:
+        self.host, self.port = host, port
+        self.routes: Dict[str, Route] = {}
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def route(self, path: str, handler: Route) -> None:
+        self.routes[path] = handler
+
+    def handle(self, target: str) -> Tuple[int, object]:
+        url = urlsplit(target)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            return 404, {"error": f"{url.path} not found", "routes": list(self.routes)}
+        try:
+            return handler(dict(parse_qsl(url.query)))
+        except ValueError as e:
+            return 400, {"error": str(e)}
+
+    def start(self) -> None:
+        control = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = control.handle(self.path)
+                data = json.dumps(body, default=str).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_POST = do_GET
+
+            def log_message(self, format, *args):
+                logger.debug(f"Control: {format % args}")
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._server.server_address[1]
+        threading.Thread(
+            target=self._server.serve_forever, name="control", daemon=True
+        ).start()
+        logger.info(f"Control endpoint on http://{self.host}:{self.port}")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
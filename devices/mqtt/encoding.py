@@ -0,0 +1,314 @@
+from collections import OrderedDict
+from enum import Enum
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Rows decoded together, the rows a lookup needs are decoded once per block
+BLOCK_ROWS = 1024
+# Decoded blocks kept per file, interpolation may read across a block edge
+CACHED_BLOCKS = 4
+# Decimals tried to turn an analog column into integers for delta encoding
+MAX_DECIMALS = 6
+# Integers above it are not exact as float64
+MAX_EXACT = 2**53
+# Bytes kept for every block of a delta or xor column
+BLOCK_HEADER = 8 + 8 + 1 + 1
+
+SIGNED = {1: np.int8, 2: np.int16, 4: np.int32, 8: np.int64}
+UNSIGNED = {1: np.uint8, 2: np.uint16, 4: np.uint32, 8: np.uint64}
+
+
+class Encoding(Enum):
+    # A single value
+    CONSTANT = 0
+    # The rows where the value changes and the new values, for status columns
+    RUNS = 1
+    # Values with a few decimals as integers, each block stored as the
+    # differences to its first value in the narrowest integers that fit
+    DELTA = 2
+    # Gorilla-style: each value xor the previous one, without the trailing
+    # zero bits they share in the block, in the narrowest integers that fit
+    XOR = 3
+
+    def __str__(self):
+        return self.name.lower()
+
+
+def decimals(values: np.ndarray) -> Optional[int]:
+    """Fewest decimals that give back `values` exactly, None if there are
+    more than `MAX_DECIMALS` or values that are not finite"""
+    bits = values.view(np.uint64)
+    for count in range(MAX_DECIMALS + 1):
+        scale = 10.0**count
+        scaled = np.round(values * scale)
+        if not np.all(np.abs(scaled) < MAX_EXACT):
+            return None
+        if np.array_equal((scaled / scale).view(np.uint64), bits):
+            return count
+    return None
+
+
+def signed_width(deltas: np.ndarray) -> int:
+    """Bytes of the narrowest signed integers that hold `deltas`"""
+    if not len(deltas) or not deltas.any():
+        return 0
+    low, high = int(deltas.min()), int(deltas.max())
+    for width, dtype in SIGNED.items():
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return width
+    return 8
+
+
+def unsigned_width(value: int) -> int:
+    if not value:
+        return 0
+    for width in UNSIGNED:
+        if value < 1 << (8 * width):
+            return width
+    return 8
+
+
+def trailing_zeros(value: int) -> int:
+    return (value & -value).bit_length() - 1 if value else 0
+
+
+def delta_block(ints: np.ndarray) -> Tuple[int, bytes]:
+    deltas = np.diff(ints)
+    width = signed_width(deltas)
+    return width, deltas.astype(SIGNED[width]).tobytes() if width else b""
+
+
+def xor_block(bits: np.ndarray) -> Tuple[int, int, bytes]:
+    xors = bits[1:] ^ bits[:-1]
+    shift = trailing_zeros(int(np.bitwise_or.reduce(xors))) if len(xors) else 0
+    xors >>= np.uint64(shift)
+    width = unsigned_width(int(xors.max())) if len(xors) else 0
+    return width, shift, xors.astype(UNSIGNED[width]).tobytes() if width else b""
+
+
+def blocks(values: np.ndarray) -> List[np.ndarray]:
+    return [
+        values[start : start + BLOCK_ROWS]
+        for start in range(0, len(values), BLOCK_ROWS)
+    ]
+
+
+class EncodedValues:
+    """Columns of a trace file each in the encoding that takes the least
+    memory, picked when the file is loaded.
+
+    A row is read with `at`: constant and run-length columns are looked up
+    directly, delta and xor columns decode the block of `BLOCK_ROWS` rows it
+    belongs to, which stays cached for the next lookups. Every array is
+    plain, so an encoded file can be written to a bundle and shared.
+    """
+
+    def __init__(
+        self,
+        rows: int,
+        encodings: np.ndarray,
+        constants: np.ndarray,
+        run_keys: np.ndarray,
+        run_values: np.ndarray,
+        decimals: np.ndarray,
+        block_offsets: np.ndarray,
+        block_widths: np.ndarray,
+        block_shifts: np.ndarray,
+        block_firsts: np.ndarray,
+        payload: np.ndarray,
+    ) -> None:
+        # Encoding of every column, and the value of the constant ones
+        self.encodings = encodings
+        self.constants = constants
+        # Run starts of every run-length column, as column * rows + row
+        self.run_keys = run_keys
+        self.run_values = run_values
+        # One row per delta or xor column and one column per block, decimals
+        # are -1 for xor columns
+        self.decimals = decimals
+        self.block_offsets = block_offsets
+        self.block_widths = block_widths
+        self.block_shifts = block_shifts
+        self.block_firsts = block_firsts
+        self.payload = payload
+        self.rows = rows
+        self.runs = np.flatnonzero(encodings == Encoding.RUNS.value)
+        self.blocked = np.flatnonzero(
+            (encodings == Encoding.DELTA.value) | (encodings == Encoding.XOR.value)
+        )
+        self._cache: "OrderedDict[int, np.ndarray]" = OrderedDict()
+
+    @classmethod
+    def encode(cls, values: np.ndarray) -> "EncodedValues":
+        rows, columns = values.shape
+        encodings = np.empty(columns, dtype=np.uint8)
+        constants = np.zeros(columns)
+        run_keys: List[np.ndarray] = []
+        run_values: List[np.ndarray] = []
+        # Encoded blocks of the delta and xor columns
+        encoded: List[Tuple[int, List[Tuple[int, int, float, bytes]]]] = []
+        for column in range(columns):
+            series = np.ascontiguousarray(values[:, column])
+            bits = series.view(np.uint64)
+            starts = np.flatnonzero(np.concatenate(([True], bits[1:] != bits[:-1])))
+            if len(starts) == 1:
+                encodings[column] = Encoding.CONSTANT.value
+                constants[column] = series[0]
+                continue
+            # Bytes taken by each candidate encoding
+            sizes = {Encoding.RUNS: 16 * len(starts)}
+            candidates = {Encoding.XOR: (-1, cls.xor_blocks(series))}
+            count = decimals(series)
+            if count is not None:
+                candidates[Encoding.DELTA] = (count, cls.delta_blocks(series, count))
+            for encoding, (_, coded) in candidates.items():
+                sizes[encoding] = sum(
+                    BLOCK_HEADER + len(data) for _, _, _, data in coded
+                )
+            encoding = min(sizes, key=sizes.get)
+            encodings[column] = encoding.value
+            if encoding == Encoding.RUNS:
+                run_keys.append(column * rows + starts)
+                run_values.append(series[starts])
+            else:
+                encoded.append(candidates[encoding])
+
+        payload = bytearray()
+        shape = (len(encoded), -(-rows // BLOCK_ROWS))
+        block_offsets = np.zeros(shape, dtype=np.int64)
+        block_widths = np.zeros(shape, dtype=np.uint8)
+        block_shifts = np.zeros(shape, dtype=np.uint8)
+        block_firsts = np.zeros(shape)
+        for position, (_, coded) in enumerate(encoded):
+            for block, (width, shift, first, data) in enumerate(coded):
+                block_offsets[position, block] = len(payload)
+                block_widths[position, block] = width
+                block_shifts[position, block] = shift
+                block_firsts[position, block] = first
+                payload += data
+        return cls(
+            rows=rows,
+            encodings=encodings,
+            constants=constants,
+            run_keys=np.concatenate(run_keys or [np.empty(0, dtype=np.int64)]),
+            run_values=np.concatenate(run_values or [np.empty(0)]),
+            decimals=np.array([count for count, _ in encoded], dtype=np.int8),
+            block_offsets=block_offsets,
+            block_widths=block_widths,
+            block_shifts=block_shifts,
+            block_firsts=block_firsts,
+            payload=np.frombuffer(bytes(payload), dtype=np.uint8),
+        )
+
+    @staticmethod
+    def delta_blocks(
+        series: np.ndarray, count: int
+    ) -> List[Tuple[int, int, float, bytes]]:
+        coded = []
+        for block in blocks(np.round(series * 10.0**count).astype(np.int64)):
+            width, data = delta_block(block)
+            coded.append((width, 0, float(block[0]), data))
+        return coded
+
+    @staticmethod
+    def xor_blocks(series: np.ndarray) -> List[Tuple[int, int, float, bytes]]:
+        coded = []
+        for block in blocks(series):
+            width, shift, data = xor_block(block.view(np.uint64).copy())
+            coded.append((width, shift, float(block[0]), data))
+        return coded
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {
+            "encodings": self.encodings,
+            "constants": self.constants,
+            "run_keys": self.run_keys,
+            "run_values": self.run_values,
+            "decimals": self.decimals,
+            "block_offsets": self.block_offsets,
+            "block_widths": self.block_widths,
+            "block_shifts": self.block_shifts,
+            "block_firsts": self.block_firsts,
+            "payload": self.payload,
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in self.arrays().values())
+
+    def counts(self) -> Dict[str, int]:
+        """Number of columns in each encoding"""
+        return {
+            str(encoding): int((self.encodings == encoding.value).sum())
+            for encoding in Encoding
+        }
+
+    def decode_column(self, position: int, block: int, rows: int) -> np.ndarray:
+        """Rows of a block of the `position`th delta or xor column"""
+        width = int(self.block_widths[position, block])
+        offset = int(self.block_offsets[position, block])
+        first = self.block_firsts[position, block]
+        count = int(self.decimals[position])
+        if count >= 0:
+            ints = np.full(rows, int(first), dtype=np.int64)
+            if width:
+                deltas = np.frombuffer(
+                    self.payload, SIGNED[width], rows - 1, offset
+                ).astype(np.int64)
+                ints[1:] += np.cumsum(deltas)
+            return ints / 10.0**count
+        bits = np.full(rows, np.float64(first).view(np.uint64))
+        if width:
+            xors = np.frombuffer(self.payload, UNSIGNED[width], rows - 1, offset)
+            xors = xors.astype(np.uint64) << np.uint64(
+                self.block_shifts[position, block]
+            )
+            bits[1:] ^= np.bitwise_xor.accumulate(xors)
+        return bits.view(np.float64)
+
+    def block(self, block: int) -> np.ndarray:
+        """Decoded rows of a block for every delta and xor column"""
+        cached = self._cache.get(block)
+        if cached is not None:
+            self._cache.move_to_end(block)
+            return cached
+        rows = min(BLOCK_ROWS, self.rows - block * BLOCK_ROWS)
+        decoded = np.empty((rows, len(self.blocked)))
+        for position in range(len(self.blocked)):
+            decoded[:, position] = self.decode_column(position, block, rows)
+        self._cache[block] = decoded
+        if len(self._cache) > CACHED_BLOCKS:
+            self._cache.popitem(last=False)
+        return decoded
+
+    def at(self, index: int) -> np.ndarray:
+        """Values of every column in row `index`"""
+        row = self.constants.copy()
+        if len(self.runs):
+            keys = self.runs * self.rows + index
+            row[self.runs] = self.run_values[
+                np.searchsorted(self.run_keys, keys, side="right") - 1
+            ]
+        if len(self.blocked):
+            block, offset = divmod(index, BLOCK_ROWS)
+            row[self.blocked] = self.block(block)[offset]
+        return row
+
+    def decode(self) -> np.ndarray:
+        """Every value, one row per row of the file"""
+        values = np.tile(self.constants, (self.rows, 1))
+        for column in self.runs:
+            keys = column * self.rows + np.arange(self.rows)
+            values[:, column] = self.run_values[
+                np.searchsorted(self.run_keys, keys, side="right") - 1
+            ]
+        for block in range(self.block_offsets.shape[1]):
+            start = block * BLOCK_ROWS
+            rows = min(BLOCK_ROWS, self.rows - start)
+            for position, column in enumerate(self.blocked):
+                values[start : start + rows, column] = self.decode_column(
+                    position, block, rows
+                )
+        return values
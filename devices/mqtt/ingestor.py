@@ -1,41 +1,313 @@
 import json
+import math
+import os
+import threading
 import time
-from queue import Empty, Queue
+from queue import Empty, Full, Queue
+from typing import NamedTuple, Optional
 
-from log import logger
+from aliases import TOPIC_ALIASES, TopicAliases
+from lanes import LaneQueue
+from log import get_logger, logger
+from metrics import Metrics
+from paho.mqtt.client import (
+    MQTT_ERR_SUCCESS,
+    MQTTMessageInfo,
+    MQTTv5,
+    MQTTv311,
+)
 from paho.mqtt.client import Client as MQTTClient
+from profiling import spans
+from ratelimit import TokenBucket
+from spool import Spool
+
+# Messages sent from the spool before looking at the queue again
+DRAIN_BATCH = 100
+# Seconds between the summary lines of what was published
+SUMMARY_INTERVAL = 60
+# Seconds given on a stop to publish the messages still queued
+DRAIN_TIMEOUT = 10
+# Put in the queue to wake the ingestor up when it is stopped
+STOP = None
+
+messages = get_logger("messages")
+
+
+class Delivery(NamedTuple):
+    """How messages reach the broker, shared by every ingestor of a run"""
+
+    qos: int = 0
+    inflight: int = 20
+    # Directory of the on-disk spool, None to drop messages while disconnected
+    spool_path: Optional[str] = None
+    spool_max_bytes: int = 256 * 1024**2
+    # Messages per second sent from the spool after a reconnect
+    drain_rate: Optional[float] = None
+    # MQTT v5 with up to `topic_aliases` topics sent by alias
+    mqtt_v5: bool = False
+    topic_aliases: int = TOPIC_ALIASES
+    # The broker keeps the last message of every topic for new subscribers
+    retain: bool = False
+
+    def options(self, name: str = "") -> dict:
+        """Ingestor arguments, `name` separates the spools of each process"""
+        spool = None
+        if self.spool_path:
+            path = os.path.join(self.spool_path, name) if name else self.spool_path
+            spool = Spool(path, max_bytes=self.spool_max_bytes)
+        return dict(
+            qos=self.qos,
+            inflight=self.inflight,
+            spool=spool,
+            drain_limiter=TokenBucket(self.drain_rate) if self.drain_rate else None,
+            protocol=MQTTv5 if self.mqtt_v5 else MQTTv311,
+            topic_aliases=self.topic_aliases,
+            retain=self.retain,
+        )
 
 
 class Ingestor:
-    def __init__(self, queue: Queue, host="0.0.0.0", port=1883) -> None:
-        self.client = MQTTClient()
+    def __init__(
+        self,
+        queue: Queue,
+        host="0.0.0.0",
+        port=1883,
+        metrics: Optional[Metrics] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        spool: Optional[Spool] = None,
+        drain_limiter: Optional[TokenBucket] = None,
+        qos: int = 0,
+        inflight: int = 20,
+        protocol: int = MQTTv311,
+        topic_aliases: int = TOPIC_ALIASES,
+        retain: bool = False,
+    ) -> None:
+        self.client = MQTTClient(protocol=protocol)
         self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_publish = self.on_publish
         self.host, self.port = host, port
         self.queue = queue
-        self._stop_flag = False
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.rate_limiter = rate_limiter
+        self.spool = spool
+        self.drain_limiter = drain_limiter
+        self.qos = qos
+        self.retain = retain
+        # QoS 1 messages waiting for their PUBACK
+        self.client.max_inflight_messages_set(inflight)
+        self._window = threading.BoundedSemaphore(inflight)
+        # Messages sent again after a reconnect keep the alias they were sent
+        # with, which the new connection does not know, so only QoS 0 uses them
+        self.aliases: Optional[TopicAliases] = None
+        if protocol == MQTTv5 and topic_aliases and not qos:
+            self.aliases = TopicAliases(topic_aliases)
+        elif protocol == MQTTv5 and topic_aliases:
+            logger.warning("Topic aliases are only used with QoS 0")
+        # Aliases allowed by the broker on a new connection, until the
+        # publishing thread resets the table
+        self._alias_limit: Optional[int] = None
+        self._connected = threading.Event()
+        self._stopping = threading.Event()
+        # Until when the queue is still published once stopping
+        self._deadline = math.inf
+        self._summary = (time.monotonic(), self.metrics.snapshot())
 
     def start(self):
         logger.info("Starting ingestor..")
-        self.client.connect(self.host, self.port)
+        if self.spool is not None:
+            # Keep spooling until the broker is reachable
+            self.client.connect_async(self.host, self.port)
+        else:
+            self.client.connect(self.host, self.port)
         self.client.loop_start()
-        while not self._stop_flag:
+        while not self.finished():
+            if time.monotonic() - self._summary[0] >= SUMMARY_INTERVAL:
+                self.summary()
+            if self.draining():
+                self.drain()
             try:
-                data = self.queue.get(block=False)
+                data = self.queue.get(timeout=0 if self.draining() else 5)
             except Empty:
-                time.sleep(5)
+                if self.spool is not None:
+                    self.spool.sync()
+                continue
+            if data is STOP:
+                self.queue.task_done()
                 continue
             topic = json.loads(data).pop("topic")
-            self.send(data, topic)
+            if self.spool is not None and (self.spool or not self.connected()):
+                # Behind older messages, keep the order
+                self.to_spool(data)
+            else:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                self.send(data, topic)
+            self.queue.task_done()
+        self.shutdown()
+
+    def stop(self, timeout: Optional[float] = DRAIN_TIMEOUT) -> None:
+        """Publishes what is queued for at most `timeout` seconds, or all of it
+        with None, then disconnects. Stopping again can only shorten the time
+        left."""
+        if not self._stopping.is_set():
+            logger.info("Stopping ingestor..")
+        if timeout is not None:
+            self._deadline = min(self._deadline, time.monotonic() + timeout)
+        self._stopping.set()
+        try:
+            self.queue.put_nowait(STOP)
+        except Full:
+            # Not waiting for messages then
+            pass
+
+    def finished(self) -> bool:
+        if not self._stopping.is_set():
+            return False
+        return self.queue.empty() or time.monotonic() >= self._deadline
 
-    def stop(self):
-        logger.info("Stopping ingestor..")
-        self._stop_flag = True
+    def shutdown(self) -> None:
+        """Spools what is still queued, or drops it without a spool, and
+        disconnects once the client has written every publish"""
+        dropped = 0
+        while True:
+            try:
+                data = self.queue.get_nowait()
+            except Empty:
+                break
+            if data is not STOP:
+                if self.spool is not None:
+                    self.to_spool(data)
+                else:
+                    dropped += 1
+            self.queue.task_done()
+        if dropped:
+            self.metrics.incr("dropped", dropped)
+            logger.warning(f"Dropped {dropped} queued messages on stop")
+        if self.spool is not None:
+            self.spool.close()
+        # The disconnect is sent after the publishes still in the client
+        self.client.disconnect()
         self.client.loop_stop()
+        self.summary()
+
+    def connected(self) -> bool:
+        return self._connected.is_set()
 
-    def send(self, data, topic):
-        logger.info(f"Ingesting {data} {topic}")
-        self.client.publish(topic, data)
+    def draining(self) -> bool:
+        return (
+            self.spool is not None
+            and bool(self.spool)
+            and self.connected()
+            and not self._stopping.is_set()
+        )
 
-    @staticmethod
-    def on_connect(client, userdata, flags, rc):
+    def summary(self) -> None:
+        now, snapshot = time.monotonic(), self.metrics.snapshot()
+        since, last = self._summary
+        self._summary = (now, snapshot)
+
+        def delta(name: str) -> int:
+            return snapshot.get(name, 0) - last.get(name, 0)
+
+        logger.info(
+            f"Published {delta('published')} messages "
+            f"({delta('published_bytes')} bytes) in {now - since:.0f} s, "
+            f"{delta('publish_errors')} errors, {self.queue.qsize()} queued"
+            + (f", {self.spool.size} bytes spooled" if self.spool else "")
+        )
+        if isinstance(self.queue, LaneQueue):
+            lanes = self.queue.summary()
+            if lanes:
+                logger.info(f"Queue waits by lane: {lanes}")
+
+    def send(self, data, topic) -> bool:
+        with spans("send"):
+            messages.debug("Ingesting %s %s", data, topic)
+            if self.qos and not self.acquire_window():
+                self.metrics.incr("publish_errors")
+                if self.spool is not None:
+                    self.to_spool(data)
+                return False
+            result = self.publish(topic, data)
+            # QoS 1 messages are kept by the client and sent again on reconnect
+            if result.rc == MQTT_ERR_SUCCESS or self.qos:
+                self.metrics.incr("published")
+                self.metrics.incr("published_bytes", len(data))
+                return True
+            self.metrics.incr("publish_errors")
+            if self.spool is not None:
+                self.to_spool(data)
+            return False
+
+    def publish(self, topic: str, data: str) -> MQTTMessageInfo:
+        if self.aliases is None:
+            return self.client.publish(topic, data, qos=self.qos, retain=self.retain)
+        limit, self._alias_limit = self._alias_limit, None
+        if limit is not None:
+            self.aliases.reset(limit)
+        sent, properties = self.aliases.lookup(topic)
+        result = self.client.publish(
+            sent, data, qos=self.qos, retain=self.retain, properties=properties
+        )
+        if result.rc != MQTT_ERR_SUCCESS:
+            self.aliases.forget(topic)
+        elif not sent:
+            self.metrics.incr("aliased")
+        return result
+
+    def acquire_window(self) -> bool:
+        """Waits for a free in-flight slot while connected"""
+        while time.monotonic() < self._deadline:
+            if self._window.acquire(timeout=1):
+                return True
+            if not self.connected():
+                return False
+        return False
+
+    def to_spool(self, data) -> None:
+        evicted = self.spool.append(data)
+        self.metrics.incr("spooled")
+        if evicted:
+            self.metrics.incr("spool_evicted", evicted)
+
+    def drain(self) -> None:
+        """Sends the oldest spooled messages, at most `DRAIN_BATCH`"""
+        for _ in range(DRAIN_BATCH):
+            data = self.spool.peek()
+            # What is spooled stays there over a restart
+            if data is None or not self.connected() or self._stopping.is_set():
+                return
+            if self.drain_limiter is not None:
+                self.drain_limiter.acquire()
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            if self.qos and not self.acquire_window():
+                return
+            result = self.publish(json.loads(data)["topic"], data)
+            if result.rc != MQTT_ERR_SUCCESS and not self.qos:
+                return
+            self.spool.commit()
+            self.metrics.incr("spool_drained")
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
         logger.info(f"Connected to server with resulted code {str(rc)}")
+        if rc == 0:
+            if self.aliases is not None:
+                # Brokers that do not say it take no aliases
+                limit = getattr(properties, "TopicAliasMaximum", 0)
+                logger.info(f"The broker takes {limit} topic aliases")
+                self._alias_limit = limit
+            self._connected.set()
+
+    def on_disconnect(self, client, userdata, rc, properties=None):
+        logger.warning(f"Disconnected from server with code {rc}")
+        self._connected.clear()
+
+    def on_publish(self, client, userdata, mid):
+        if self.qos:
+            try:
+                self._window.release()
+            except ValueError:
+                # Acknowledgements of messages sent again after a reconnect
+                pass
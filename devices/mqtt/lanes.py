@@ -0,0 +1,183 @@
+import bisect
+import time
+from collections import deque
+from queue import Queue
+from typing import Deque, List, NamedTuple, Optional, Tuple
+
+from metrics import Metrics
+
+# Attributes sent first by default, a breaker trip should not wait behind
+# the measurements of a whole grid
+STATUS_ATTRIBUTES = ("switch_status", "contingency")
+# Upper bounds in seconds of the buckets of the time messages wait in a lane
+WAIT_BOUNDS = (
+    0.001,
+    0.002,
+    0.005,
+    0.01,
+    0.02,
+    0.05,
+    0.1,
+    0.2,
+    0.5,
+    1,
+    2,
+    5,
+    10,
+    30,
+    60,
+)
+
+
+class Lanes(NamedTuple):
+    """Attributes of each priority lane, by name or prefix. The first lane
+    goes first and every other attribute goes in a last lane of its own.
+
+    Without `weights` a lane is only read when the lanes before it are
+    empty, with them lanes share the publishing in proportion to their
+    weight while they have messages.
+    """
+
+    attributes: Tuple[Tuple[str, ...], ...] = (STATUS_ATTRIBUTES,)
+    weights: Tuple[int, ...] = ()
+
+    @classmethod
+    def parse(cls, spec: str, weights: str = "") -> Optional["Lanes"]:
+        """Lanes like `switch_status,contingency;active_power` with weights
+        like `8,2,1`, None without lanes"""
+        attributes = tuple(
+            tuple(name.strip() for name in lane.split(",") if name.strip())
+            for lane in spec.split(";")
+            if lane.strip()
+        )
+        if not attributes:
+            return None
+        lanes = cls(
+            attributes,
+            tuple(int(weight) for weight in weights.split(",") if weight.strip()),
+        )
+        if lanes.weights and len(lanes.weights) != lanes.count:
+            raise ValueError(
+                f"{len(lanes.weights)} lane weights given for {lanes.count} lanes"
+            )
+        if any(weight <= 0 for weight in lanes.weights):
+            raise ValueError("Lane weights must be positive")
+        return lanes
+
+    @property
+    def count(self) -> int:
+        return len(self.attributes) + 1
+
+    def lane(self, topic: str) -> int:
+        """Lane of the messages of a trace"""
+        attribute = topic.rsplit("/", 1)[-1]
+        for lane, names in enumerate(self.attributes):
+            if attribute.startswith(names):
+                return lane
+        return len(self.attributes)
+
+
+class LaneQueue(Queue):
+    """Queue with a FIFO lane per priority.
+
+    Items are put as `(lane, data)` and got as `data`, anything else goes
+    in the first lane, like the sentinel that stops the ingestor. The time
+    every message waited is counted per lane, and added to `metrics` by
+    `summary`. `maxsize` bounds all the lanes together.
+    """
+
+    def __init__(
+        self, lanes: Lanes, maxsize: int = 0, metrics: Optional[Metrics] = None
+    ) -> None:
+        self.lanes = lanes
+        self.metrics = metrics if metrics is not None else Metrics()
+        super().__init__(maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        count = self.lanes.count
+        self._lanes: List[Deque[Tuple[Optional[float], object]]] = [
+            deque() for _ in range(count)
+        ]
+        self._size = 0
+        # Smooth weighted round robin, the lane with the most credit goes next
+        self._credits = [0] * count
+        # Waits of every lane since the last summary
+        self._waits = [[0] * (len(WAIT_BOUNDS) + 1) for _ in range(count)]
+        self._longest = [0.0] * count
+        self._total = [0.0] * count
+
+    def _qsize(self) -> int:
+        return self._size
+
+    def _put(self, item) -> None:
+        if isinstance(item, tuple):
+            lane, data = item
+            self._lanes[lane].append((time.monotonic(), data))
+        else:
+            # Not a message, its wait is not counted
+            self._lanes[0].append((None, item))
+        self._size += 1
+
+    def _get(self):
+        lane = self._next_lane()
+        queued, data = self._lanes[lane].popleft()
+        self._size -= 1
+        if queued is None:
+            return data
+        wait = time.monotonic() - queued
+        self._waits[lane][bisect.bisect_left(WAIT_BOUNDS, wait)] += 1
+        if wait > self._longest[lane]:
+            self._longest[lane] = wait
+        self._total[lane] += wait
+        return data
+
+    def _next_lane(self) -> int:
+        if not self.lanes.weights:
+            for lane, queued in enumerate(self._lanes):
+                if queued:
+                    return lane
+        waiting = [lane for lane, queued in enumerate(self._lanes) if queued]
+        for lane in waiting:
+            self._credits[lane] += self.lanes.weights[lane]
+        chosen = max(waiting, key=self._credits.__getitem__)
+        self._credits[chosen] -= sum(self.lanes.weights[lane] for lane in waiting)
+        return chosen
+
+    def summary(self) -> str:
+        """Messages and waits of every lane since the last summary"""
+        with self.mutex:
+            parts = []
+            for lane, buckets in enumerate(self._waits):
+                count = sum(buckets)
+                if not count:
+                    continue
+                self.metrics.incr(f"lane{lane}_dequeued", count)
+                self.metrics.incr(f"lane{lane}_wait_us", int(self._total[lane] * 1e6))
+                # Upper bound of the bucket of the 99th percentile
+                position, seen = 0, buckets[0]
+                while seen < 0.99 * count:
+                    position += 1
+                    seen += buckets[position]
+                bound = (
+                    f"under {WAIT_BOUNDS[position] * 1000:g} ms"
+                    if position < len(WAIT_BOUNDS)
+                    else f"over {WAIT_BOUNDS[-1]} s"
+                )
+                parts.append(
+                    f"lane {lane}: {count} messages, waited "
+                    f"{self._total[lane] / count * 1000:.1f} ms on average, "
+                    f"p99 {bound}, max {self._longest[lane] * 1000:.1f} ms"
+                )
+            self._waits = [[0] * len(buckets) for buckets in self._waits]
+            self._longest = [0.0] * len(self._longest)
+            self._total = [0.0] * len(self._total)
+        return "; ".join(parts)
+
+
+def make_queue(
+    lanes: Optional[Lanes], maxsize: int = 0, metrics: Optional[Metrics] = None
+) -> Queue:
+    """Queue between the scheduler and the ingestor, a plain FIFO without lanes"""
+    if lanes is None:
+        return Queue(maxsize)
+    return LaneQueue(lanes, maxsize, metrics)
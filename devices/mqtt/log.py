@@ -1,14 +1,125 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sys
+import threading
+from typing import Dict, Optional
+
+from ratelimit import TokenBucket
 
 formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
 
 handler = logging.StreamHandler(sys.stdout)
 handler.setFormatter(formatter)
 
+# Records waiting for the writer thread, dropped when it can not keep up
+QUEUE_SIZE = 10000
+# Records per second of each category when LOG_RATE does not set it
+DEFAULT_RATE = 10.0
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the writer thread without ever blocking the caller"""
+
+    def __init__(self, records: queue.Queue) -> None:
+        super().__init__(records)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class CategoryFilter(logging.Filter):
+    """Keeps one in `every` records of a category, at most `rate` a second.
+
+    The next record let through tells how many were dropped since the last
+    one.
+    """
+
+    def __init__(self, every: int = 1, rate: Optional[float] = None) -> None:
+        super().__init__()
+        self.every = max(every, 1)
+        self.bucket = TokenBucket(rate) if rate else None
+        self.count = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        with self._lock:
+            self.count += 1
+            if self.count % self.every:
+                return False
+            if self.bucket is not None and not self.bucket.try_acquire():
+                self.dropped += 1
+                return False
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            record.msg = f"{record.getMessage()} ({dropped} more dropped)"
+            record.args = None
+        return True
+
+
+def parse_settings(value: Optional[str]) -> Dict[str, float]:
+    """`category=number` pairs separated by commas"""
+    settings = {}
+    for item in (value or "").split(","):
+        if item.strip():
+            name, number = item.split("=")
+            settings[name.strip()] = float(number)
+    return settings
+
+
+# Fraction of the records of a category that are kept, e.g. messages=0.01
+SAMPLES = parse_settings(os.getenv("LOG_SAMPLE"))
+# Records per second of a category, 0 for no limit, e.g. no_data=1
+RATES = parse_settings(os.getenv("LOG_RATE"))
+
+_records: queue.Queue = queue.Queue(QUEUE_SIZE)
+queue_handler = DroppingQueueHandler(_records)
+listener = logging.handlers.QueueListener(_records, handler)
+
+
+def _start_listener() -> None:
+    global listener
+    # A forked process does not have the writer thread of its parent
+    queue_handler.queue = queue.Queue(QUEUE_SIZE)
+    listener = logging.handlers.QueueListener(queue_handler.queue, handler)
+    listener.start()
+
+
+def flush() -> None:
+    """Writes every pending record, stopping the writer thread"""
+    listener.stop()
+
+
+listener.start()
+atexit.register(flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_start_listener)
+
 logger = logging.getLogger()
 logger.setLevel(os.getenv("LOG_LEVEL", logging.INFO))
-logger.addHandler(handler)
+logger.addHandler(queue_handler)
+
+
+def get_logger(category: str) -> logging.Logger:
+    """Logger of a hot path category, sampled with LOG_SAMPLE and rate limited
+    with LOG_RATE"""
+    category_logger = logging.getLogger(category)
+    if not category_logger.filters:
+        sample = SAMPLES.get(category, 1.0)
+        category_logger.addFilter(
+            CategoryFilter(
+                every=round(1 / sample) if sample else sys.maxsize,
+                rate=RATES.get(category, DEFAULT_RATE),
+            )
+        )
+    return category_logger
+
 
 logger.debug("Logger initialized")
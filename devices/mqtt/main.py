@@ -1,28 +1,171 @@
-import queue
+import os
+import signal
 import threading
+from datetime import datetime, timezone
 
-from ingestor import Ingestor
+from aliases import TOPIC_ALIASES
+from bundle import SharedTraceStore
+from clock import Clock, VirtualClock
+from control import ControlServer
+from ingestor import Delivery, Ingestor
+from lanes import STATUS_ATTRIBUTES, Lanes, make_queue
 from log import logger
-from scheduler import Scheduler
+from metrics import Metrics
+from profiling import PROFILE_DIR, Profiling
+from ratelimit import TokenBucket
+from scenario import Scenario
+from scheduler import GroupBy, Scheduler
+from shutdown import stop, stop_on_sigterm, wait
+from supervisor import ShardBy, Supervisor
 
-if __name__ == "__main__":
-    logger.info("Starting..")
-    shared_queue = queue.Queue()
+WORKERS = int(os.getenv("WORKERS", "1"))
+SHARD_BY = ShardBy(os.getenv("SHARD_BY", "grid"))
+# Send every attribute of an asset, or every asset of a grid, in one message
+GROUP_BY = GroupBy(os.getenv("GROUP_BY", "trace"))
+# Number the messages of every topic and stamp them for the verifier
+STAMP_MESSAGES = bool(os.getenv("STAMP_MESSAGES"))
+# Replay a time range instead of following the real time, REPLAY_SPEED is the
+# speed-up over real time, 0 goes as fast as the publish rate allows
+REPLAY_START = os.getenv("REPLAY_START")
+REPLAY_END = os.getenv("REPLAY_END")
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", "0"))
+# Messages per second sent to the broker, 0 for no limit
+PUBLISH_RATE = float(os.getenv("PUBLISH_RATE", "0"))
+# Makes the noise added to the traces reproducible
+NOISE_SEED = int(os.environ["NOISE_SEED"]) if os.getenv("NOISE_SEED") else None
+QUEUE_SIZE = int(os.getenv("QUEUE_SIZE", "10000" if REPLAY_START else "0"))
+# Bundle of trace files published by the supervisor, or attached to when it
+# already exists, so several devices share a single copy of the traces
+SHARED_STORE = os.getenv("SHARED_STORE")
+# Messages are spooled to SPOOL_PATH while the broker is unreachable and sent
+# at SPOOL_DRAIN_RATE messages per second once it is back, MQTT_VERSION=5
+# sends up to MQTT_TOPIC_ALIASES topics by alias, MQTT_RETAIN=1 has the broker
+# keep the last message of every topic for the clients that subscribe later
+DELIVERY = Delivery(
+    qos=int(os.getenv("MQTT_QOS", "0")),
+    inflight=int(os.getenv("MQTT_INFLIGHT", "20")),
+    spool_path=os.getenv("SPOOL_PATH"),
+    spool_max_bytes=int(os.getenv("SPOOL_MAX_MB", "256")) * 1024**2,
+    drain_rate=float(os.getenv("SPOOL_DRAIN_RATE", "500")),
+    mqtt_v5=os.getenv("MQTT_VERSION", "3.1.1") == "5",
+    topic_aliases=int(os.getenv("MQTT_TOPIC_ALIASES", str(TOPIC_ALIASES))),
+    retain=bool(os.getenv("MQTT_RETAIN")),
+)
+# SIGUSR1 writes a profile of PROFILE_SECONDS to PROFILE_DIR, CONTROL_PORT
+# serves /profile, /spans and the last values at /snapshot on localhost,
+# PROFILE_SPANS times spans all along
+PROFILING = Profiling(
+    directory=os.getenv("PROFILE_DIR", PROFILE_DIR),
+    seconds=float(os.getenv("PROFILE_SECONDS", "30")),
+    spans_enabled=bool(os.getenv("PROFILE_SPANS")),
+)
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", "0"))
+# Json file of events overlaid on the traces, read again when it changes
+SCENARIO = os.getenv("SCENARIO")
+# Seconds given on SIGTERM or SIGINT to publish what is queued, what is left
+# goes to the spool or is dropped
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "10"))
+# Attributes published ahead of the others, lanes separated by ";", strictly
+# by priority or in proportion to LANE_WEIGHTS (one per lane and one for the
+# rest), an empty PRIORITY_LANES keeps a single FIFO
+LANES = Lanes.parse(
+    os.getenv("PRIORITY_LANES", ",".join(STATUS_ATTRIBUTES)),
+    os.getenv("LANE_WEIGHTS", ""),
+)
 
-    scheduler = Scheduler(shared_queue)
-    ingestor = Ingestor(shared_queue)
 
-    scheduler_thread = threading.Thread(target=scheduler.start)
-    ingestor_thread = threading.Thread(target=ingestor.start)
+def get_clock() -> Clock:
+    if not REPLAY_START:
+        return Clock()
+    start = datetime.fromisoformat(REPLAY_START)
+    # Naive replay times are UTC, like the naive timestamps of the trace files
+    now = datetime.now(timezone.utc)
+    if REPLAY_END:
+        end = datetime.fromisoformat(REPLAY_END)
+    else:
+        end = now if start.tzinfo is not None else now.replace(tzinfo=None)
+    clock = VirtualClock(start, end, speed=REPLAY_SPEED)
+    logger.info(
+        f"Replaying {len(clock)} ticks from {clock.start} to {clock.end} "
+        f"at {f'{REPLAY_SPEED}x' if clock.speed else 'full speed'}"
+    )
+    return clock
 
-    try:
-        scheduler_thread.start()
-        ingestor_thread.start()
-        scheduler_thread.join()
-        ingestor_thread.join()
 
+def run():
+    stopping = threading.Event()
+    metrics = Metrics()
+    shared_queue = make_queue(LANES, QUEUE_SIZE, metrics)
+
+    scheduler = Scheduler(
+        shared_queue,
+        store=SharedTraceStore.attach(SHARED_STORE),
+        metrics=metrics,
+        clock=get_clock(),
+        seed=NOISE_SEED,
+        scenario=Scenario(SCENARIO) if SCENARIO else None,
+        group_by=GROUP_BY,
+        stamp=STAMP_MESSAGES,
+        lanes=LANES,
+    )
+    ingestor = Ingestor(
+        shared_queue,
+        metrics=metrics,
+        rate_limiter=TokenBucket(PUBLISH_RATE) if PUBLISH_RATE else None,
+        **DELIVERY.options(),
+    )
+
+    scheduler_thread = threading.Thread(target=scheduler.start, name="scheduler")
+    ingestor_thread = threading.Thread(target=ingestor.start, name="ingestor")
+
+    profiler = PROFILING.install()
+    if CONTROL_PORT:
+        control = ControlServer(CONTROL_PORT)
+        routes = {**PROFILING.routes(profiler), **scheduler.last_values.routes()}
+        for path, handler in routes.items():
+            control.route(path, handler)
+        control.start()
+
+    scheduler_thread.start()
+    ingestor_thread.start()
+    wait(scheduler_thread, stopping)
+    stop(
+        scheduler, scheduler_thread, ingestor, ingestor_thread, stopping, DRAIN_TIMEOUT
+    )
+    logger.info(f"Final metrics: {Metrics.format(metrics.snapshot())}")
+
+
+def run_supervisor():
+    supervisor = Supervisor(
+        WORKERS,
+        shard_by=SHARD_BY,
+        clock=get_clock(),
+        rate=PUBLISH_RATE,
+        queue_size=QUEUE_SIZE,
+        seed=NOISE_SEED,
+        delivery=DELIVERY,
+        bundle_path=SHARED_STORE,
+        profiling=PROFILING,
+        scenario=SCENARIO,
+        group_by=GROUP_BY,
+        stamp=STAMP_MESSAGES,
+        drain_timeout=DRAIN_TIMEOUT,
+        lanes=LANES,
+    )
+    # Each worker writes its own profile
+    signal.signal(signal.SIGUSR1, lambda signum, _: supervisor.forward(signum))
+    try:
+        supervisor.start()
     except KeyboardInterrupt:
-        scheduler.stop()
-        ingestor.stop()
-        scheduler_thread.join()
-        ingestor_thread.join()
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    logger.info("Starting..")
+    stop_on_sigterm()
+    if WORKERS > 1:
+        run_supervisor()
+    else:
+        run()
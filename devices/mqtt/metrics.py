@@ -0,0 +1,30 @@
+import threading
+from collections import Counter
+from typing import Dict
+
+
+class Metrics:
+    """Thread safe counters shared by the scheduler and the ingestor."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Counter = Counter()
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._counters)
+
+    @staticmethod
+    def merge(*snapshots: Dict[str, int]) -> Dict[str, int]:
+        total: Counter = Counter()
+        for snapshot in snapshots:
+            total.update(snapshot)
+        return dict(total)
+
+    @staticmethod
+    def format(snapshot: Dict[str, int]) -> str:
+        return " ".join(f"{key}={value}" for key, value in sorted(snapshot.items()))
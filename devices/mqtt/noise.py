@@ -0,0 +1,144 @@
+import math
+import zlib
+from enum import Enum
+from typing import Dict, Optional
+
+import numpy as np
+
+BLOCK_SIZE = 4096
+# Rounds of drawing again the bounded samples that fell outside the bound,
+# those still outside are drawn uniformly within it
+MAX_RESAMPLES = 20
+
+
+class NoiseModel(Enum):
+    # Independent gaussian samples
+    WHITE = "white"
+    # Gaussian samples correlated with the previous one, x = phi * x + e
+    AR1 = "ar1"
+    # Gaussian samples truncated to [-bound, bound]
+    BOUNDED = "bounded"
+
+    def __str__(self):
+        return self.value
+
+
+class NoiseBuffer:
+    """Noise of a single trace, generated in blocks from a seeded generator.
+
+    `scale` is the standard deviation of the noise, for AR(1) noise too, where
+    `correlation` is the weight of the previous sample.
+    """
+
+    def __init__(
+        self,
+        scale: float,
+        model: NoiseModel = NoiseModel.WHITE,
+        seed: Optional[int] = None,
+        correlation: float = 0.9,
+        bound: Optional[float] = None,
+        block_size: int = BLOCK_SIZE,
+    ) -> None:
+        if model == NoiseModel.AR1 and not 0 <= correlation < 1:
+            raise ValueError(f"AR(1) correlation must be in [0, 1), got {correlation}")
+        if bound is not None and bound <= 0:
+            raise ValueError(f"Noise bound must be positive, got {bound}")
+        self.scale = scale
+        self.model = model
+        self.correlation = correlation
+        self.bound = bound if bound is not None else 3 * scale
+        self.block_size = block_size
+        self._rng = np.random.default_rng(seed)
+        self._buffer = np.empty(0)
+        self._index = 0
+        self._last = 0.0
+
+    def next(self) -> float:
+        if self._index >= len(self._buffer):
+            self._buffer = self._generate(self.block_size)
+            self._index = 0
+        value = self._buffer[self._index]
+        self._index += 1
+        return float(value)
+
+    def _generate(self, size: int) -> np.ndarray:
+        if self.model == NoiseModel.AR1:
+            return self._generate_ar1(size)
+        samples = self._rng.normal(0.0, self.scale, size)
+        if self.model == NoiseModel.BOUNDED:
+            outside = np.abs(samples) > self.bound
+            for _ in range(MAX_RESAMPLES):
+                if not outside.any():
+                    break
+                samples[outside] = self._rng.normal(0.0, self.scale, outside.sum())
+                outside = np.abs(samples) > self.bound
+            # Only left with a bound well within the deviation, where the
+            # truncated gaussian is nearly flat
+            samples[outside] = self._rng.uniform(-self.bound, self.bound, outside.sum())
+        return samples
+
+    def _generate_ar1(self, size: int) -> np.ndarray:
+        phi = self.correlation
+        innovations = self._rng.normal(0.0, self.scale * math.sqrt(1 - phi**2), size)
+        if phi == 0:
+            return innovations
+        # x[t] = phi^t * (x[-1] * phi + sum(e[k] * phi^-k)), solved by chunks
+        # short enough for phi^-k to stay within the float range
+        chunk = min(size, max(1, int(200 / -math.log10(phi))))
+        samples = np.empty(size)
+        for start in range(0, size, chunk):
+            part = innovations[start : start + chunk]
+            powers = phi ** np.arange(len(part))
+            samples[start : start + len(part)] = powers * (
+                self._last * phi + np.cumsum(part / powers)
+            )
+            self._last = samples[start + len(part) - 1]
+        return samples
+
+
+class NoiseEngine:
+    """Noise buffers of every trace of a process.
+
+    Each trace gets its own generator seeded from the engine seed and the
+    trace key, so values do not depend on which other traces share the
+    process or on the order they are drawn.
+    """
+
+    def __init__(self, seed: Optional[int] = None) -> None:
+        self.seed = seed
+        self._buffers: Dict[str, NoiseBuffer] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._buffers
+
+    def trace_seed(self, key: str) -> Optional[int]:
+        if self.seed is None:
+            return None
+        return int(
+            np.random.SeedSequence(
+                [self.seed, zlib.crc32(key.encode())]
+            ).generate_state(1)[0]
+        )
+
+    def register(
+        self,
+        key: str,
+        scale: float,
+        model: NoiseModel = NoiseModel.WHITE,
+        seed: Optional[int] = None,
+        correlation: float = 0.9,
+        bound: Optional[float] = None,
+    ) -> NoiseBuffer:
+        self._buffers[key] = NoiseBuffer(
+            scale,
+            model=model,
+            seed=seed if seed is not None else self.trace_seed(key),
+            correlation=correlation,
+            bound=bound,
+        )
+        return self._buffers[key]
+
+    def next(self, key: str, scale: float) -> float:
+        if key not in self._buffers:
+            self.register(key, scale)
+        return self._buffers[key].next()
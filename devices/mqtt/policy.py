@@ -0,0 +1,57 @@
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+def _as_array(values: Sequence[Optional[float]]) -> np.ndarray:
+    return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+
+class PublishPolicy:
+    """Report by exception, like the deadbands configured in real IEDs.
+
+    Traces with a `deadband` (absolute) or `deadband_percent` (of the last
+    sent value) are only published when they move further than the band from
+    the last value sent. Booleans are only published when they change, with or
+    without a deadband. `max_silence` forces a publish after that many seconds
+    without one, for any trace. Every check runs over all the traces of a tick
+    at once.
+    """
+
+    def __init__(
+        self,
+        deadband: Sequence[Optional[float]],
+        deadband_percent: Sequence[Optional[float]],
+        max_silence: Sequence[Optional[float]],
+        booleans: Sequence[bool],
+    ) -> None:
+        self.deadband = _as_array(deadband)
+        self.deadband_percent = _as_array(deadband_percent)
+        self.max_silence = _as_array(max_silence)
+        self.booleans = np.asarray(booleans, dtype=bool)
+        self.by_exception = (
+            ~np.isnan(self.deadband) | ~np.isnan(self.deadband_percent) | self.booleans
+        )
+        self.last_value = np.full(len(self.deadband), np.nan)
+        self.last_time = np.full(len(self.deadband), -np.inf)
+
+    def __len__(self) -> int:
+        return len(self.deadband)
+
+    def check(self, values: np.ndarray, found: np.ndarray, now: float) -> np.ndarray:
+        """Mask of the traces to publish, remembered as the last sent values"""
+        delta = np.abs(values - self.last_value)
+        band = np.fmax(
+            np.nan_to_num(self.deadband, nan=0.0),
+            np.nan_to_num(self.deadband_percent, nan=0.0)
+            / 100
+            * np.abs(self.last_value),
+        )
+        changed = np.where(self.booleans, delta > 0, delta > band)
+        # Comparisons with NaN are False, so a first value is always sent
+        first = np.isnan(self.last_value)
+        silent = now - self.last_time >= self.max_silence
+        publish = found & (~self.by_exception | first | changed | silent)
+        self.last_value[publish] = values[publish]
+        self.last_time[publish] = now
+        return publish
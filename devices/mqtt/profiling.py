@@ -0,0 +1,223 @@
+import contextlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from log import logger
+
+PROFILE_DIR = "./traces/profiles"
+# Seconds between two samples of the stacks of every thread
+SAMPLE_INTERVAL = 0.005
+
+_DISABLED = contextlib.nullcontext()
+
+
+class _Span:
+    __slots__ = ("spans", "name", "start")
+
+    def __init__(self, spans: "Spans", name: str) -> None:
+        self.spans = spans
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc) -> None:
+        self.spans.record(self.name, time.perf_counter() - self.start)
+
+
+class Spans:
+    """Named timings of the hot path, `with spans("send"): ...`.
+
+    While disabled a span is a shared no-op context, so they can stay in the
+    code. They are enabled during a profile capture.
+    """
+
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[float]] = {}
+
+    def __call__(self, name: str):
+        if not self.enabled:
+            return _DISABLED
+        return _Span(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(name, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def snapshot(self, reset: bool = False) -> Dict[str, dict]:
+        with self._lock:
+            stats = self._stats
+            if reset:
+                self._stats = {}
+        return {
+            name: {
+                "count": count,
+                "total_ms": total * 1000,
+                "mean_us": total / count * 1e6,
+                "max_ms": longest * 1000,
+            }
+            for name, (count, total, longest) in stats.items()
+        }
+
+
+spans = Spans()
+
+
+def stack_of(frame) -> str:
+    """Functions of a stack from the outermost, separated by `;`"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+            f"{code.co_firstlineno})"
+        )
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Captures on demand where the time and the memory of the process go.
+
+    A capture samples the stacks of every thread, takes a tracemalloc
+    snapshot and times the spans for a number of seconds, then writes:
+
+    - `<prefix>.folded`: sampled stacks per thread, in the folded format of
+      flame graph tools.
+    - `<prefix>.tracemalloc`: the snapshot, for `tracemalloc.Snapshot.load`.
+    - `<prefix>.txt`: the busiest functions, the biggest allocations and the
+      spans.
+    """
+
+    def __init__(
+        self, output_dir: str = PROFILE_DIR, interval: float = SAMPLE_INTERVAL
+    ) -> None:
+        self.output_dir = output_dir
+        self.interval = interval
+        self._running = threading.Lock()
+
+    def trigger(self, seconds: float) -> Optional[str]:
+        """Starts a capture in the background, None if one is running"""
+        if not self._running.acquire(blocking=False):
+            logger.warning("A profile is already being captured")
+            return None
+        prefix = os.path.join(
+            self.output_dir,
+            f"profile-{datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}",
+        )
+        threading.Thread(
+            target=self._run, args=(seconds, prefix), name="profiler", daemon=True
+        ).start()
+        return prefix
+
+    def _run(self, seconds: float, prefix: str) -> None:
+        try:
+            self.capture(seconds, prefix)
+        except Exception as e:
+            logger.error(f"Profile failed: {e}")
+        finally:
+            self._running.release()
+
+    def capture(self, seconds: float, prefix: str) -> None:
+        """Captures a profile, blocking for `seconds`"""
+        logger.info(f"Profiling for {seconds} s into {prefix}")
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        enabled = spans.enabled
+        spans.enabled = True
+        spans.snapshot(reset=True)
+        try:
+            stacks = self.sample(seconds)
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            spans.enabled = enabled
+            if not tracing:
+                tracemalloc.stop()
+        self.write(prefix, stacks, snapshot, spans.snapshot(reset=True))
+        logger.info(f"Profile written to {prefix}")
+
+    def sample(self, seconds: float) -> Counter:
+        stacks: Counter = Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    stacks[f"{names.get(ident, ident)};{stack_of(frame)}"] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    def write(
+        self,
+        prefix: str,
+        stacks: Counter,
+        snapshot: tracemalloc.Snapshot,
+        span_stats: Dict[str, dict],
+    ) -> None:
+        os.makedirs(os.path.dirname(prefix) or ".", exist_ok=True)
+        with open(f"{prefix}.folded", "w") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        snapshot.dump(f"{prefix}.tracemalloc")
+
+        own: Counter = Counter()
+        for stack, count in stacks.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        total = sum(stacks.values()) or 1
+        with open(f"{prefix}.txt", "w") as f:
+            f.write("Busiest functions (share of samples)\n")
+            for function, count in own.most_common(25):
+                f.write(f"{count / total:7.1%}  {function}\n")
+            f.write("\nBiggest allocations\n")
+            for stat in snapshot.statistics("lineno")[:25]:
+                f.write(f"{stat}\n")
+            f.write("\nSpans\n")
+            f.write(json.dumps(span_stats, indent=2) + "\n")
+
+
+def install_signal(
+    profiler: Profiler, seconds: float, signum: int = signal.SIGUSR1
+) -> None:
+    """Captures a profile when the process gets `signum`, main thread only"""
+    signal.signal(signum, lambda *_: profiler.trigger(seconds))
+
+
+class Profiling(NamedTuple):
+    directory: str = PROFILE_DIR
+    # Length of a capture, the control endpoint can ask for another one
+    seconds: float = 30
+    # Time the spans all along instead of only during a capture
+    spans_enabled: bool = False
+
+    def install(self) -> Profiler:
+        """Profiles the process on SIGUSR1, call it from the main thread"""
+        profiler = Profiler(self.directory)
+        spans.enabled = self.spans_enabled
+        install_signal(profiler, self.seconds)
+        return profiler
+
+    def routes(self, profiler: Profiler) -> Dict[str, Callable]:
+        """`/profile?seconds=N` starts a capture, `/spans` returns the spans"""
+
+        def profile(query: Dict[str, str]):
+            prefix = profiler.trigger(float(query.get("seconds", self.seconds)))
+            if prefix is None:
+                return 409, {"error": "A profile is already being captured"}
+            return 202, {"profile": prefix}
+
+        return {"/profile": profile, "/spans": lambda query: (200, spans.snapshot())}
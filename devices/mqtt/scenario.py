@@ -0,0 +1,257 @@
+import fnmatch
+import json
+import os
+import re
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional, Sequence, Set, Union
+
+import numpy as np
+from log import logger
+from store import to_timestamp
+
+ACTIONS = ("set", "scale", "trip")
+FIELDS = ("at", "until", "target", "action", "attribute", "value", "ramp")
+# What a trip does to the attributes of the tripped asset, by name or prefix
+TRIPPED = {"switch_status": 0.0, "contingency": 1.0}
+DEENERGIZED = ("active_power", "reactive_power", "current_")
+FOREVER = np.iinfo(np.int64).max
+
+
+class Event(NamedTuple):
+    """A change applied to the traces of `target` from `start` until `end`.
+
+    `target` is a topic, an asset (every topic below it) or a glob pattern.
+    `set` sends `value` instead of the trace, `scale` multiplies the trace by
+    `value` and `trip` opens the switches of the target, raises its
+    contingency and brings its flows to zero. With a `ramp` the trace moves
+    to the new value over that many seconds instead of jumping to it.
+    """
+
+    target: str
+    action: str
+    start: int
+    end: int = FOREVER
+    attribute: Optional[str] = None
+    value: float = 0.0
+    ramp: float = 0.0
+
+
+def parse_time(value: str) -> int:
+    """Nanoseconds of an ISO 8601 time, compared as the device clock"""
+    return to_timestamp(datetime.fromisoformat(value))
+
+
+def parse_event(definition: dict) -> Event:
+    unknown = set(definition) - set(FIELDS)
+    if unknown:
+        raise ValueError(f"unknown fields {', '.join(sorted(unknown))}")
+    action = definition.get("action")
+    if action not in ACTIONS:
+        raise ValueError(f"action must be one of {', '.join(ACTIONS)}, not {action}")
+    if "target" not in definition or "at" not in definition:
+        raise ValueError("an event needs a target and an at time")
+    value = definition.get("value", 1.0 if action == "scale" else 0.0)
+    if action == "trip" and "value" in definition:
+        raise ValueError("a trip has no value")
+    start = parse_time(definition["at"])
+    end = parse_time(definition["until"]) if definition.get("until") else FOREVER
+    if end <= start:
+        raise ValueError(f"until {definition['until']} is not after {definition['at']}")
+    ramp = float(definition.get("ramp", 0))
+    if ramp < 0:
+        raise ValueError("ramp can not be negative")
+    return Event(
+        target=definition["target"],
+        action=action,
+        start=start,
+        end=end,
+        attribute=definition.get("attribute"),
+        value=float(value),
+        ramp=ramp,
+    )
+
+
+def read_scenario(path: str) -> List[Event]:
+    """Events of a scenario file, a json object with a list of `events`"""
+    with open(path) as f:
+        definitions = json.load(f)["events"]
+    events = []
+    for position, definition in enumerate(definitions):
+        try:
+            events.append(parse_event(definition))
+        except ValueError as e:
+            raise ValueError(f"Event {position} of {path}: {e}") from None
+    return events
+
+
+def tripped_value(attribute: str) -> Optional[float]:
+    """Value of an attribute of a tripped asset, None if it is not touched"""
+    for name, value in TRIPPED.items():
+        if attribute.startswith(name):
+            return value
+    if attribute.startswith(DEENERGIZED):
+        return 0.0
+    return None
+
+
+class Layer(NamedTuple):
+    """Entries of an overlay touching each trace at most once"""
+
+    positions: np.ndarray
+    starts: np.ndarray
+    ends: np.ndarray
+    ramps: np.ndarray
+    values: np.ndarray
+    scales: np.ndarray
+
+
+class Overlay:
+    """Events of a scenario resolved against the topics of the traces.
+
+    Each pair of event and trace it touches is an entry of flat arrays, so
+    the events active at a time are applied to all the traces at once, and
+    the arrays of a trace file to all its rows at once. Events apply in the
+    order of the scenario, a trace touched by several events is in as many
+    layers.
+    """
+
+    def __init__(
+        self,
+        events: Sequence[Event],
+        topics: Sequence[str],
+        booleans: Optional[np.ndarray] = None,
+    ) -> None:
+        self.events = list(events)
+        # Targets without any of these topics
+        self.unmatched: Set[str] = set()
+        # Positions of the topics below every asset and grid
+        below: Dict[str, List[int]] = {}
+        for position, topic in enumerate(topics):
+            parts = topic.split("/")
+            for depth in range(1, len(parts) + 1):
+                below.setdefault("/".join(parts[:depth]), []).append(position)
+
+        entries: List[tuple] = []
+        for event in self.events:
+            if event.target in below:
+                positions = below[event.target]
+            else:
+                match = re.compile(fnmatch.translate(event.target)).match
+                positions = [
+                    position for position, topic in enumerate(topics) if match(topic)
+                ]
+            if not positions:
+                self.unmatched.add(event.target)
+            for position in positions:
+                attribute = topics[position].rsplit("/", 1)[-1]
+                if event.attribute is not None and attribute != event.attribute:
+                    continue
+                value = event.value
+                if event.action == "trip":
+                    value = tripped_value(attribute)
+                    if value is None:
+                        continue
+                ramp = event.ramp
+                if booleans is not None and booleans[position]:
+                    # Switches and flags change at once
+                    ramp = 0.0
+                entries.append(
+                    (
+                        position,
+                        event.start,
+                        event.end,
+                        int(ramp * 10**9),
+                        value,
+                        event.action == "scale",
+                    )
+                )
+
+        # Traces already in a layer go to the next one
+        layers: List[List[tuple]] = []
+        count: Dict[int, int] = {}
+        for entry in entries:
+            depth = count.get(entry[0], 0)
+            count[entry[0]] = depth + 1
+            if depth == len(layers):
+                layers.append([])
+            layers[depth].append(entry)
+        dtypes = (np.intp, np.int64, np.int64, np.int64, np.float64, bool)
+        self.layers = [
+            Layer(
+                *(np.array(column, dtype) for column, dtype in zip(zip(*layer), dtypes))
+            )
+            for layer in layers
+        ]
+        self.entries = len(entries)
+        self.first = min((entry[1] for entry in entries), default=FOREVER)
+        self.last = max((entry[2] for entry in entries), default=0)
+
+    def __len__(self) -> int:
+        return self.entries
+
+    def apply(
+        self,
+        values: np.ndarray,
+        found: Optional[np.ndarray],
+        when: Union[int, np.ndarray],
+    ) -> None:
+        """Overlays the events active at `when` on `values`, in place.
+
+        `values` has the traces in its last axis, `when` is a timestamp in
+        nanoseconds or one per row of `values`. Traces with a set value are
+        marked in `found`, scaled ones keep having data only if they had it.
+        """
+        when = np.asarray(when, dtype=np.int64)
+        if not self.layers or when.max() < self.first or when.min() >= self.last:
+            return
+        when = when[..., None]
+        for layer in self.layers:
+            active = (layer.starts <= when) & (when < layer.ends)
+            if not active.any():
+                continue
+            base = values[..., layer.positions]
+            target = np.where(layer.scales, base * layer.values, layer.values)
+            elapsed = (when - layer.starts).astype(float)
+            progress = np.where(
+                layer.ramps > 0,
+                np.clip(elapsed / np.maximum(layer.ramps, 1), 0, 1),
+                1.0,
+            )
+            values[..., layer.positions] = np.where(
+                active, base + (target - base) * progress, base
+            )
+            if found is not None:
+                found[..., layer.positions] |= active & ~layer.scales
+
+
+class Scenario:
+    """Scenario file of a device, read again whenever it changes so the
+    events can be swapped without restarting"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.events: List[Event] = []
+        # Modification time of the events, -1 before the first read
+        self._mtime: Optional[float] = -1.0
+
+    def changed(self) -> bool:
+        """Whether the events changed since the last call"""
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        if mtime is None:
+            logger.warning(f"Scenario {self.path} not found, no events applied")
+            self.events = []
+            return True
+        try:
+            self.events = read_scenario(self.path)
+        except (ValueError, KeyError) as e:
+            # A half written file keeps the events that were running
+            logger.error(f"Scenario {self.path} not loaded: {e}")
+            return False
+        logger.info(f"Loaded {len(self.events)} events from {self.path}")
+        return True
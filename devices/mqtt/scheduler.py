@@ -1,42 +1,74 @@
 import json
 import os
-import random
 import threading
 import time
 from datetime import datetime
 from enum import Enum
-from functools import reduce, total_ordering
-from queue import Queue
+from queue import Full, Queue
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
 
-import pandas as pd
-from log import logger
+import numpy as np
+from bundle import BUNDLE_NAME, open_store, read_trace_table
+from clock import Clock
+from lanes import Lanes
+from log import get_logger, logger
+from metrics import Metrics
+from noise import NoiseEngine, NoiseModel
+from policy import PublishPolicy
+from profiling import spans
+from scenario import Overlay, Scenario
+from snapshot import LastValues
+from store import (
+    TRACES_PATH,
+    Lookup,
+    TimeUnit,
+    TraceFile,
+    TraceStore,
+    to_timestamp,
+)
 
-TRACES_PATH = "./traces"
+# Every message and every trace without data, sampled and rate limited
+messages = get_logger("messages")
+no_data = get_logger("no_data")
+# One summary line per tick
+ticks = get_logger("ticks")
 
 
-@total_ordering
-class TimeUnit(Enum):
-    MINUTE = ("minute", 2)
-    HOUR = ("hour", 3)
-    DAY_OF_WEEK = ("dow", 4)
-    DAY_OF_MONTH = ("dom", 4)
-    DAY_OF_YEAR = ("doy", 4)
+class GroupBy(Enum):
+    """Traces sent together in one message per tick"""
 
-    def __new__(cls, member_value, member_order):
-        member = object.__new__(cls)
-        member._value_ = member_value
-        member.order = member_order
-        return member
-
-    def __lt__(self, other):
-        if self.__class__ is other.__class__:
-            return self.order < other.order
-        return NotImplemented
+    # One message per trace
+    TRACE = "trace"
+    # Every attribute of a grid/asset
+    ASSET = "asset"
+    # Every asset and attribute of a grid
+    GRID = "grid"
 
     def __str__(self):
         return self.value
 
 
+def group_key(topic: str, group_by: GroupBy) -> Tuple[str, str]:
+    """Topic of the message carrying `topic` and the key of its value there"""
+    depth = 2 if group_by == GroupBy.ASSET else 1
+    parts = topic.split("/")
+    if group_by == GroupBy.TRACE or len(parts) <= depth:
+        return topic, "value"
+    return "/".join(parts[:depth]), "/".join(parts[depth:])
+
+
+def stamped(data: str, sequence: int) -> str:
+    """Message with its number in its topic and the time it was made"""
+    return data[:-1] + ', "seq": %d, "sent": %.6f}' % (sequence, time.time())
+
+
+def default_lookup(time_unit: TimeUnit) -> Lookup:
+    # Periodic patterns are matched minute by minute unless told otherwise
+    if time_unit == TimeUnit.ABSOLUTE:
+        return Lookup.PREVIOUS
+    return Lookup.EXACT
+
+
 class Trace:
     def __init__(
         self,
@@ -46,6 +78,15 @@ class Trace:
         noise_factor: float,
         match_timestamp_by: str = "minute",
         target_value: str = "value",
+        lookup: Optional[str] = None,
+        noise_model: str = "white",
+        noise_seed: Optional[int] = None,
+        noise_correlation: float = 0.9,
+        noise_bound: Optional[float] = None,
+        deadband: Optional[float] = None,
+        deadband_percent: Optional[float] = None,
+        max_silence: Optional[float] = None,
+        column: Optional[int] = None,
     ) -> None:
         self.name = name
         self.topic = topic
@@ -53,6 +94,18 @@ class Trace:
         self.noise_factor = noise_factor
         self.match_timestamp_by = TimeUnit(match_timestamp_by)
         self.target_value = target_value
+        self.lookup = (
+            Lookup(lookup) if lookup else default_lookup(self.match_timestamp_by)
+        )
+        self.noise_model = NoiseModel(noise_model)
+        self.noise_seed = noise_seed
+        self.noise_correlation = noise_correlation
+        self.noise_bound = noise_bound
+        self.deadband = deadband
+        self.deadband_percent = deadband_percent
+        self.max_silence = max_silence
+        # Index of `target_value` in the file, resolved when compiling
+        self.column = column
 
     def __str__(self) -> str:
         return self.name
@@ -61,103 +114,362 @@ class Trace:
         return self.name
 
 
-class Parser:
-    def __init__(self) -> None:
-        pass
+class PayloadTemplate:
+    """Field order of the messages of a trace file: the timestamp, every
+    column, then the value and the topic unless a column has their name.
 
-    def parse(
-        self,
-        filename: str,
-        datetime: datetime,
-        time_unit: TimeUnit,
-        noise_factor: float,
-        topic: str,
-        target_value: str = "value",
-    ) -> pd.Series:
-        logger.info(f"Parsing file {filename}")
-        data = pd.read_csv(
-            os.path.join(TRACES_PATH, filename),
-            parse_dates=["timestamp"],
-            infer_datetime_format=True,
-        )
-        filters = self._get_filters_criteria(data, datetime, time_unit)
-        # Apply filters
-        data: pd.Series = data.loc[reduce(lambda a, b: a & b, filters)]
-        # Transform to dict
-        data = data.to_dict(orient="records")
-        # Get only one read and add noise and topic
-        if data:
-            data = data[0]
-            data["value"] = data[target_value]
-            if noise_factor:
-                data["value"] = random.gauss(data[target_value], noise_factor)
-            data["topic"] = topic
-            data["timestamp"] = datetime.isoformat()
-        return data
-
-    @staticmethod
-    def _get_filters_criteria(df: pd.DataFrame, datetime: datetime, criteria: str):
-        filters = [df["timestamp"].dt.minute == datetime.time().minute]
-        if criteria >= TimeUnit.HOUR:
-            filters.append(df["timestamp"].dt.hour == datetime.time().hour)
-        if criteria == TimeUnit.DAY_OF_WEEK:
-            filters.append(
-                df["timestamp"].dt.day_of_week == datetime.timetuple().tm_wday
-            )
-        if criteria == TimeUnit.DAY_OF_MONTH:
-            filters.append(df["timestamp"].dt.day == datetime.timetuple().tm_mday)
-        if criteria == TimeUnit.DAY_OF_YEAR:
-            filters.append(
-                df["timestamp"].dt.day_of_year == datetime.timetuple().tm_yday
-            )
-        return filters
+    The fields shared by every trace of the file are serialized once per
+    tick, each message only adds its value and topic.
+    """
+
+    SLOTS = ("value", "topic")
+
+    def __init__(self, columns: List[str]) -> None:
+        self.keys = ["timestamp"] + [c for c in columns if c != "timestamp"]
+        self.keys += [slot for slot in self.SLOTS if slot not in self.keys]
+        self.value_first = self.keys.index("value") < self.keys.index("topic")
+
+    def render(self, record: dict, datetime: datetime) -> List[str]:
+        """Serialized message split around the value and the topic"""
+        fields = {"timestamp": datetime.isoformat(), **record}
+        parts = []
+        text = "{"
+        for position, key in enumerate(self.keys):
+            text += (", " if position else "") + json.dumps(key) + ": "
+            if key in self.SLOTS:
+                parts.append(text)
+                text = ""
+            else:
+                text += json.dumps(fields[key], default=str)
+        parts.append(text + "}")
+        return parts
+
+    def fill(self, parts: List[str], value: str, topic: str) -> str:
+        """Message of a trace from the parts of its file and serialized slots"""
+        if not self.value_first:
+            value, topic = topic, value
+        return parts[0] + value + parts[1] + topic + parts[2]
+
+
+class TraceGroup(NamedTuple):
+    file: TraceFile
+    time_unit: TimeUnit
+    lookup: Lookup
+    # Positions of the traces in the scheduler and their columns in the file
+    traces: np.ndarray
+    columns: np.ndarray
+    template: PayloadTemplate
+
+
+def read_traces(path: str = TRACES_PATH) -> List[dict]:
+    """Trace definitions, resolved by the compiled bundle when it is current"""
+    filename = os.path.join(path, "traces.json")
+    bundle_path = os.path.join(path, BUNDLE_NAME)
+    try:
+        if os.path.exists(bundle_path) and os.path.getmtime(
+            bundle_path
+        ) >= os.path.getmtime(filename):
+            traces = read_trace_table(bundle_path)
+            if traces is not None:
+                return traces
+        with open(filename, "r") as f:
+            return json.load(f)["traces"]
+    except FileNotFoundError:
+        logger.error("No traces file found")
+        exit(1)
 
 
 class Scheduler:
-    def __init__(self, queue: Queue) -> None:
-        self._stop_flag = False
+    def __init__(
+        self,
+        queue: Queue,
+        traces: Optional[List[dict]] = None,
+        store: Optional[TraceStore] = None,
+        metrics: Optional[Metrics] = None,
+        clock: Optional[Clock] = None,
+        seed: Optional[int] = None,
+        scenario: Optional[Scenario] = None,
+        group_by: GroupBy = GroupBy.TRACE,
+        stamp: bool = False,
+        lanes: Optional[Lanes] = None,
+    ) -> None:
+        self._stopped = threading.Event()
         # Initiate the queue client to start sending data
         self.queue = queue
+        # Trace definitions, all of traces.json unless a shard is given
+        self.definitions = traces
         # Load parser
-        self.parser = Parser()
+        self.store = store if store is not None else open_store()
+        # Noise of every trace, from its own generator
+        self.noise = NoiseEngine(seed)
+        self.metrics = metrics if metrics is not None else Metrics()
+        # Real time unless replaying a time range
+        self.clock = clock if clock is not None else Clock()
+        # Events overlaid on the traces, read again when the file changes
+        self.scenario = scenario
+        self.overlay: Optional[Overlay] = None
+        # Traces of an asset or grid can be sent together in one message
+        self.group_by = group_by
+        # Every message numbered by topic and stamped with when it was made,
+        # for the verifier
+        self.stamp = stamp
+        # Messages are put as (lane, data) in a LaneQueue, higher priority
+        # lanes first in every tick
+        self.lanes = lanes
+        # Last value published for every trace, served by the control endpoint
+        self.last_values = LastValues()
         # Load traces
-        self.threads = []
+        self.traces: List[Trace] = []
+        self.groups: List[TraceGroup] = []
 
     def start(self):
         logger.info("Starting scheduler..")
         self.load_traces()
+        for now in self.clock.ticks(self._stopped):
+            self.tick(now)
+        logger.info("Scheduler finished")
 
     def stop(self):
         logger.info("Stopping scheduler..")
-        self._stop_flag = True
+        self._stopped.set()
 
     def load_traces(self):
-        try:
-            with open(os.path.join(TRACES_PATH, "traces.json"), "r") as f:
-                traces = [Trace(**trace) for trace in json.load(f)["traces"]]
-                for trace in traces:
-                    t = threading.Thread(target=self.simulate_trace, args=(trace,))
-                    self.threads.append(t)
-                    t.start()
-        except FileNotFoundError:
-            logger.error("No traces file found")
-            exit(1)
-
-    def simulate_trace(self, trace: Trace):
-        while not self._stop_flag:
-            now = datetime.now()
-            data = self.parser.parse(
-                trace.filename,
-                datetime=now,
-                time_unit=trace.match_timestamp_by,
-                noise_factor=trace.noise_factor,
-                topic=trace.topic,
-                target_value=trace.target_value,
+        if self.definitions is None:
+            self.definitions = read_traces()
+        self.traces = [Trace(**trace) for trace in self.definitions]
+        self.topics = [json.dumps(trace.topic) for trace in self.traces]
+        # Only the files used by these traces are kept in memory
+        self.store.load(trace.filename for trace in self.traces)
+        self.groups = self.group_traces(self.traces)
+        self.group_of = np.empty(len(self.traces), dtype=np.intp)
+        self.booleans = np.zeros(len(self.traces), dtype=bool)
+        for position, group in enumerate(self.groups):
+            self.group_of[group.traces] = position
+            self.booleans[group.traces] = group.file.booleans[group.columns]
+        self.noisy = []
+        for position, trace in enumerate(self.traces):
+            if trace.noise_factor and not self.booleans[position]:
+                self.noisy.append(position)
+                self.noise.register(
+                    trace.topic,
+                    trace.noise_factor,
+                    model=trace.noise_model,
+                    seed=trace.noise_seed,
+                    correlation=trace.noise_correlation,
+                    bound=trace.noise_bound,
+                )
+        self.lane_of = np.array(
+            [
+                self.lanes.lane(trace.topic) if self.lanes else 0
+                for trace in self.traces
+            ],
+            dtype=np.intp,
+        )
+        if self.group_by != GroupBy.TRACE:
+            self.group_composites()
+        # Messages are numbered by the topic they are sent on
+        self.sequence = np.zeros(
+            len(
+                self.traces if self.group_by == GroupBy.TRACE else self.composite_topics
+            ),
+            dtype=np.int64,
+        )
+        self.last_values.load([trace.topic for trace in self.traces], self.booleans)
+        self.policy = PublishPolicy(
+            [trace.deadband for trace in self.traces],
+            [trace.deadband_percent for trace in self.traces],
+            [trace.max_silence for trace in self.traces],
+            self.booleans,
+        )
+
+    def group_composites(self):
+        """Resolves the message of every trace and its key in the message"""
+        topics: Dict[str, int] = {}
+        self.composite_of = np.empty(len(self.traces), dtype=np.intp)
+        self.keys = []
+        for position, trace in enumerate(self.traces):
+            topic, key = group_key(trace.topic, self.group_by)
+            self.composite_of[position] = topics.setdefault(topic, len(topics))
+            self.keys.append(json.dumps(key) + ": ")
+        self.composite_topics = [json.dumps(topic) for topic in topics]
+        # A message goes in the highest priority lane of its traces
+        self.composite_lane = np.full(len(topics), np.iinfo(np.intp).max)
+        np.minimum.at(self.composite_lane, self.composite_of, self.lane_of)
+        logger.info(
+            f"Sending {len(self.traces)} traces in {len(topics)} messages "
+            f"by {self.group_by}"
+        )
+
+    def group_traces(self, traces: List[Trace]) -> List[TraceGroup]:
+        """Group the traces read with the same lookup of the same file"""
+        positions: Dict[tuple, List[int]] = {}
+        for position, trace in enumerate(traces):
+            key = (trace.filename, trace.match_timestamp_by, trace.lookup)
+            positions.setdefault(key, []).append(position)
+        groups = []
+        for (filename, time_unit, lookup), members in positions.items():
+            trace_file = self.store.get(filename)
+            names = trace_file.columns
+            columns = []
+            for position in members:
+                target = traces[position].target_value
+                column = traces[position].column
+                # The file may have changed since the trace was compiled
+                if column is None or column >= len(names) or names[column] != target:
+                    if target not in names:
+                        raise ValueError(f"Column {target} not found in {filename}")
+                    column = trace_file.index(target)
+                columns.append(column)
+            groups.append(
+                TraceGroup(
+                    trace_file,
+                    time_unit,
+                    lookup,
+                    np.array(members),
+                    np.array(columns),
+                    PayloadTemplate(trace_file.columns),
+                )
             )
-            if data:
-                data = json.dumps(data, default=str)
-                self.queue.put(data)
-                logger.info(f"Enqueuing {data}")
-            else:
-                logger.info(f"No data for {trace.name} at {now}")
-            time.sleep(60)
+        return groups
+
+    def sample(
+        self, now: datetime
+    ) -> Tuple[np.ndarray, np.ndarray, List[Optional[dict]]]:
+        """Values of every trace at `now` with the scenario overlaid, which ones
+        have data and the records"""
+        # Every file is read once per tick for all the traces that share it
+        values = np.zeros(len(self.traces))
+        found = np.zeros(len(self.traces), dtype=bool)
+        records: List[Optional[dict]] = []
+        for group in self.groups:
+            row = group.file.row(now, group.time_unit, group.lookup)
+            records.append(None if row is None else group.file.record(row))
+            if row is not None:
+                values[group.traces] = row[group.columns]
+                found[group.traces] = True
+        for position in self.noisy:
+            trace = self.traces[position]
+            values[position] += self.noise.next(trace.topic, trace.noise_factor)
+        if self.scenario is not None:
+            if self.scenario.changed():
+                self.overlay = Overlay(
+                    self.scenario.events,
+                    [trace.topic for trace in self.traces],
+                    self.booleans,
+                )
+                for target in sorted(self.overlay.unmatched):
+                    logger.warning(f"No trace matches the scenario target {target}")
+            if self.overlay is not None:
+                self.overlay.apply(values, found, to_timestamp(now))
+        return values, found, records
+
+    def tick(self, now: datetime):
+        started = time.monotonic()
+        # The values of all the traces go through the policy together
+        with spans("sample"):
+            values, found, records = self.sample(now)
+        publish = self.policy.check(values, found, now.timestamp())
+        self.last_values.update(now, values, publish)
+
+        for position in np.flatnonzero(~found):
+            no_data.info("No data for %s at %s", self.traces[position].name, now)
+        missing = len(found) - int(found.sum())
+        suppressed = int(found.sum() - publish.sum())
+        self.metrics.incr("no_data", missing)
+        self.metrics.incr("suppressed", suppressed)
+        if self.group_by != GroupBy.TRACE:
+            with spans("serialize"):
+                batch = self.composite_messages(now, values, publish)
+        else:
+            batch = self.trace_messages(now, values, records, publish)
+        enqueued = size = 0
+        for lane, data in batch:
+            if self._stopped.is_set():
+                return
+            with spans("enqueue"):
+                self.enqueue(data, lane)
+            enqueued += 1
+            size += len(data)
+            messages.debug("Enqueuing %s", data)
+        self.metrics.incr("enqueued", enqueued)
+        ticks.info(
+            "Tick %s: %d enqueued (%d bytes), %d suppressed, %d without data, "
+            "%.3f s late, took %.1f ms",
+            now,
+            enqueued,
+            size,
+            suppressed,
+            missing,
+            self.clock.lateness,
+            (time.monotonic() - started) * 1000,
+        )
+
+    def serialize(self, values: np.ndarray, position: int) -> str:
+        value = values[position].item()
+        return json.dumps(bool(value) if self.booleans[position] else value)
+
+    def trace_messages(
+        self,
+        now: datetime,
+        values: np.ndarray,
+        records: List[Optional[dict]],
+        publish: np.ndarray,
+    ) -> Iterator[Tuple[int, str]]:
+        """One message per published trace, with every column of its file,
+        and its lane"""
+        parts: Dict[int, List[str]] = {}
+        published = np.flatnonzero(publish)
+        if self.lanes is not None:
+            published = published[np.argsort(self.lane_of[published], kind="stable")]
+        for position in published:
+            with spans("serialize"):
+                group = self.group_of[position]
+                template = self.groups[group].template
+                if group not in parts:
+                    parts[group] = template.render(records[group], now)
+                value = self.serialize(values, position)
+                data = template.fill(parts[group], value, self.topics[position])
+            if self.stamp:
+                self.sequence[position] += 1
+                data = stamped(data, self.sequence[position])
+            yield self.lane_of[position], data
+
+    def composite_messages(
+        self, now: datetime, values: np.ndarray, publish: np.ndarray
+    ) -> List[Tuple[int, str]]:
+        """One message per asset or grid with the values of its published
+        traces, and its lane"""
+        published = np.flatnonzero(publish)
+        if not len(published):
+            return []
+        owners = self.composite_of[published]
+        order = np.lexsort((owners, self.composite_lane[owners]))
+        published, owners = published[order], owners[order]
+        bounds = np.flatnonzero(np.diff(owners)) + 1
+        head = '{"timestamp": ' + json.dumps(now.isoformat()) + ', "topic": '
+        batch = []
+        for start, end in zip(
+            [0, *bounds.tolist()], [*bounds.tolist(), len(published)]
+        ):
+            fields = ", ".join(
+                self.keys[position] + self.serialize(values, position)
+                for position in published[start:end].tolist()
+            )
+            topic = self.composite_topics[owners[start]]
+            data = head + topic + ', "values": {' + fields + "}}"
+            if self.stamp:
+                self.sequence[owners[start]] += 1
+                data = stamped(data, self.sequence[owners[start]])
+            batch.append((self.composite_lane[owners[start]], data))
+        return batch
+
+    def enqueue(self, data: str, lane: int = 0):
+        # A bounded queue blocks the scheduler when the ingestor falls behind,
+        # which is what keeps a fast replay from filling the memory
+        item = (int(lane), data) if self.lanes is not None else data
+        while not self._stopped.is_set():
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except Full:
+                continue
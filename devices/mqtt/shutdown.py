@@ -0,0 +1,55 @@
+import signal
+import threading
+from typing import Optional
+
+from ingestor import DRAIN_TIMEOUT, Ingestor
+from log import logger
+from scheduler import Scheduler
+
+
+def stop_on_sigterm() -> None:
+    """Raises KeyboardInterrupt on SIGTERM, what `docker stop` sends, so it
+    stops a device like Ctrl-C does.
+
+    A process running as PID 1 in a container has no default action for
+    SIGTERM, without a handler it only stops when it is killed.
+    """
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+
+def wait(scheduler_thread: threading.Thread, stopping) -> None:
+    """Waits until the scheduler finishes a replay, or sets `stopping` on
+    SIGTERM or SIGINT"""
+    try:
+        while scheduler_thread.is_alive() and not stopping.wait(1):
+            pass
+    except KeyboardInterrupt:
+        stopping.set()
+
+
+def stop(
+    scheduler: Scheduler,
+    scheduler_thread: threading.Thread,
+    ingestor: Ingestor,
+    ingestor_thread: threading.Thread,
+    stopping,
+    timeout: Optional[float] = DRAIN_TIMEOUT,
+) -> None:
+    """Stops the scheduler, then gives the ingestor `timeout` seconds to
+    publish what is queued.
+
+    A replay that reached its end publishes every message it queued, unless
+    it is stopped meanwhile.
+    """
+    scheduler.stop()
+    scheduler_thread.join()
+    if not stopping.is_set():
+        logger.info(f"Replay finished, publishing {ingestor.queue.qsize()} messages")
+        ingestor.stop(timeout=None)
+    while ingestor_thread.is_alive():
+        if stopping.is_set():
+            ingestor.stop(timeout)
+        try:
+            ingestor_thread.join(1)
+        except KeyboardInterrupt:
+            stopping.set()
@@ -0,0 +1,84 @@
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class LastValues:
+    """Last value published for every trace, updated by the scheduler every
+    tick and read by the control endpoint as one document.
+
+    A consumer that connects in the middle of a run gets the state of every
+    topic at once instead of waiting for the next tick to publish it.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.load([], np.zeros(0, dtype=bool))
+
+    def load(self, topics: List[str], booleans: np.ndarray) -> None:
+        """Traces of the scheduler, in its order"""
+        parts = [topic.split("/") for topic in topics]
+        with self._lock:
+            self.topics = topics
+            # Grid and asset of every trace, to filter the snapshot
+            self.grids = np.array([part[0] for part in parts], dtype=object)
+            self.assets = np.array(
+                [part[1] if len(part) > 2 else "" for part in parts], dtype=object
+            )
+            self.booleans = booleans
+            self.values = np.zeros(len(topics))
+            # Epoch seconds of the tick every value was published in, NaN
+            # before the first one
+            self.times = np.full(len(topics), np.nan)
+            self.tick: Optional[datetime] = None
+
+    def update(self, now: datetime, values: np.ndarray, publish: np.ndarray) -> None:
+        with self._lock:
+            np.copyto(self.values, values, where=publish)
+            np.copyto(self.times, now.timestamp(), where=publish)
+            self.tick = now
+
+    def snapshot(
+        self, grid: Optional[str] = None, asset: Optional[str] = None
+    ) -> Tuple[int, dict]:
+        """Status and document of the last values of the traces of `grid`
+        and `asset`, 404 when no trace matches them"""
+        with self._lock:
+            topics, booleans, tick = self.topics, self.booleans, self.tick
+            selected = np.ones(len(topics), dtype=bool)
+            if grid is not None:
+                selected &= self.grids == grid
+            if asset is not None:
+                selected &= self.assets == asset
+            positions = np.flatnonzero(selected & ~np.isnan(self.times))
+            values = self.values[positions].tolist()
+            times = self.times[positions]
+        if (grid is not None or asset is not None) and not selected.any():
+            filters = {"grid": grid, "asset": asset}
+            wanted = " and ".join(f"{k} {v}" for k, v in filters.items() if v)
+            return 404, {"error": f"No trace of {wanted}"}
+        timezone = tick.tzinfo if tick is not None else None
+        stamps: Dict[float, str] = {}
+        traces = {}
+        for position, value, stamp in zip(positions.tolist(), values, times.tolist()):
+            if stamp not in stamps:
+                stamps[stamp] = datetime.fromtimestamp(stamp, timezone).isoformat()
+            traces[topics[position]] = {
+                "value": bool(value) if booleans[position] else value,
+                "timestamp": stamps[stamp],
+            }
+        return 200, {
+            "timestamp": tick.isoformat() if tick is not None else None,
+            "count": len(traces),
+            "traces": traces,
+        }
+
+    def routes(self) -> Dict[str, Callable]:
+        """`/snapshot?grid=G&asset=A` returns the last values, both optional"""
+        return {
+            "/snapshot": lambda query: self.snapshot(
+                query.get("grid"), query.get("asset")
+            )
+        }
@@ -0,0 +1,162 @@
+import os
+import time
+from typing import BinaryIO, List, Optional
+
+from log import logger
+
+SEGMENT_SUFFIX = ".spool"
+
+
+class Spool:
+    """Append-only on-disk buffer of the messages that could not be sent.
+
+    Messages are written one per line to numbered segment files, synced to
+    disk every `sync_every` messages or `sync_interval` seconds. When the
+    spool grows over `max_bytes` the oldest segments are dropped. Messages
+    are read back in order with `peek` and removed with `commit` once sent,
+    so a restart sends again at most the messages of the last segment read.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 256 * 1024**2,
+        segment_bytes: int = 8 * 1024**2,
+        sync_every: int = 100,
+        sync_interval: float = 1.0,
+    ) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        os.makedirs(path, exist_ok=True)
+        self.segments: List[int] = sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.size = sum(os.path.getsize(self._filename(s)) for s in self.segments)
+        self._writer: Optional[BinaryIO] = None
+        self._writer_size = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._reader: Optional[BinaryIO] = None
+        self._offset = 0
+        self._next: Optional[bytes] = None
+        if self.segments:
+            logger.info(f"Found {self.size} bytes spooled in {path}")
+
+    def __bool__(self) -> bool:
+        return self.size > self._offset
+
+    def _filename(self, segment: int) -> str:
+        return os.path.join(self.path, f"{segment:012d}{SEGMENT_SUFFIX}")
+
+    def _is_writing(self, segment: int) -> bool:
+        return self._writer is not None and segment == self.segments[-1]
+
+    def _rotate(self) -> None:
+        self.sync()
+        if self._writer is not None:
+            self._writer.close()
+        segment = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(segment)
+        self._writer = open(self._filename(segment), "ab")
+        self._writer_size = 0
+
+    def append(self, data: str) -> int:
+        """Spools a message, returns how many old messages were evicted"""
+        line = data.encode() + b"\n"
+        if self._writer is None or self._writer_size + len(line) > self.segment_bytes:
+            self._rotate()
+        self._writer.write(line)
+        self._writer_size += len(line)
+        self.size += len(line)
+        self._unsynced += 1
+        if (
+            self._unsynced >= self.sync_every
+            or time.monotonic() - self._last_sync >= self.sync_interval
+        ):
+            self.sync()
+        evicted = 0
+        while self.size > self.max_bytes and len(self.segments) > 1:
+            evicted += self._drop_oldest()
+        return evicted
+
+    def sync(self) -> None:
+        if self._writer is not None and self._unsynced:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def peek(self) -> Optional[str]:
+        """Oldest message in the spool, None if it is empty"""
+        if self._next is not None:
+            return self._next[:-1].decode()
+        if not self:
+            return None
+        if self._writer is not None:
+            # The message may still be in the write buffer
+            self._writer.flush()
+        if self._reader is None:
+            self._reader = open(self._filename(self.segments[0]), "rb")
+            self._reader.seek(self._offset)
+        line = self._reader.readline()
+        if not line.endswith(b"\n"):
+            # Partial line left by a crash while writing
+            logger.warning(f"Discarding truncated message in {self._reader.name}")
+            self._offset += len(line)
+            self._finish_segment()
+            return self.peek()
+        self._next = line
+        return line[:-1].decode()
+
+    def commit(self) -> None:
+        """Removes the message returned by the last `peek`"""
+        if self._next is None:
+            return
+        self._offset += len(self._next)
+        self._next = None
+        self._finish_segment()
+
+    def _finish_segment(self) -> None:
+        segment = self.segments[0]
+        if self._offset < os.path.getsize(self._filename(segment)):
+            return
+        if self._is_writing(segment):
+            if self._writer_size == 0 or self:
+                return
+            # Everything written was sent, start over with a new segment
+            self._writer.close()
+            self._writer = None
+        self._remove_first()
+
+    def _remove_first(self) -> None:
+        segment = self.segments.pop(0)
+        filename = self._filename(segment)
+        size = os.path.getsize(filename)
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        os.remove(filename)
+        self.size -= size
+        self._offset = 0
+        self._next = None
+
+    def _drop_oldest(self) -> int:
+        filename = self._filename(self.segments[0])
+        with open(filename, "rb") as f:
+            f.seek(self._offset)
+            count = f.read().count(b"\n")
+        self._remove_first()
+        logger.warning(f"Spool full, dropped {count} messages from {filename}")
+        return count
+
+    def close(self) -> None:
+        self.sync()
+        for f in (self._writer, self._reader):
+            if f is not None:
+                f.close()
+        self._writer = self._reader = None
@@ -0,0 +1,347 @@
+import csv
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from functools import total_ordering
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from encoding import EncodedValues
+from log import logger
+
+TRACES_PATH = "./traces"
+
+DAY = 24 * 60 * 60
+
+EPOCH = datetime(1970, 1, 1)
+BOOLEANS = {"true": 1.0, "false": 0.0}
+
+
+@total_ordering
+class TimeUnit(Enum):
+    MINUTE = ("minute", 2)
+    HOUR = ("hour", 3)
+    DAY_OF_WEEK = ("dow", 4)
+    DAY_OF_MONTH = ("dom", 4)
+    DAY_OF_YEAR = ("doy", 4)
+    # Not periodic, the file is a time series matched by its real timestamps
+    ABSOLUTE = ("absolute", 5)
+
+    def __new__(cls, member_value, member_order):
+        member = object.__new__(cls)
+        member._value_ = member_value
+        member.order = member_order
+        return member
+
+    def __lt__(self, other):
+        if self.__class__ is other.__class__:
+            return self.order < other.order
+        return NotImplemented
+
+    def __str__(self):
+        return self.value
+
+
+# Length in seconds of the pattern repeated by each periodic unit
+PERIODS = {
+    TimeUnit.MINUTE: 60 * 60,
+    TimeUnit.HOUR: DAY,
+    TimeUnit.DAY_OF_WEEK: 7 * DAY,
+    TimeUnit.DAY_OF_MONTH: 31 * DAY,
+    TimeUnit.DAY_OF_YEAR: 366 * DAY,
+}
+
+
+class Lookup(Enum):
+    """What is sent when the time falls between two stored samples"""
+
+    # Only the sample of the same minute (periodic) or timestamp (absolute)
+    EXACT = "exact"
+    PREVIOUS = "previous"
+    NEAREST = "nearest"
+    INTERPOLATE = "interpolate"
+    CUBIC = "cubic"
+
+    @classmethod
+    def _missing_(cls, value):
+        return {"step": cls.PREVIOUS, "linear": cls.INTERPOLATE}.get(value)
+
+    def __str__(self):
+        return self.value
+
+
+def to_timestamp(value: datetime) -> int:
+    """Nanoseconds since epoch, naive datetimes are taken as UTC"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = value - EPOCH
+    return (delta.days * DAY + delta.seconds) * 10**9 + delta.microseconds * 1000
+
+
+def from_timestamp(value: int) -> datetime:
+    """Naive datetime of nanoseconds since epoch, the inverse of `to_timestamp`"""
+    return EPOCH + timedelta(microseconds=value // 1000)
+
+
+def parse_timestamp(text: str) -> Tuple[int, int]:
+    """UTC and wall clock nanoseconds of an ISO 8601 timestamp"""
+    text = text.strip()
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    value = datetime.fromisoformat(text)
+    return to_timestamp(value), to_timestamp(value.replace(tzinfo=None))
+
+
+def parse_column(name: str, cells: List[str]) -> Tuple[np.ndarray, bool]:
+    """Values of a column as float64 and whether it is a boolean column"""
+    lowered = [cell.strip().lower() for cell in cells]
+    if lowered and all(cell in BOOLEANS for cell in lowered):
+        return np.array([BOOLEANS[cell] for cell in lowered]), True
+    try:
+        return np.array([cell or "nan" for cell in lowered], dtype=np.float64), False
+    except ValueError:
+        raise ValueError(f"Column {name} is not numeric nor boolean") from None
+
+
+def periodic_key(value: datetime, unit: TimeUnit) -> float:
+    """Seconds elapsed since the beginning of the period of `unit`"""
+    seconds = (
+        value.hour * 3600 + value.minute * 60 + value.second + value.microsecond / 1e6
+    )
+    if unit == TimeUnit.MINUTE:
+        return seconds - value.hour * 3600
+    if unit == TimeUnit.DAY_OF_WEEK:
+        return value.weekday() * DAY + seconds
+    if unit == TimeUnit.DAY_OF_MONTH:
+        return (value.day - 1) * DAY + seconds
+    if unit == TimeUnit.DAY_OF_YEAR:
+        return (value.timetuple().tm_yday - 1) * DAY + seconds
+    return seconds
+
+
+def periodic_keys(wall: np.ndarray, unit: TimeUnit) -> np.ndarray:
+    """Vectorized `periodic_key` over wall clock nanosecond timestamps"""
+    epoch = wall // 10**9
+    seconds = epoch % DAY
+    if unit == TimeUnit.MINUTE:
+        return seconds % 3600
+    if unit == TimeUnit.DAY_OF_WEEK:
+        # 1970-01-01 was a Thursday
+        return ((epoch // DAY + 3) % 7) * DAY + seconds
+    days = wall.astype("datetime64[ns]").astype("datetime64[D]")
+    if unit == TimeUnit.DAY_OF_MONTH:
+        start = days.astype("datetime64[M]").astype("datetime64[D]")
+        return (days - start).astype(np.int64) * DAY + seconds
+    if unit == TimeUnit.DAY_OF_YEAR:
+        start = days.astype("datetime64[Y]").astype("datetime64[D]")
+        return (days - start).astype(np.int64) * DAY + seconds
+    return seconds
+
+
+class TraceFile:
+    """Samples of a trace file as arrays, one column per trace.
+
+    `values` holds every column as float64, booleans as 0 and 1, so the row
+    for a given time is computed for all the traces of the file at once.
+    An `encode`d file keeps them compressed and only decodes the rows it
+    looks up.
+    """
+
+    def __init__(
+        self,
+        timestamps: np.ndarray,
+        wall: np.ndarray,
+        columns: List[str],
+        booleans: np.ndarray,
+        values: Optional[np.ndarray] = None,
+        encoded: Optional[EncodedValues] = None,
+    ) -> None:
+        # UTC nanoseconds sorted ascending, used by absolute traces
+        self.timestamps = timestamps
+        # Same instants as written in the file, used by periodic traces
+        self.wall = wall
+        self.columns = columns
+        self._values = values
+        self.encoded = encoded
+        self.booleans = booleans
+        self._keys: Dict[TimeUnit, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def values(self) -> np.ndarray:
+        """Every value, decoded again on every access when encoded"""
+        if self.encoded is None:
+            return self._values
+        values = self.encoded.decode()
+        values.flags.writeable = False
+        return values
+
+    def at(self, position: int) -> np.ndarray:
+        """Values of the row at `position`"""
+        if self.encoded is None:
+            return self._values[position]
+        return self.encoded.at(position)
+
+    def encode(self) -> "TraceFile":
+        """The same file with every column in its most compact encoding"""
+        if self.encoded is not None or not len(self):
+            return self
+        return TraceFile(
+            timestamps=self.timestamps,
+            wall=self.wall,
+            columns=self.columns,
+            booleans=self.booleans,
+            encoded=EncodedValues.encode(self._values),
+        )
+
+    @classmethod
+    def from_csv(cls, path: str) -> "TraceFile":
+        """Reads a csv file with a `timestamp` column and numeric or boolean
+        columns"""
+        with open(path, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            rows = [row for row in reader if row]
+        if "timestamp" not in header:
+            raise ValueError(f"{path} has no timestamp column")
+        cells = list(zip(*rows)) if rows else [()] * len(header)
+        position = header.index("timestamp")
+        stamps = [parse_timestamp(text) for text in cells[position]]
+        timestamps = np.array([utc for utc, _ in stamps], dtype=np.int64)
+        wall = np.array([local for _, local in stamps], dtype=np.int64)
+        columns = [name for name in header if name != "timestamp"]
+        parsed = [
+            parse_column(name, list(cells[header.index(name)])) for name in columns
+        ]
+        values = np.column_stack([v for v, _ in parsed]) if parsed else None
+        if values is None:
+            values = np.empty((len(rows), 0))
+        booleans = np.array([boolean for _, boolean in parsed], dtype=bool)
+        order = np.argsort(timestamps, kind="stable")
+        return cls(
+            timestamps=timestamps[order],
+            wall=wall[order],
+            columns=columns,
+            values=values[order],
+            booleans=booleans,
+        )
+
+    def index(self, column: str) -> int:
+        return self.columns.index(column)
+
+    def keys(self, unit: TimeUnit) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted keys of `unit` and the rows they belong to"""
+        if unit == TimeUnit.ABSOLUTE:
+            return self.timestamps, np.arange(len(self))
+        if unit not in self._keys:
+            keys = periodic_keys(self.wall, unit)
+            order = np.argsort(keys, kind="stable")
+            self._keys[unit] = keys[order], order
+        return self._keys[unit]
+
+    def row(
+        self, when: datetime, unit: TimeUnit, lookup: Lookup
+    ) -> Optional[np.ndarray]:
+        """Values of every column at `when`, None if there is no data"""
+        keys, order = self.keys(unit)
+        size = len(keys)
+        if not size:
+            return None
+        absolute = unit == TimeUnit.ABSOLUTE
+        target = to_timestamp(when) if absolute else periodic_key(when, unit)
+
+        if lookup == Lookup.EXACT:
+            if absolute:
+                low, high = target, target + 1
+            else:
+                low = math.floor(target / 60) * 60
+                high = low + 60
+            position = int(np.searchsorted(keys, low, side="left"))
+            if position < size and keys[position] < high:
+                return self.at(order[position]).copy()
+            return None
+
+        if absolute and not keys[0] <= target <= keys[-1]:
+            return None
+        previous = int(np.searchsorted(keys, target, side="right")) - 1
+
+        def sample(position: int) -> Tuple[float, np.ndarray]:
+            # Periodic traces wrap around, absolute ones stop at the edges
+            if absolute:
+                position = min(max(position, 0), size - 1)
+                return keys[position], self.at(order[position])
+            period = PERIODS[unit]
+            turns, position = divmod(position, size)
+            return keys[position] + turns * period, self.at(order[position])
+
+        start, before = sample(previous)
+        if lookup == Lookup.PREVIOUS or start == target:
+            return before.copy()
+        end, after = sample(previous + 1)
+        if lookup == Lookup.NEAREST:
+            return (after if end - target < target - start else before).copy()
+
+        weight = (target - start) / (end - start)
+        if lookup == Lookup.INTERPOLATE:
+            row = before + (after - before) * weight
+        else:
+            # Catmull-Rom spline through the two samples at each side
+            _, first = sample(previous - 1)
+            _, last = sample(previous + 2)
+            row = 0.5 * (
+                2 * before
+                + (after - first) * weight
+                + (2 * first - 5 * before + 4 * after - last) * weight**2
+                + (3 * before - first - 3 * after + last) * weight**3
+            )
+        # Status columns can not be interpolated, they hold their value
+        row[self.booleans] = before[self.booleans]
+        return row
+
+    def record(self, row: np.ndarray) -> dict:
+        record = dict(zip(self.columns, row.tolist()))
+        for column, boolean in zip(self.columns, self.booleans):
+            if boolean:
+                record[column] = bool(record[column])
+        return record
+
+
+class TraceStore:
+    """Keeps every trace file needed by a process in memory.
+
+    Files are read once, either up front with `load` or lazily on the first
+    lookup, so the scheduler never goes back to disk while running. With
+    `encode` they are kept compressed.
+    """
+
+    def __init__(self, path: str = TRACES_PATH, encode: bool = False) -> None:
+        self.path = path
+        self.encode = encode
+        self._files: Dict[str, TraceFile] = {}
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._files
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def load(self, filenames: Iterable[str]) -> None:
+        for filename in sorted(set(filenames)):
+            self.get(filename)
+
+    def get(self, filename: str) -> TraceFile:
+        if filename not in self._files:
+            logger.info(f"Loading file {filename}")
+            trace_file = TraceFile.from_csv(os.path.join(self.path, filename))
+            self._files[filename] = trace_file.encode() if self.encode else trace_file
+        return self._files[filename]
+
+    def files(self) -> Dict[str, TraceFile]:
+        return dict(self._files)
+
+    def index(self, filename: str) -> np.ndarray:
+        """Sorted int64 timestamps of a file, in nanoseconds since epoch"""
+        return self.get(filename).timestamps
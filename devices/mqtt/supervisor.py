@@ -0,0 +1,324 @@
+import bisect
+import hashlib
+import multiprocessing as mp
+import os
+import queue
+import signal
+import threading
+import time
+from collections import defaultdict
+from enum import Enum
+from typing import Dict, List, Optional
+
+from bundle import SharedTraceStore, default_bundle_path, publish
+from clock import Clock
+from ingestor import DRAIN_TIMEOUT, Delivery, Ingestor
+from lanes import Lanes, make_queue
+from log import logger
+from metrics import Metrics
+from profiling import Profiling
+from ratelimit import TokenBucket
+from scenario import Scenario
+from scheduler import GroupBy, Scheduler, group_key, read_traces
+from shutdown import stop
+from store import TraceStore
+
+
+class ShardBy(Enum):
+    GRID = "grid"
+    HASH = "hash"
+
+    def __str__(self):
+        return self.value
+
+
+class HashRing:
+    """Consistent hash ring used to place topics on workers.
+
+    Each worker owns `replicas` points of the ring, so changing the number of
+    workers only moves the topics that land between the affected points.
+    """
+
+    def __init__(self, nodes: int, replicas: int = 64) -> None:
+        self._ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in range(nodes)
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def get(self, key: str) -> int:
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+
+def partition(
+    traces: List[dict],
+    workers: int,
+    shard_by: ShardBy,
+    group_by: GroupBy = GroupBy.TRACE,
+) -> List[List[dict]]:
+    """Split the trace definitions in `workers` shards."""
+    shards: List[List[dict]] = [[] for _ in range(workers)]
+    if shard_by == ShardBy.HASH:
+        ring = HashRing(workers)
+        for trace in traces:
+            # Traces sent in the same message stay in the same worker
+            topic, _ = group_key(trace["topic"], group_by)
+            shards[ring.get(topic)].append(trace)
+        return shards
+
+    # Keep every grid in a single worker, biggest grids go first to the
+    # least loaded worker so shards end up balanced by trace count
+    grids: Dict[str, List[dict]] = defaultdict(list)
+    for trace in traces:
+        grids[trace["topic"].split("/", 1)[0]].append(trace)
+    for grid in sorted(grids.values(), key=len, reverse=True):
+        min(shards, key=len).extend(grid)
+    return shards
+
+
+def run_worker(
+    index: int,
+    traces: List[dict],
+    stop_event,
+    metrics_queue,
+    host: str,
+    port: int,
+    metrics_interval: float,
+    clock: Optional[Clock] = None,
+    rate: Optional[float] = None,
+    queue_size: int = 0,
+    seed: Optional[int] = None,
+    delivery: Delivery = Delivery(),
+    bundle_path: Optional[str] = None,
+    profiling: Profiling = Profiling(),
+    scenario: Optional[str] = None,
+    group_by: GroupBy = GroupBy.TRACE,
+    stamp: bool = False,
+    drain_timeout: float = DRAIN_TIMEOUT,
+    lanes: Optional[Lanes] = None,
+) -> None:
+    logger.info(f"Starting worker {index} with {len(traces)} traces..")
+    # The supervisor stops workers through the stop event, it only sends
+    # SIGTERM to the ones that did not stop in time
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    profiling.install()
+    metrics = Metrics()
+    shared_queue = make_queue(lanes, queue_size, metrics)
+
+    scheduler = Scheduler(
+        shared_queue,
+        traces=traces,
+        store=SharedTraceStore.attach(bundle_path),
+        metrics=metrics,
+        clock=clock,
+        seed=seed,
+        scenario=Scenario(scenario) if scenario else None,
+        group_by=group_by,
+        stamp=stamp,
+        lanes=lanes,
+    )
+    ingestor = Ingestor(
+        shared_queue,
+        host=host,
+        port=port,
+        metrics=metrics,
+        rate_limiter=TokenBucket(rate) if rate else None,
+        **delivery.options(f"worker-{index}"),
+    )
+
+    scheduler_thread = threading.Thread(
+        target=scheduler.start, name="scheduler", daemon=True
+    )
+    ingestor_thread = threading.Thread(
+        target=ingestor.start, name="ingestor", daemon=True
+    )
+    scheduler_thread.start()
+    ingestor_thread.start()
+
+    try:
+        last_report = time.monotonic()
+        # A replay reaches its end, then publishes what is left and leaves
+        while scheduler_thread.is_alive() and not stop_event.wait(1):
+            if time.monotonic() - last_report >= metrics_interval:
+                last_report = time.monotonic()
+                metrics_queue.put((index, metrics.snapshot()))
+    except KeyboardInterrupt:
+        # The supervisor coordinates shutdown through the stop event
+        stop_event.wait()
+    finally:
+        stop(
+            scheduler,
+            scheduler_thread,
+            ingestor,
+            ingestor_thread,
+            stop_event,
+            drain_timeout,
+        )
+        metrics_queue.put((index, metrics.snapshot()))
+        logger.info(f"Worker {index} stopped")
+
+
+class Supervisor:
+    def __init__(
+        self,
+        workers: int,
+        shard_by: ShardBy = ShardBy.GRID,
+        host: str = "0.0.0.0",
+        port: int = 1883,
+        metrics_interval: float = 60,
+        join_timeout: float = 10,
+        clock: Optional[Clock] = None,
+        rate: Optional[float] = None,
+        queue_size: int = 0,
+        seed: Optional[int] = None,
+        delivery: Delivery = Delivery(),
+        bundle_path: Optional[str] = None,
+        profiling: Profiling = Profiling(),
+        scenario: Optional[str] = None,
+        group_by: GroupBy = GroupBy.TRACE,
+        stamp: bool = False,
+        drain_timeout: float = DRAIN_TIMEOUT,
+        lanes: Optional[Lanes] = None,
+    ) -> None:
+        self.workers = workers
+        self.shard_by = shard_by
+        self.host, self.port = host, port
+        self.clock = clock
+        # The publish rate is shared by all the workers
+        self.rate = rate / workers if rate else None
+        self.queue_size = queue_size
+        self.seed = seed
+        self.delivery = delivery
+        # Trace files are read once and shared with the workers through it,
+        # a bundle that already exists is attached to as it is. Only a bundle
+        # in the default path is removed on stop, others may be shared
+        self.bundle_path = bundle_path or default_bundle_path()
+        self.owns_bundle = bundle_path is None
+        self.profiling = profiling
+        # Every worker overlays the scenario file on its own traces
+        self.scenario = scenario
+        self.group_by = group_by
+        self.stamp = stamp
+        self.lanes = lanes
+        self.metrics_interval = metrics_interval
+        # Workers get `drain_timeout` to publish what they queued, on top of
+        # the time to join them
+        self.join_timeout = join_timeout
+        self.drain_timeout = drain_timeout
+        self.processes: List[mp.Process] = []
+        self.stop_event = mp.Event()
+        self.metrics_queue = mp.Queue()
+        self.metrics: Dict[int, Dict[str, int]] = {}
+        self._reported = set()
+
+    def start(self):
+        traces = read_traces()
+        shards = partition(traces, self.workers, self.shard_by, self.group_by)
+        if os.path.exists(self.bundle_path):
+            logger.info(f"Attaching the workers to {self.bundle_path}")
+        else:
+            self.publish(traces)
+        logger.info(
+            f"Starting supervisor with {self.workers} workers sharded by "
+            f"{self.shard_by}: {[len(shard) for shard in shards]} traces"
+        )
+        for index, shard in enumerate(shards):
+            if not shard:
+                continue
+            process = mp.Process(
+                target=run_worker,
+                name=f"worker-{index}",
+                args=(
+                    index,
+                    shard,
+                    self.stop_event,
+                    self.metrics_queue,
+                    self.host,
+                    self.port,
+                    self.metrics_interval,
+                    self.clock,
+                    self.rate,
+                    self.queue_size,
+                    self.seed,
+                    self.delivery,
+                    self.bundle_path,
+                    self.profiling,
+                    self.scenario,
+                    self.group_by,
+                    self.stamp,
+                    self.drain_timeout,
+                    self.lanes,
+                ),
+            )
+            process.start()
+            self.processes.append(process)
+
+        while not self.stop_event.is_set():
+            self.collect()
+            if not any(process.is_alive() for process in self.processes):
+                logger.info("All workers finished")
+                break
+            failed = [p for p in self.processes if p.exitcode not in (None, 0)]
+            if failed:
+                logger.error(f"Workers {[p.name for p in failed]} failed, stopping..")
+                self.stop_event.set()
+
+    def forward(self, signum: int) -> None:
+        """Sends a signal to every running worker, e.g. to profile them"""
+        for process in self.processes:
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+    def publish(self, traces: List[dict]) -> None:
+        store = TraceStore()
+        store.load(trace["filename"] for trace in traces)
+        publish(store, self.bundle_path)
+
+    def receive(self, timeout: float) -> Optional[int]:
+        try:
+            index, snapshot = self.metrics_queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        self.metrics[index] = snapshot
+        return index
+
+    def collect(self, timeout: float = 1) -> None:
+        index = self.receive(timeout)
+        if index is None:
+            return
+        self._reported.add(index)
+        # Log once per round, when every worker has sent its snapshot
+        if len(self._reported) == len(self.processes):
+            self._reported.clear()
+            total = Metrics.merge(*self.metrics.values())
+            logger.info(
+                f"Metrics for {len(self.processes)} workers: {Metrics.format(total)}"
+            )
+
+    def stop(self):
+        logger.info("Stopping supervisor..")
+        self.stop_event.set()
+        # Keep reading the final snapshots while waiting, a worker can not
+        # exit until everything it put in the queue has been consumed
+        deadline = time.monotonic() + self.join_timeout + self.drain_timeout
+        while time.monotonic() < deadline and any(
+            process.is_alive() for process in self.processes
+        ):
+            self.receive(timeout=0.1)
+        for process in self.processes:
+            if process.is_alive():
+                logger.warning(f"Terminating {process.name}")
+                process.terminate()
+            process.join()
+        while self.receive(timeout=0) is not None:
+            pass
+        if self.owns_bundle and os.path.exists(self.bundle_path):
+            os.remove(self.bundle_path)
+        total = Metrics.merge(*self.metrics.values())
+        logger.info(f"Final metrics: {Metrics.format(total)}")
@@ -0,0 +1,494 @@
+import argparse
+import json
+import multiprocessing as mp
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from bundle import open_store
+from log import logger
+from noise import NoiseModel
+from paho.mqtt.client import Client as MQTTClient
+from scenario import Scenario
+from scheduler import GroupBy, Scheduler, Trace, group_key, read_traces
+from store import TRACES_PATH, TraceStore
+from supervisor import ShardBy, partition
+
+# Upper edges of the latency histogram in seconds, from 0.1 ms to 100 s
+LATENCY_BUCKETS = np.logspace(-4, 2, 61)
+# Standard deviations of noise a value can be away from its trace
+NOISE_SIGMAS = 6
+# Seconds between two batches of received messages
+BATCH_INTERVAL = 0.2
+# Ticks whose values are kept, messages of older ticks are computed again
+CACHED_TICKS = 64
+# Ranges of missing numbers kept per topic to tell late messages from
+# duplicates, older gaps are taken as lost
+MAX_GAPS = 100
+# Sequence numbers are below this, so topics do not mix in running maxima
+SEQUENCE_SPAN = 2**40
+# Topic index of the messages of other publishers and of payloads that are
+# not messages of the simulator
+UNKNOWN = -1
+MALFORMED = -2
+
+
+def tolerance(trace: Trace) -> float:
+    """How far from its trace a value with noise can be"""
+    if not trace.noise_factor:
+        return 0.0
+    if trace.noise_model == NoiseModel.BOUNDED:
+        return trace.noise_bound or 3 * trace.noise_factor
+    return NOISE_SIGMAS * trace.noise_factor
+
+
+def percentile(histogram: np.ndarray, fraction: float) -> Optional[float]:
+    """Upper edge of the bucket holding `fraction` of the latencies"""
+    total = histogram.sum()
+    if not total:
+        return None
+    position = int(np.searchsorted(np.cumsum(histogram), fraction * total))
+    return float(LATENCY_BUCKETS[min(position, len(LATENCY_BUCKETS) - 1)])
+
+
+def parse(payloads: Sequence[bytes]) -> list:
+    """Messages of a batch, parsed in a single call while all of them are
+    json, with None for the payloads that are not"""
+    try:
+        messages = json.loads(b"[" + b",".join(payloads) + b"]")
+        if len(messages) == len(payloads):
+            return messages
+    except ValueError:
+        pass
+    return [_loads(payload) for payload in payloads]
+
+
+def _loads(payload: bytes) -> object:
+    try:
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=CACHED_TICKS)
+def _is_tick(text: str) -> bool:
+    try:
+        datetime.fromisoformat(text)
+    except ValueError:
+        return False
+    return True
+
+
+def _is_number(value: object) -> bool:
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+def well_formed(message: dict) -> bool:
+    """Whether a message has the fields the simulator sends"""
+    timestamp = message.get("timestamp")
+    if not isinstance(timestamp, str) or not _is_tick(timestamp):
+        return False
+    if not isinstance(message.get("seq", -1), int):
+        return False
+    if not _is_number(message.get("sent", np.nan)):
+        return False
+    if "values" in message:
+        values = message["values"]
+        return isinstance(values, dict) and all(map(_is_number, values.values()))
+    return "value" in message and _is_number(message["value"])
+
+
+class Sequences:
+    """Loss, duplicates and out of order arrivals of numbered messages.
+
+    A whole batch is checked at once against the highest number seen on
+    each topic, only the messages older than that are looked at one by one
+    to tell a late message, which fills a gap, from a duplicate.
+    """
+
+    def __init__(self, topics: int) -> None:
+        self.last = np.full(topics, -1, dtype=np.int64)
+        self.received = np.zeros(topics, dtype=np.int64)
+        self.lost = np.zeros(topics, dtype=np.int64)
+        self.duplicates = np.zeros(topics, dtype=np.int64)
+        self.reordered = np.zeros(topics, dtype=np.int64)
+        self.restarts = np.zeros(topics, dtype=np.int64)
+        self.gaps: Dict[int, List[List[int]]] = {}
+
+    def update(self, topics: np.ndarray, numbers: np.ndarray) -> None:
+        if not len(topics):
+            return
+        order = np.argsort(topics, kind="stable")
+        topics, numbers = topics[order], numbers[order]
+        np.add.at(self.received, topics, 1)
+        first = np.ones(len(topics), dtype=bool)
+        first[1:] = topics[1:] != topics[:-1]
+        # Topics seen for the first time are counted from their first message
+        last = self.last[topics]
+        start = np.where(last < 0, numbers - 1, last)
+        offset = (np.cumsum(first) - 1) * SEQUENCE_SPAN
+        highest = np.where(first, np.maximum(numbers, start), numbers) + offset
+        highest = np.maximum.accumulate(highest) - offset
+        before = np.where(first, start, np.roll(highest, 1))
+        step = numbers - before
+
+        for position in np.flatnonzero(step > 1).tolist():
+            topic = int(topics[position])
+            self.lost[topic] += step[position] - 1
+            gaps = self.gaps.setdefault(topic, [])
+            gaps.append([int(before[position]) + 1, int(numbers[position])])
+            del gaps[:-MAX_GAPS]
+        restarted = {}
+        for position in np.flatnonzero(step <= 0).tolist():
+            topic, number = int(topics[position]), int(numbers[position])
+            if topic in restarted:
+                restarted[topic] = max(restarted[topic], number)
+            elif self.late(topic, number):
+                restarted[topic] = number
+        np.maximum.at(self.last, topics, numbers)
+        for topic, number in restarted.items():
+            self.last[topic] = number
+
+    def late(self, topic: int, number: int) -> bool:
+        """Counts a message older than the last one, True if the device
+        started numbering again"""
+        gaps = self.gaps.get(topic, [])
+        for position, (low, high) in enumerate(gaps):
+            if low <= number < high:
+                self.reordered[topic] += 1
+                self.lost[topic] -= 1
+                gaps[position : position + 1] = [
+                    gap
+                    for gap in ([low, number], [number + 1, high])
+                    if gap[0] < gap[1]
+                ]
+                return False
+        if number == 1:
+            self.restarts[topic] += 1
+            self.gaps.pop(topic, None)
+            return True
+        self.duplicates[topic] += 1
+        return False
+
+
+class Expected:
+    """Values the traces should have at each tick, computed by the
+    scheduler for all the traces at once, without noise"""
+
+    def __init__(
+        self,
+        traces: List[dict],
+        store: TraceStore,
+        scenario: Optional[Scenario] = None,
+    ) -> None:
+        self.scheduler = Scheduler(
+            None,
+            traces=[{**trace, "noise_factor": None} for trace in traces],
+            store=store,
+            scenario=scenario,
+        )
+        self.scheduler.load_traces()
+        self.tolerance = np.array([tolerance(Trace(**trace)) for trace in traces])
+        self._ticks: "OrderedDict[str, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+
+    def at(self, timestamp: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Values of every trace at a tick and which ones have data"""
+        if timestamp in self._ticks:
+            self._ticks.move_to_end(timestamp)
+            return self._ticks[timestamp]
+        values, found, _ = self.scheduler.sample(datetime.fromisoformat(timestamp))
+        self._ticks[timestamp] = (values, found)
+        if len(self._ticks) > CACHED_TICKS:
+            self._ticks.popitem(last=False)
+        return values, found
+
+
+class Verifier:
+    """Subscribes to the topics of `traces` and checks every message.
+
+    Messages are only stored when they arrive, every `BATCH_INTERVAL` the
+    batch is parsed in a single call, one payload at a time only when some
+    are not json. Payloads that are not messages of the simulator are
+    counted as malformed and skipped. Numbers and latencies are checked
+    with array operations and values against the traces once per tick, so
+    the verifier keeps up with the simulator.
+    """
+
+    def __init__(
+        self,
+        traces: List[dict],
+        store: TraceStore,
+        group_by: GroupBy = GroupBy.TRACE,
+        scenario: Optional[Scenario] = None,
+    ) -> None:
+        self.traces = traces
+        self.group_by = group_by
+        self.expected = Expected(traces, store, scenario)
+        self.positions = {trace["topic"]: index for index, trace in enumerate(traces)}
+        topics: Dict[str, int] = {}
+        for trace in traces:
+            topic, _ = group_key(trace["topic"], group_by)
+            topics.setdefault(topic, len(topics))
+        self.topics = topics
+        self.names = list(topics)
+        self.sequences = Sequences(len(topics))
+        self.histogram = np.zeros(len(LATENCY_BUCKETS), dtype=np.int64)
+        self.checked = np.zeros(len(traces), dtype=np.int64)
+        self.mismatched = np.zeros(len(traces), dtype=np.int64)
+        self.worst = np.zeros(len(traces))
+        self.unknown = 0
+        self.malformed = 0
+        self.unstamped = 0
+        self.started = time.monotonic()
+        self._inbox: List[Tuple[float, bytes]] = []
+        self._lock = threading.Lock()
+
+    def on_message(self, client, userdata, message) -> None:
+        # Runs for every message, anything more is done by batches
+        with self._lock:
+            self._inbox.append((time.time(), message.payload))
+
+    def take(self) -> List[Tuple[float, bytes]]:
+        with self._lock:
+            batch, self._inbox = self._inbox, []
+        return batch
+
+    def subscriptions(self) -> List[Tuple[str, int]]:
+        """Topic filters of the grids of the traces"""
+        grids = sorted({trace["topic"].split("/", 1)[0] for trace in self.traces})
+        return [(f"{grid}/#", 0) for grid in grids] + [(grid, 0) for grid in grids]
+
+    def topic(self, message: object) -> int:
+        """Index of the topic of a message, UNKNOWN for the topics of other
+        publishers and MALFORMED for anything the simulator does not send"""
+        if not isinstance(message, dict) or not isinstance(message.get("topic"), str):
+            return MALFORMED
+        topic = self.topics.get(message["topic"], UNKNOWN)
+        if topic >= 0 and not well_formed(message):
+            return MALFORMED
+        return topic
+
+    def process(self, batch: List[Tuple[float, bytes]]) -> None:
+        if not batch:
+            return
+        messages = parse([payload for _, payload in batch])
+        topics = np.array([self.topic(m) for m in messages], dtype=np.int64)
+        known = topics >= 0
+        self.unknown += int((topics == UNKNOWN).sum())
+        self.malformed += int((topics == MALFORMED).sum())
+        messages = [m for m, ok in zip(messages, known) if ok]
+        topics = topics[known]
+        received = np.array([arrival for arrival, _ in batch])[known]
+
+        numbers = np.array([m.get("seq", -1) for m in messages], dtype=np.int64)
+        sent = np.array([m.get("sent", np.nan) for m in messages], dtype=float)
+        stamped = numbers >= 0
+        self.unstamped += int((~stamped).sum())
+        self.sequences.update(topics[stamped], numbers[stamped])
+        latency = (received - sent)[stamped]
+        self.histogram += np.bincount(
+            np.searchsorted(LATENCY_BUCKETS, latency).clip(0, len(LATENCY_BUCKETS) - 1),
+            minlength=len(LATENCY_BUCKETS),
+        )
+        self.check_values(messages)
+
+    def check_values(self, messages: List[dict]) -> None:
+        """Compares the values of every message with its trace at its tick"""
+        ticks: Dict[str, int] = {}
+        positions, values, tick_of = [], [], []
+        for message in messages:
+            tick = ticks.setdefault(message["timestamp"], len(ticks))
+            if "values" in message:
+                prefix = message["topic"] + "/"
+                for key, value in message["values"].items():
+                    position = self.positions.get(prefix + key)
+                    if position is None:
+                        position = self.positions.get(message["topic"], -1)
+                    positions.append(position)
+                    values.append(value)
+                    tick_of.append(tick)
+            else:
+                positions.append(self.positions.get(message["topic"], -1))
+                values.append(message["value"])
+                tick_of.append(tick)
+        positions = np.array(positions, dtype=np.intp)
+        values = np.array(values, dtype=float)
+        tick_of = np.array(tick_of, dtype=np.intp)
+        valid = positions >= 0
+        for timestamp, tick in ticks.items():
+            mask = valid & (tick_of == tick)
+            at = positions[mask]
+            expected, found = self.expected.at(timestamp)
+            error = np.abs(values[mask] - expected[at])
+            wrong = ~found[at] | ~(error <= self.expected.tolerance[at])
+            np.add.at(self.checked, at, 1)
+            np.add.at(self.mismatched, at[wrong], 1)
+            np.maximum.at(self.worst, at[found[at]], error[found[at]])
+
+    def report(self) -> dict:
+        """Totals, latency histogram and the topics and traces with errors"""
+        sequences = self.sequences
+        topics = {}
+        for index in np.flatnonzero(
+            sequences.lost + sequences.duplicates + sequences.reordered
+        ).tolist():
+            topics[self.names[index]] = {
+                "received": int(sequences.received[index]),
+                "lost": int(sequences.lost[index]),
+                "duplicates": int(sequences.duplicates[index]),
+                "reordered": int(sequences.reordered[index]),
+            }
+        traces = {
+            self.traces[index]["topic"]: {
+                "checked": int(self.checked[index]),
+                "mismatched": int(self.mismatched[index]),
+                "worst_error": float(self.worst[index]),
+            }
+            for index in np.flatnonzero(self.mismatched).tolist()
+        }
+        return {
+            "seconds": time.monotonic() - self.started,
+            "received": int(sequences.received.sum()) + self.unstamped,
+            "unknown": self.unknown,
+            "malformed": self.malformed,
+            "unstamped": self.unstamped,
+            "lost": int(sequences.lost.sum()),
+            "duplicates": int(sequences.duplicates.sum()),
+            "reordered": int(sequences.reordered.sum()),
+            "restarts": int(sequences.restarts.sum()),
+            "checked": int(self.checked.sum()),
+            "mismatched": int(self.mismatched.sum()),
+            "histogram": self.histogram.tolist(),
+            "topics": topics,
+            "traces": traces,
+        }
+
+
+def merge(reports: List[dict]) -> dict:
+    """Report of several verifiers over different topics"""
+    merged: dict = {"topics": {}, "traces": {}}
+    for report in reports:
+        for key, value in report.items():
+            if key in ("topics", "traces"):
+                merged[key].update(value)
+            elif key == "histogram":
+                merged[key] = np.add(merged.get(key, 0), value).tolist()
+            elif key == "seconds":
+                merged[key] = max(merged.get(key, 0), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def summary(report: dict) -> str:
+    histogram = np.array(report.get("histogram", []))
+    latencies = ", ".join(
+        f"p{int(fraction * 100)} {value * 1000:.1f} ms"
+        for fraction in (0.5, 0.9, 0.99)
+        for value in [percentile(histogram, fraction)]
+        if value is not None
+    )
+    rate = report["received"] / max(report["seconds"], 1e-9)
+    return (
+        f"{report['received']} received ({rate:.0f}/s), "
+        f"{report['lost']} lost, {report['duplicates']} duplicates, "
+        f"{report['reordered']} out of order, {report['mismatched']} of "
+        f"{report['checked']} values wrong, {report['unknown']} unknown topics, "
+        f"{report['malformed']} malformed"
+        + (f", latency {latencies}" if latencies else "")
+    )
+
+
+def verify(
+    traces: List[dict],
+    host: str,
+    port: int,
+    seconds: float,
+    path: str = TRACES_PATH,
+    group_by: GroupBy = GroupBy.TRACE,
+    scenario: Optional[str] = None,
+    reports=None,
+) -> dict:
+    """Checks the messages of `traces` for `seconds`, or until interrupted"""
+    verifier = Verifier(
+        traces,
+        open_store(path),
+        group_by,
+        Scenario(scenario) if scenario else None,
+    )
+    client = MQTTClient()
+    client.on_message = verifier.on_message
+    client.on_connect = lambda client, *_: client.subscribe(verifier.subscriptions())
+    client.connect(host, port)
+    client.loop_start()
+    deadline = time.monotonic() + seconds if seconds else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            time.sleep(BATCH_INTERVAL)
+            verifier.process(verifier.take())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+    verifier.process(verifier.take())
+    report = verifier.report()
+    if reports is not None:
+        reports.put(report)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks that the messages of the simulator arrive and match "
+        "the traces, run the device with STAMP_MESSAGES=1"
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--path", default=TRACES_PATH, help="traces directory")
+    parser.add_argument("--seconds", type=float, default=0, help="0 until ctrl-c")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument(
+        "--group-by", type=GroupBy, default=GroupBy.TRACE, choices=list(GroupBy)
+    )
+    parser.add_argument("--scenario", help="scenario file of the device")
+    parser.add_argument("--report", help="json file with the whole report")
+    args = parser.parse_args()
+
+    traces = read_traces(args.path)
+    options = (args.host, args.port, args.seconds, args.path, args.group_by)
+    if args.processes > 1:
+        # Each process takes whole grids, so every topic is seen by one of them
+        reports = mp.Queue()
+        shards = partition(traces, args.processes, ShardBy.GRID, args.group_by)
+        processes = [
+            mp.Process(target=verify, args=(shard, *options, args.scenario, reports))
+            for shard in shards
+            if shard
+        ]
+        for process in processes:
+            process.start()
+        report = merge([reports.get() for _ in processes])
+        for process in processes:
+            process.join()
+    else:
+        report = verify(traces, *options, args.scenario)
+
+    logger.info(summary(report))
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    failed = report["lost"] + report["duplicates"] + report["mismatched"]
+    exit(1 if failed or not report["received"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,39 +3,84 @@
 # distance_to_next_tower values of the SplightSim line.
 # - Test these scripts and run them on SplighSim
 
+import argparse
 
+import requests
 import utils
 from splight_lib.models import Asset
 from tqdm import tqdm
 
+# Writes between two saves of the checkpoint, a crash repeats at most these
+SAVE_EVERY = 50
+
 
 def main():
+    parser = argparse.ArgumentParser(
+        description="Updates the altitude, distance and span of every segment"
+    )
+    parser.add_argument("--checkpoint", default=utils.CHECKPOINT_PATH)
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="report the values that differ without writing them",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="read every segment again instead of resuming",
+    )
+    args = parser.parse_args()
+
+    checkpoint = utils.Checkpoint(args.checkpoint)
+    if args.restart:
+        checkpoint.segments = {}
     altitude_client = utils.OpenElevationClient()
     all_assets = Asset.list(type__in="Segment")
 
+    # A segment that cannot be read stops the run, without it the previous
+    # segment would get a distance of 0. What was read is kept for the next one
     asset_dict: dict[str, utils.Tower] = {}
-    for asset in tqdm(all_assets, desc="Creating segment dictionary", unit="segments"):
-        full_asset = Asset.retrieve(asset.id)
-        asset_dict[asset.name] = utils.Tower(full_asset, altitude_client)
-
-    # go through each segment and update the database
-    for asset_name in tqdm(
-        asset_dict.keys(), desc="Updating metadata", unit="segments"
-    ):
-        tower = asset_dict[asset_name]
-        utils.set_metadata(tower.altitude_id, str(tower.location.alt))
-        if tower.next_tower in asset_dict.keys():
-            next_tower = asset_dict[tower.next_tower]
-            _ = utils.set_metadata(
-                tower.distance_id,
-                str(tower.location.distance_from(next_tower.location)),
-            )
-            span_length = tower.span_length_from(next_tower)
-            _ = utils.set_metadata(tower.span_length_id, str(span_length))
-            # utils.set_metadata(tower.span_length_id, "20")
-        else:
-            _ = utils.set_metadata(tower.distance_id, "0")
-            _ = utils.set_metadata(tower.span_length_id, "0")
+    try:
+        for asset in tqdm(
+            all_assets, desc="Creating segment dictionary", unit="segments"
+        ):
+            record = checkpoint.segments.get(asset.name)
+            if record is None:
+                record = utils.segment_record(Asset.retrieve(asset.id))
+            asset_dict[asset.name] = checkpoint.tower(record, altitude_client)
+    finally:
+        checkpoint.save()
+
+    writes = utils.planned_writes(asset_dict)
+    if args.dry_run:
+        for write in writes:
+            print(f"{write.segment} {write.name}: {write.current} -> {write.value}")
+        print(f"{len(writes)} of {3 * len(asset_dict)} values would be written")
+        return
+
+    # A failed write is retried by the next run, the others go on
+    failed = []
+    try:
+        for count, write in enumerate(
+            tqdm(writes, desc="Updating metadata", unit="values"), 1
+        ):
+            try:
+                utils.set_metadata(write.metadata_id, write.value)
+            except (AssertionError, requests.RequestException) as error:
+                tqdm.write(f"{write.segment} {write.name}: {error}")
+                failed.append(write)
+                continue
+            checkpoint.written(write)
+            if count % SAVE_EVERY == 0:
+                checkpoint.save()
+    finally:
+        checkpoint.save()
+
+    print(f"Wrote {len(writes) - len(failed)} of {3 * len(asset_dict)} values")
+    if failed:
+        print(f"{len(failed)} failed, run again to retry them")
+        raise SystemExit(1)
+    checkpoint.finish()
 
 
 if __name__ == "__main__":
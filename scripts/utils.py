@@ -1,6 +1,9 @@
 from __future__ import annotations
 
+import json
+import os
 import re
+from typing import NamedTuple
 
 import haversine as hs
 import numpy as np
@@ -8,6 +11,16 @@ import requests
 from splight_lib.models import SplightDatabaseBaseModel
 
 OPEN_ELEVATION_URL = "https://api.open-elevation.com/api/v1/lookup"
+# Values computed and written by a run, kept until it finishes without errors
+CHECKPOINT_PATH = "segment_updater.checkpoint.json"
+# Metres a new value has to differ from the current one to be written
+TOLERANCE = 0.01
+# Metadata written for every segment, and the Tower attribute with its id
+UPDATED_METADATA = {
+    "altitude": "altitude_id",
+    "distance_to_next_tower": "distance_id",
+    "span_length": "span_length_id",
+}
 
 
 class OpenElevationClient:
@@ -54,15 +67,19 @@ class Tower:
     def create_from(
         self, full_asset: SplightDatabaseBaseModel, client: OpenElevationClient
     ):
-        self.id = full_asset.id
-        self.location = get_location(full_asset, client)
-        self.next_tower = get_next_tower(full_asset.name)
-        metadata_dict = {meta.name: meta for meta in full_asset.metadata}
-        # self.altitude_id = get_metadata_id(full_asset, "altitude")
-        self.altitude_id = metadata_dict["altitude"].id
-        self.distance_id = metadata_dict["distance_to_next_tower"].id
-        self.span_length_id = metadata_dict["span_length"].id
-        self.line_height = metadata_dict["line_height"].value
+        self.load(segment_record(full_asset), get_location(full_asset, client))
+
+    def load(self, record: dict, location: Location):
+        """Tower of a segment as saved by `segment_record`"""
+        self.id = record["id"]
+        self.location = location
+        self.next_tower = get_next_tower(record["name"])
+        metadata_dict = record["metadata"]
+        self.altitude_id = metadata_dict["altitude"]["id"]
+        self.distance_id = metadata_dict["distance_to_next_tower"]["id"]
+        self.span_length_id = metadata_dict["span_length"]["id"]
+        self.line_height = metadata_dict["line_height"]["value"]
+        self.current = {name: meta["value"] for name, meta in metadata_dict.items()}
 
     def create_for_test(self):
         self.id = "the-test-0"
@@ -72,6 +89,7 @@ class Tower:
         self.distance_id = "distance_id"
         self.span_length_id = "span_id"
         self.line_height = 35
+        self.current = {}
 
     def span_length_from(self, other_tower: Tower) -> float:
         # span_length^2 = distance^2 + diff_in_altitude^2
@@ -91,6 +109,105 @@ def get_location(
     return Location(lat, lng, client.get_altitude(lat, lng))
 
 
+def segment_record(asset: SplightDatabaseBaseModel) -> dict:
+    """What the updater needs of a segment, as plain json"""
+    return {
+        "id": asset.id,
+        "name": asset.name,
+        "coordinates": list(asset.centroid_coordinates),
+        "metadata": {
+            meta.name: {"id": meta.id, "value": meta.value} for meta in asset.metadata
+        },
+    }
+
+
+class Checkpoint:
+    """Altitudes looked up, segments read and metadata written by the
+    updater, saved to a json file so a run that fails resumes where it
+    stopped instead of calling the APIs again for every segment.
+
+    Altitudes are kept across runs, they only depend on the coordinates.
+    The segments read are dropped by `finish` once every write succeeded,
+    so the next run compares against the metadata as it is then.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH):
+        self.path = path
+        self.altitudes: dict[str, float] = {}
+        self.segments: dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = json.load(f)
+            self.altitudes = saved["altitudes"]
+            self.segments = saved["segments"]
+
+    def altitude(self, lat: float, lng: float, client: OpenElevationClient) -> float:
+        key = f"{lat},{lng}"
+        if key not in self.altitudes:
+            self.altitudes[key] = client.get_altitude(lat, lng)
+        return self.altitudes[key]
+
+    def tower(self, record: dict, client: OpenElevationClient) -> Tower:
+        """Tower of a segment, with its record kept for the next run"""
+        self.segments[record["name"]] = record
+        lng, lat = record["coordinates"]
+        tower = Tower()
+        tower.load(record, Location(lat, lng, self.altitude(lat, lng, client)))
+        return tower
+
+    def written(self, write: Write):
+        self.segments[write.segment]["metadata"][write.name]["value"] = write.value
+
+    def save(self):
+        # Replaced at once, a crash while saving keeps the previous checkpoint
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({"altitudes": self.altitudes, "segments": self.segments}, f)
+        os.replace(temporary, self.path)
+
+    def finish(self):
+        self.segments = {}
+        self.save()
+
+
+class Write(NamedTuple):
+    segment: str
+    name: str
+    metadata_id: str
+    current: object
+    value: str
+
+
+def differs(current, value: float) -> bool:
+    try:
+        return abs(float(current) - value) > TOLERANCE
+    except (TypeError, ValueError):
+        return True
+
+
+def planned_writes(towers: dict[str, Tower]) -> list[Write]:
+    """Metadata of every segment whose current value differs from the
+    computed one"""
+    writes = []
+    for name, tower in towers.items():
+        values = {"altitude": tower.location.alt}
+        next_tower = towers.get(tower.next_tower)
+        if next_tower is not None:
+            values["distance_to_next_tower"] = tower.location.distance_from(
+                next_tower.location
+            )
+            values["span_length"] = tower.span_length_from(next_tower)
+        else:
+            values["distance_to_next_tower"] = 0
+            values["span_length"] = 0
+        for metadata, value in values.items():
+            current = tower.current.get(metadata)
+            if differs(current, value):
+                metadata_id = getattr(tower, UPDATED_METADATA[metadata])
+                writes.append(Write(name, metadata, metadata_id, current, str(value)))
+    return writes
+
+
 def get_next_tower(asset_name: str) -> str | None:
     # assumes segment 0 is connected to segement 1 i.e. segements created in order they are connected
     # TODO: add to segment kind the next segment's ID
@@ -1,9 +1,24 @@
+import json
+import queue
+import sys
+import time
 from pathlib import Path
+from typing import NamedTuple, Optional
 
 import pytest
+from paho.mqtt.client import MQTT_ERR_NO_CONN, MQTT_ERR_SUCCESS
 
 from scripts import utils
 
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+# Device modules are deployed flat in their container and import each other
+# by module name
+sys.path.append(str(Path(__file__).resolve().parent.parent / "devices/mqtt"))
+sys.path.append(str(Path(__file__).resolve().parent.parent / "devices/modbus"))
+# Trace builders too, run as scripts from the traces directory
+sys.path.append(str(Path(__file__).resolve().parent.parent / "traces"))
+
 
 @pytest.fixture
 def srtm_path():
@@ -15,3 +30,91 @@ def srtm_path():
 def altitude_client():
     client = utils.OpenElevationClient()
     return client
+
+
+@pytest.fixture
+def tick_messages():
+    """Messages a scheduler sends in a tick at `when` for trace definitions
+    read from `store`"""
+    from scheduler import Scheduler
+
+    def tick(store, definitions, when):
+        shared_queue = queue.Queue()
+        scheduler = Scheduler(shared_queue, traces=definitions, store=store)
+        scheduler.load_traces()
+        scheduler.tick(when)
+        return [json.loads(shared_queue.get()) for _ in range(shared_queue.qsize())]
+
+    return tick
+
+
+@pytest.fixture
+def calama_traces():
+    """Trace definitions of the Calama grid in data/mqtt/traces, with
+    `fields` set on every one"""
+
+    def load(**fields):
+        with open(TRACES_PATH / "traces.json") as f:
+            traces = json.load(f)["traces"]
+        return [
+            {**trace, **fields}
+            for trace in traces
+            if trace["topic"].startswith("Calama/")
+        ]
+
+    return load
+
+
+class FakeResult(NamedTuple):
+    rc: int
+
+
+class Published(NamedTuple):
+    topic: str
+    data: str
+    retain: bool
+    alias: Optional[int]
+
+
+class FakeClient:
+    """MQTT client recording what it publishes, without a broker.
+
+    Publishing fails while `connected` is False and takes `delay` seconds.
+    """
+
+    def __init__(self, connected: bool = True, delay: float = 0.0):
+        self.connected = connected
+        self.delay = delay
+        self.published: list[Published] = []
+        self.disconnected = False
+
+    def publish(self, topic, data, qos=0, retain=False, properties=None):
+        if self.delay:
+            time.sleep(self.delay)
+        if not self.connected:
+            return FakeResult(MQTT_ERR_NO_CONN)
+        alias = properties.TopicAlias if properties is not None else None
+        self.published.append(Published(topic, data, retain, alias))
+        return FakeResult(MQTT_ERR_SUCCESS)
+
+    def connect(self, host, port):
+        pass
+
+    def connect_async(self, host, port):
+        pass
+
+    def loop_start(self):
+        pass
+
+    def loop_stop(self):
+        pass
+
+    def disconnect(self):
+        self.connected = False
+        self.disconnected = True
+
+
+@pytest.fixture
+def fake_client():
+    """Makes fake MQTT clients, see `FakeClient`"""
+    return FakeClient
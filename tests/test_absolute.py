@@ -0,0 +1,72 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from clock import Clock
+from store import Lookup, TraceStore, to_timestamp
+
+
+@pytest.fixture
+def store(tmp_path):
+    (tmp_path / "scada.csv").write_text(
+        "timestamp,power,status\n"
+        "2024-01-01 00:10:00+00:00,30.0,false\n"
+        "2024-01-01 00:00:00+00:00,10.0,true\n"
+        "2024-01-01 00:20:00+00:00,20.0,true\n"
+    )
+    return TraceStore(str(tmp_path))
+
+
+@pytest.fixture
+def parse(store, tick_messages):
+    def message(when, lookup):
+        trace = {
+            "name": "power",
+            "topic": "scada/power",
+            "filename": "scada.csv",
+            "noise_factor": 0,
+            "match_timestamp_by": "absolute",
+            "target_value": "power",
+            "lookup": lookup.value,
+        }
+        messages = tick_messages(store, [trace], when)
+        return messages[0] if messages else {}
+
+    return message
+
+
+class TestAbsolute:
+    @pytest.mark.parametrize(
+        ("lookup", "expected"),
+        ((Lookup.PREVIOUS, 10.0), (Lookup.NEAREST, 30.0), (Lookup.INTERPOLATE, 26.0)),
+    )
+    def test_between_samples(self, parse, lookup, expected):
+        data = parse(datetime(2024, 1, 1, 0, 8), lookup)
+        assert data["value"] == pytest.approx(expected)
+        assert data["topic"] == "scada/power"
+        assert data["timestamp"] == "2024-01-01T00:08:00"
+
+    def test_exact_sample(self, parse):
+        data = parse(datetime(2024, 1, 1, 0, 10), Lookup.INTERPOLATE)
+        assert data["value"] == 30.0
+        assert data["status"] is False
+
+    def test_timezone_aware(self, parse):
+        when = datetime(2024, 1, 1, 0, 20, tzinfo=timezone.utc)
+        assert parse(when, Lookup.PREVIOUS)["value"] == 20.0
+
+    @pytest.mark.parametrize("lookup", list(Lookup))
+    def test_out_of_range(self, parse, lookup):
+        assert not parse(datetime(2023, 12, 31, 23, 59), lookup)
+        assert not parse(datetime(2024, 1, 1, 0, 21), lookup)
+
+    def test_real_clock_outside_utc(self, monkeypatch):
+        monkeypatch.setenv("TZ", "Etc/GMT+3")
+        time.tzset()
+        try:
+            tick = next(Clock().ticks())
+            assert tick.utcoffset() == timedelta(hours=-3)
+            assert abs(to_timestamp(tick) - time.time_ns()) < 5 * 10**9
+        finally:
+            monkeypatch.undo()
+            time.tzset()
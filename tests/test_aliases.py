@@ -0,0 +1,106 @@
+import queue
+
+import pytest
+from aliases import PackedProperties, TopicAliases
+from ingestor import Ingestor
+from paho.mqtt.client import MQTTv5
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+
+class Connack:
+    TopicAliasMaximum = 2
+
+
+class TestTopicAliases:
+    def test_packed_once(self):
+        properties = Properties(PacketTypes.PUBLISH)
+        properties.TopicAlias = 300
+        assert PackedProperties(300).pack() == properties.pack()
+
+    def test_least_recently_used_is_reassigned(self):
+        aliases = TopicAliases(2)
+        assert aliases.lookup("a")[0] == "a"
+        assert aliases.lookup("b")[0] == "b"
+        assert aliases.lookup("a")[0] == ""
+        topic, properties = aliases.lookup("c")
+        # b was used least recently, c takes its alias
+        assert (topic, properties.TopicAlias) == ("c", 2)
+        # Then a is the oldest, b takes its alias
+        assert aliases.lookup("b")[1].TopicAlias == 1
+        assert len(aliases) == 2
+
+    def test_forget_gives_the_alias_back(self):
+        aliases = TopicAliases(3)
+        for topic in "abc":
+            aliases.lookup(topic)
+        aliases.forget("b")
+        assert aliases.lookup("d")[1].TopicAlias == 2
+        assert aliases.lookup("a")[1].TopicAlias == 1
+        assert aliases.lookup("c")[1].TopicAlias == 3
+
+    def test_reset(self):
+        aliases = TopicAliases(5)
+        aliases.lookup("a")
+        aliases.reset(0)
+        assert aliases.lookup("a") == ("a", None)
+        aliases.reset(10)
+        assert aliases.limit == 5
+
+
+def sent(client):
+    return [(published.topic, published.alias) for published in client.published]
+
+
+class TestIngestorAliases:
+    @pytest.fixture
+    def make_ingestor(self, fake_client):
+        def make(**options):
+            ingestor = Ingestor(
+                queue.Queue(), protocol=MQTTv5, topic_aliases=10, **options
+            )
+            ingestor.client = fake_client()
+            return ingestor
+
+        return make
+
+    def test_alias_after_first_message(self, make_ingestor):
+        ingestor = make_ingestor()
+        ingestor.on_connect(ingestor.client, None, {}, 0, Connack())
+        for topic in ("grid/a", "grid/a", "grid/b", "grid/c", "grid/a"):
+            ingestor.send("{}", topic)
+        assert sent(ingestor.client) == [
+            ("grid/a", 1),
+            ("", 1),
+            ("grid/b", 2),
+            # The broker takes two aliases, grid/a was used least recently
+            ("grid/c", 1),
+            ("grid/a", 2),
+        ]
+        assert ingestor.metrics.snapshot()["aliased"] == 1
+
+    def test_reconnect_forgets_aliases(self, make_ingestor):
+        ingestor = make_ingestor()
+        ingestor.on_connect(ingestor.client, None, {}, 0, Connack())
+        ingestor.send("{}", "grid/a")
+        ingestor.client.connected = False
+        ingestor.send("{}", "grid/b")
+        ingestor.client.connected = True
+        ingestor.on_connect(ingestor.client, None, {}, 0, Connack())
+        ingestor.send("{}", "grid/a")
+        ingestor.send("{}", "grid/b")
+        assert sent(ingestor.client) == [
+            ("grid/a", 1),
+            ("grid/a", 1),
+            ("grid/b", 2),
+        ]
+
+    def test_broker_without_aliases(self, make_ingestor):
+        ingestor = make_ingestor()
+        ingestor.on_connect(ingestor.client, None, {}, 0, None)
+        ingestor.send("{}", "grid/a")
+        ingestor.send("{}", "grid/a")
+        assert sent(ingestor.client) == [("grid/a", None), ("grid/a", None)]
+
+    def test_no_aliases_with_qos(self, make_ingestor):
+        assert make_ingestor(qos=1).aliases is None
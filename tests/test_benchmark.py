@@ -0,0 +1,26 @@
+from benchmark import Case, build_cases, call_cases, compare, measure
+
+
+class TestBenchmark:
+    def test_compare(self):
+        baseline = {"fast": 1.0, "slow": 1.0, "same": 2.0}
+        results = {"fast": 0.5, "slow": 1.5, "same": 2.4, "new": 3.0}
+        assert compare(results, baseline, 0.25) == [("slow", 1.5)]
+        assert compare(results, baseline, 0.1) == [("slow", 1.5), ("same", 1.2)]
+
+    def test_measure_per_call(self):
+        calls = []
+        case = Case("append", lambda: calls.append(1), calls=10, repeats=3)
+        assert measure(case) > 0
+        assert len(calls) == 30
+
+    def test_cases(self):
+        names = [case.name for case in call_cases() + build_cases((60,), (50,))]
+        assert len(names) == len(set(names))
+        assert "solar_gaussian" in names
+        assert "build[Calama,60m]" in names
+        assert "build[Synthetic,50 buses,60m]" in names
+
+    def test_build(self):
+        case = next(case for case in build_cases((5,), ()) if "Atlantica" in case.name)
+        assert measure(case._replace(repeats=1)) > 0
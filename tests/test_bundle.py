@@ -0,0 +1,86 @@
+import multiprocessing as mp
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pytest
+from bundle import (
+    SharedTraceStore,
+    publish,
+    read_bundle,
+)
+from store import Lookup, TimeUnit, TraceStore
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+FILENAMES = ["Calama/active_power.csv", "Calama/switch_status.csv"]
+
+
+@pytest.fixture
+def bundle_path(tmp_path):
+    store = TraceStore(str(TRACES_PATH))
+    store.load(FILENAMES)
+    path = str(tmp_path / "traces.bundle")
+    publish(store, path)
+    return path
+
+
+def read_in_process(path, filename, result):
+    store = SharedTraceStore(path)
+    row = store.get(filename).row(datetime(2024, 1, 1, 8), TimeUnit.HOUR, Lookup.EXACT)
+    result.put(row.tolist())
+
+
+class TestBundle:
+    def test_same_values_as_csv(self, bundle_path):
+        store = TraceStore(str(TRACES_PATH))
+        shared = SharedTraceStore(bundle_path)
+        assert len(shared) == 2
+        for filename in FILENAMES:
+            original, attached = store.get(filename), shared.get(filename)
+            assert attached.columns == original.columns
+            np.testing.assert_array_equal(attached.values, original.values)
+            np.testing.assert_array_equal(attached.booleans, original.booleans)
+            for minutes in range(0, 24 * 60, 37):
+                when = datetime(2024, 3, 5) + timedelta(minutes=minutes, seconds=20)
+                for lookup in Lookup:
+                    np.testing.assert_array_equal(
+                        attached.row(when, TimeUnit.HOUR, lookup),
+                        original.row(when, TimeUnit.HOUR, lookup),
+                    )
+
+    def test_read_only(self, bundle_path):
+        files = read_bundle(bundle_path)
+        assert not files[FILENAMES[0]].values.flags.writeable
+        with pytest.raises(ValueError):
+            files[FILENAMES[0]].values[0, 0] = 1
+
+    def test_missing_files_are_read_from_disk(self, bundle_path):
+        shared = SharedTraceStore(bundle_path, str(TRACES_PATH))
+        assert "Calama/frequency.csv" not in shared
+        assert len(shared.get("Calama/frequency.csv")) == 24 * 60
+
+    def test_attach_without_bundle(self, tmp_path):
+        assert SharedTraceStore.attach(None) is None
+        assert SharedTraceStore.attach(str(tmp_path / "missing.bundle")) is None
+
+    def test_not_a_bundle(self, tmp_path):
+        path = tmp_path / "traces.bundle"
+        path.write_bytes(b"timestamp,value\n" * 4)
+        with pytest.raises(ValueError):
+            read_bundle(str(path))
+
+    def test_other_process(self, bundle_path):
+        result = mp.get_context("spawn").Queue()
+        process = mp.get_context("spawn").Process(
+            target=read_in_process, args=(bundle_path, FILENAMES[0], result)
+        )
+        process.start()
+        row = result.get(timeout=30)
+        process.join()
+        expected = TraceStore(str(TRACES_PATH)).get(FILENAMES[0])
+        assert (
+            row
+            == expected.row(
+                datetime(2024, 1, 1, 8), TimeUnit.HOUR, Lookup.EXACT
+            ).tolist()
+        )
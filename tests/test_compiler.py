@@ -0,0 +1,159 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+from bundle import SharedTraceStore, open_store
+from compiler import compile_bundle, compile_traces
+from scheduler import PayloadTemplate, read_traces
+
+
+def trace(name, **fields):
+    return {
+        "name": name,
+        "topic": f"grid/{name}",
+        "filename": "grid/values.csv",
+        "noise_factor": None,
+        "match_timestamp_by": "hour",
+        "target_value": "power",
+        **fields,
+    }
+
+
+@pytest.fixture
+def traces_path(tmp_path):
+    (tmp_path / "grid").mkdir()
+    rows = [
+        f"2024-01-01 {hour:02d}:{minute:02d}:00,{hour + minute / 60},true"
+        for hour in range(24)
+        for minute in range(60)
+    ]
+    (tmp_path / "grid/values.csv").write_text(
+        "timestamp,power,status\n" + "\n".join(rows) + "\n"
+    )
+    (tmp_path / "grid/coarse.csv").write_text(
+        "timestamp,power\n2024-01-01 00:00:00,1\n2024-01-01 12:00:00,2\n"
+    )
+    return tmp_path
+
+
+def write_traces(path, traces):
+    (path / "traces.json").write_text(json.dumps({"traces": traces}))
+
+
+class TestCompile:
+    def test_resolves_traces(self, traces_path):
+        compiled = compile_traces(
+            [trace("power"), trace("status", target_value="status")],
+            str(traces_path),
+        )
+        assert compiled.errors == [] and compiled.warnings == []
+        assert list(compiled.files) == ["grid/values.csv"]
+        assert [t["column"] for t in compiled.traces] == [0, 1]
+        assert compiled.traces[0]["lookup"] == "exact"
+
+    @pytest.mark.parametrize(
+        ("fields", "message"),
+        (
+            ({"target_value": "voltage"}, "column voltage not in grid/values.csv"),
+            ({"filename": "grid/missing.csv"}, "file grid/missing.csv not found"),
+            ({"match_timestamp_by": "week"}, "'week' is not a valid TimeUnit"),
+            ({"lookup": "spline"}, "'spline' is not a valid Lookup"),
+            ({"unit": "kW"}, "unknown fields unit on topic grid/bad"),
+            (
+                {"unit": "kW", "scale": 2},
+                "unknown fields scale, unit on topic grid/bad",
+            ),
+            (
+                {"noise_model": "bounded", "noise_bound": 0},
+                "Noise bound must be positive",
+            ),
+            (
+                {"noise_model": "ar1", "noise_correlation": 1},
+                "AR(1) correlation must be in [0, 1)",
+            ),
+        ),
+    )
+    def test_errors(self, traces_path, fields, message):
+        compiled = compile_traces(
+            [trace("ok"), trace("bad", **fields)], str(traces_path)
+        )
+        assert len(compiled.errors) == 1
+        assert compiled.errors[0].startswith("Trace 1 (bad): ")
+        assert message in compiled.errors[0]
+        assert len(compiled.traces) == 1
+
+    def test_warnings(self, traces_path):
+        compiled = compile_traces(
+            [
+                trace("coarse", filename="grid/coarse.csv"),
+                trace("filled", filename="grid/coarse.csv", lookup="previous"),
+                trace("again", topic="grid/filled"),
+            ],
+            str(traces_path),
+        )
+        assert compiled.errors == []
+        assert len(compiled.warnings) == 2
+        assert "1438 minutes of each hour period have no data" in compiled.warnings[0]
+        assert "topic grid/filled also used by Trace 1" in compiled.warnings[1]
+
+    def test_no_bundle_with_errors(self, traces_path):
+        write_traces(traces_path, [trace("bad", target_value="voltage")])
+        assert compile_bundle(str(traces_path)).errors
+        assert not os.path.exists(traces_path / "traces.bundle")
+
+
+class TestCompiledBundle:
+    def test_scheduler_inputs(self, traces_path):
+        write_traces(traces_path, [trace("power")])
+        assert "column" not in read_traces(str(traces_path))[0]
+        compile_bundle(str(traces_path))
+        assert read_traces(str(traces_path))[0]["column"] == 0
+        store = open_store(str(traces_path))
+        assert isinstance(store, SharedTraceStore)
+        # Only the files used by the traces are compiled
+        assert "grid/values.csv" in store and "grid/coarse.csv" not in store
+
+    def test_outdated_trace_table(self, traces_path):
+        write_traces(traces_path, [trace("power")])
+        compile_bundle(str(traces_path))
+        bundle_path = traces_path / "traces.bundle"
+        write_traces(traces_path, [trace("status", target_value="status")])
+        os.utime(traces_path / "traces.json", (bundle_path.stat().st_mtime + 1,) * 2)
+        assert read_traces(str(traces_path))[0]["name"] == "status"
+
+    def test_changed_files_are_read_from_disk(self, traces_path):
+        write_traces(traces_path, [trace("power")])
+        compile_bundle(str(traces_path))
+        source = traces_path / "grid/values.csv"
+        source.write_text("timestamp,power\n2024-01-01 00:00:00,2.5\n")
+        mtime = (traces_path / "traces.bundle").stat().st_mtime + 1
+        os.utime(source, (mtime, mtime))
+        store = open_store(str(traces_path))
+        assert "grid/values.csv" not in store
+        assert store.get("grid/values.csv").values.tolist() == [[2.5]]
+
+
+class TestPayloadTemplate:
+    @pytest.mark.parametrize(
+        "record",
+        (
+            {"a": 1.5, "b": True},
+            {"value": 3.0, "other": -1.0},
+            {"topic": 2.0, "value": 1.0},
+            {"x": float("nan")},
+        ),
+    )
+    def test_same_as_message(self, record):
+        when = datetime(2024, 1, 1, 10, 30)
+        template = PayloadTemplate(list(record))
+        parts = template.render(record, when)
+        expected = {
+            "timestamp": when.isoformat(),
+            **record,
+            "value": 7.25,
+            "topic": "grid/asset/x",
+        }
+        assert template.fill(parts, "7.25", '"grid/asset/x"') == json.dumps(
+            expected, default=str
+        )
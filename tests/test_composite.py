@@ -0,0 +1,91 @@
+import json
+import queue
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from clock import VirtualClock
+from scheduler import GroupBy, Scheduler, group_key
+from store import TraceStore
+from supervisor import ShardBy, partition
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+
+@pytest.mark.parametrize(
+    ("group_by", "expected"),
+    (
+        (GroupBy.TRACE, ("Calama/CAL-NCH/contingency", "value")),
+        (GroupBy.ASSET, ("Calama/CAL-NCH", "contingency")),
+        (GroupBy.GRID, ("Calama", "CAL-NCH/contingency")),
+    ),
+)
+def test_group_key(group_by, expected):
+    assert group_key("Calama/CAL-NCH/contingency", group_by) == expected
+
+
+def run(traces, group_by, minutes=1):
+    start = datetime(2024, 3, 1, 10)
+    shared_queue = queue.Queue()
+    Scheduler(
+        shared_queue,
+        traces=traces,
+        store=TraceStore(str(TRACES_PATH)),
+        clock=VirtualClock(start, start + timedelta(minutes=minutes)),
+        group_by=group_by,
+    ).start()
+    return [json.loads(shared_queue.get()) for _ in range(shared_queue.qsize())]
+
+
+class TestComposite:
+    def test_one_message_per_asset(self, calama_traces):
+        traces = calama_traces()
+        single = run(traces, GroupBy.TRACE)
+        grouped = run(traces, GroupBy.ASSET)
+        assets = {trace["topic"].rsplit("/", 1)[0] for trace in traces}
+        assert len(single) == len(traces)
+        assert sorted(message["topic"] for message in grouped) == sorted(assets)
+
+        line = next(m for m in grouped if m["topic"] == "Calama/CAL-NCH")
+        assert line["timestamp"] == "2024-03-01T10:00:00"
+        assert len(line["values"]) == 15
+        for message in single:
+            asset, attribute = message["topic"].rsplit("/", 1)
+            if asset == "Calama/CAL-NCH":
+                assert line["values"][attribute] == message["value"]
+        assert isinstance(line["values"]["switch_status_start"], bool)
+
+    def test_one_message_per_grid(self, calama_traces):
+        traces = calama_traces()
+        (grid,) = run(traces, GroupBy.GRID)
+        assert grid["topic"] == "Calama"
+        assert len(grid["values"]) == len(traces)
+        assert "CAL-NCH/contingency" in grid["values"]
+
+    def test_suppressed_traces_are_left_out(self, calama_traces):
+        traces = [
+            {**trace, "deadband": 1e9}
+            for trace in calama_traces()
+            if trace["topic"].startswith("Calama/CAL-NCH/")
+        ]
+        traces[0] = {**traces[0], "deadband": None}
+        first, second = run(traces, GroupBy.ASSET, minutes=2)
+        assert len(first["values"]) == 15
+        assert list(second["values"]) == [traces[0]["topic"].rsplit("/", 1)[1]]
+
+    @pytest.mark.parametrize("group_by", (GroupBy.ASSET, GroupBy.GRID))
+    def test_tick_without_messages(self, group_by, calama_traces):
+        # Nothing changes by more than the deadband after the first tick
+        traces = [{**trace, "deadband": 1e9} for trace in calama_traces()]
+        first = run(traces, group_by, minutes=1)
+        assert run(traces, group_by, minutes=2) == first
+
+
+def test_hash_shards_keep_messages_together(calama_traces):
+    traces = calama_traces()
+    shards = partition(traces, 4, ShardBy.HASH, GroupBy.ASSET)
+    for shard in shards:
+        assets = {trace["topic"].rsplit("/", 1)[0] for trace in shard}
+        for other in shards:
+            if other is not shard:
+                assert not assets & {t["topic"].rsplit("/", 1)[0] for t in other}
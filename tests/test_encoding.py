@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bundle import read_bundle, write_bundle
+from encoding import BLOCK_ROWS, EncodedValues, Encoding
+from store import Lookup, TimeUnit, TraceFile
+
+ROWS = 3 * BLOCK_ROWS + 17
+
+
+def trace_file(values, booleans=None):
+    start = np.datetime64("2024-01-01T00:00", "ns").astype(np.int64)
+    timestamps = start + np.arange(len(values), dtype=np.int64) * 60 * 10**9
+    return TraceFile(
+        timestamps=timestamps,
+        wall=timestamps,
+        columns=[f"c{i}" for i in range(values.shape[1])],
+        booleans=np.zeros(values.shape[1], dtype=bool)
+        if booleans is None
+        else np.array(booleans),
+        values=values,
+    )
+
+
+def columns():
+    generator = np.random.default_rng(1)
+    status = np.ones(ROWS)
+    status[500:520] = 0
+    with_nan = np.round(generator.normal(220, 2, ROWS), 3)
+    with_nan[7] = np.nan
+    return np.column_stack(
+        [
+            np.full(ROWS, 50.0),
+            status,
+            np.round(49.9 + np.cumsum(generator.normal(0, 0.001, ROWS)), 3),
+            generator.normal(0, 1, ROWS),
+            with_nan,
+            np.full(ROWS, -0.0),
+        ]
+    )
+
+
+def bits(values):
+    return np.ascontiguousarray(values).view(np.uint64)
+
+
+class TestEncodedValues:
+    def test_picks_an_encoding_per_column(self):
+        encoded = EncodedValues.encode(columns())
+        assert [Encoding(value) for value in encoded.encodings] == [
+            Encoding.CONSTANT,
+            Encoding.RUNS,
+            Encoding.DELTA,
+            Encoding.XOR,
+            Encoding.XOR,
+            Encoding.CONSTANT,
+        ]
+        assert encoded.nbytes < columns().nbytes / 2
+
+    def test_decodes_exactly(self):
+        values = columns()
+        encoded = EncodedValues.encode(values)
+        np.testing.assert_array_equal(bits(encoded.decode()), bits(values))
+        for index in (0, 7, 499, 500, 519, 520, BLOCK_ROWS - 1, BLOCK_ROWS, ROWS - 1):
+            np.testing.assert_array_equal(bits(encoded.at(index)), bits(values[index]))
+
+    def test_cached_blocks(self):
+        encoded = EncodedValues.encode(columns())
+        for index in range(ROWS):
+            encoded.at(index)
+        assert len(encoded._cache) <= 4
+
+
+class TestEncodedTraceFile:
+    @pytest.mark.parametrize("lookup", list(Lookup))
+    def test_same_rows(self, lookup):
+        plain = trace_file(
+            columns(), booleans=[False, True, False, False, False, False]
+        )
+        encoded = plain.encode()
+        assert encoded.encoded is not None
+        for minutes in range(0, 24 * 60, 7):
+            when = datetime(2024, 3, 5) + timedelta(minutes=minutes, seconds=20)
+            np.testing.assert_array_equal(
+                encoded.row(when, TimeUnit.DAY_OF_WEEK, lookup),
+                plain.row(when, TimeUnit.DAY_OF_WEEK, lookup),
+            )
+
+    def test_empty_file_stays_plain(self):
+        empty = trace_file(np.empty((0, 2)))
+        assert empty.encode() is empty
+
+    def test_bundle_keeps_the_encoding(self, tmp_path):
+        path = str(tmp_path / "traces.bundle")
+        original = trace_file(columns())
+        write_bundle({"grid/values.csv": original}, path)
+        attached = read_bundle(path)["grid/values.csv"]
+        assert attached.encoded is not None
+        np.testing.assert_array_equal(bits(attached.values), bits(original.values))
+
+    def test_plain_bundle(self, tmp_path):
+        path = str(tmp_path / "traces.bundle")
+        write_bundle({"grid/values.csv": trace_file(columns())}, path, encode=False)
+        assert read_bundle(path)["grid/values.csv"].encoded is None
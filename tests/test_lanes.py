@@ -0,0 +1,119 @@
+import json
+import queue
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from clock import VirtualClock
+from lanes import LaneQueue, Lanes, make_queue
+from scheduler import GroupBy, Scheduler
+from store import TraceStore
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+
+def drain(lane_queue):
+    return [lane_queue.get_nowait() for _ in range(lane_queue.qsize())]
+
+
+class TestLanes:
+    def test_parse(self):
+        lanes = Lanes.parse("switch_status, contingency;active_power", "4,2,1")
+        assert lanes.attributes == (("switch_status", "contingency"), ("active_power",))
+        assert lanes.weights == (4, 2, 1)
+        assert Lanes.parse("") is None
+
+    @pytest.mark.parametrize("weights", ["1,1", "1,0,1"])
+    def test_invalid_weights(self, weights):
+        with pytest.raises(ValueError):
+            Lanes.parse("switch_status;active_power", weights)
+
+    def test_lane_by_attribute(self):
+        lanes = Lanes()
+        assert lanes.lane("Calama/CAL-NCH/switch_status_end") == 0
+        assert lanes.lane("Calama/PECalama/contingency") == 0
+        assert lanes.lane("Calama/PECalama/active_power") == 1
+
+    def test_without_lanes(self):
+        assert type(make_queue(None)) is queue.Queue
+
+
+class TestLaneQueue:
+    def test_strict_priority(self):
+        lane_queue = LaneQueue(Lanes())
+        for i in range(1000):
+            lane_queue.put((1, f"power {i}"))
+        lane_queue.put((0, "trip"))
+        assert lane_queue.get() == "trip"
+        assert drain(lane_queue) == [f"power {i}" for i in range(1000)]
+
+    def test_weighted(self):
+        lane_queue = LaneQueue(Lanes(weights=(3, 1)))
+        for i in range(20):
+            lane_queue.put((0, "status"))
+            lane_queue.put((1, "power"))
+        first = [lane_queue.get() for _ in range(8)]
+        assert first.count("status") == 6
+        # Once a lane is empty the others take all the turns
+        assert drain(lane_queue)[-10:] == ["power"] * 10
+
+    def test_sentinel_goes_first(self):
+        lane_queue = LaneQueue(Lanes())
+        lane_queue.put((1, "power"))
+        lane_queue.put_nowait(None)
+        assert lane_queue.get() is None
+        assert lane_queue.summary() == ""
+
+    def test_bounded_by_every_lane(self):
+        lane_queue = LaneQueue(Lanes(), maxsize=2)
+        lane_queue.put((1, "power"))
+        lane_queue.put((0, "trip"))
+        with pytest.raises(queue.Full):
+            lane_queue.put((0, "trip"), timeout=0)
+
+    def test_waits(self):
+        lane_queue = LaneQueue(Lanes())
+        lane_queue.put((0, "trip"))
+        lane_queue.put((1, "power"))
+        drain(lane_queue)
+        summary = lane_queue.summary()
+        assert summary.startswith("lane 0: 1 messages")
+        assert "p99 under 1 ms" in summary
+        snapshot = lane_queue.metrics.snapshot()
+        assert snapshot["lane0_dequeued"] == snapshot["lane1_dequeued"] == 1
+        assert lane_queue.summary() == ""
+
+
+def first_tick(traces, group_by):
+    start = datetime(2024, 3, 1, 10)
+    lane_queue = LaneQueue(Lanes())
+    Scheduler(
+        lane_queue,
+        traces=traces,
+        store=TraceStore(str(TRACES_PATH)),
+        clock=VirtualClock(start, start + timedelta(minutes=1)),
+        group_by=group_by,
+        lanes=Lanes(),
+    ).start()
+    return [json.loads(data) for data in drain(lane_queue)]
+
+
+class TestScheduler:
+    def test_status_first(self, calama_traces):
+        messages = first_tick(
+            calama_traces(deadband=None, max_silence=None), GroupBy.TRACE
+        )
+        lanes = [Lanes().lane(message["topic"]) for message in messages]
+        assert lanes == sorted(lanes)
+        assert lanes.count(0) == 7 + 6 + 7 + 7
+
+    def test_composite_with_status_first(self, calama_traces):
+        messages = first_tick(
+            calama_traces(deadband=None, max_silence=None), GroupBy.ASSET
+        )
+        status = [
+            any(Lanes().lane(key) == 0 for key in message["values"])
+            for message in messages
+        ]
+        assert status == sorted(status, reverse=True)
+        assert any(status) and not all(status)
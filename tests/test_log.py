@@ -0,0 +1,50 @@
+import logging
+import queue
+
+from log import CategoryFilter, DroppingQueueHandler, parse_settings
+
+
+def record(message="Enqueuing %s", args=("data",)):
+    return logging.LogRecord("messages", logging.INFO, __file__, 1, message, args, None)
+
+
+class TestCategoryFilter:
+    def test_sampling(self):
+        category_filter = CategoryFilter(every=10)
+        kept = [category_filter.filter(record()) for _ in range(100)]
+        assert sum(kept) == 10
+
+    def test_rate_limit(self):
+        category_filter = CategoryFilter(rate=5)
+        kept = [category_filter.filter(record()) for _ in range(100)]
+        assert sum(kept) == 5
+
+    def test_reports_dropped_records(self):
+        category_filter = CategoryFilter(rate=1000)
+        category_filter.bucket._tokens = 1
+        assert category_filter.filter(record())
+        category_filter.bucket._tokens = 0
+        category_filter.bucket.rate = 1e-9
+        assert not category_filter.filter(record())
+        assert not category_filter.filter(record())
+        category_filter.bucket._tokens = 1
+        kept = record()
+        assert category_filter.filter(kept)
+        assert kept.getMessage() == "Enqueuing data (2 more dropped)"
+
+
+class TestDroppingQueueHandler:
+    def test_never_blocks(self):
+        handler = DroppingQueueHandler(queue.Queue(2))
+        for _ in range(5):
+            handler.handle(record())
+        assert handler.queue.qsize() == 2
+        assert handler.dropped == 3
+
+
+def test_parse_settings():
+    assert parse_settings("messages=0.01, no_data=1") == {
+        "messages": 0.01,
+        "no_data": 1.0,
+    }
+    assert parse_settings(None) == {}
@@ -0,0 +1,136 @@
+import asyncio
+import socket
+import struct
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pytest
+from registers import RegisterMap, RegisterUpdater
+from scheduler import read_traces
+from server import GATEWAY_TARGET_FAILED, ILLEGAL_DATA_ADDRESS, ModbusServer
+from store import TraceStore
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+
+@pytest.fixture
+def unused_port():
+    """First of two consecutive free ports"""
+    while True:
+        with socket.socket() as first, socket.socket() as second:
+            first.bind(("127.0.0.1", 0))
+            port = first.getsockname()[1]
+            try:
+                second.bind(("127.0.0.1", port + 1))
+            except OSError:
+                continue
+            return port
+
+
+def traces(devices, attributes=("active_power", "reactive_power")):
+    return [
+        {
+            "name": f"grid/asset{i}/{attribute}",
+            "topic": f"grid/asset{i}/{attribute}",
+            "filename": "grid/values.csv",
+            "noise_factor": None,
+        }
+        for i in range(devices)
+        for attribute in attributes
+    ]
+
+
+async def read(port, unit, address, count, function=3, transaction=1):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        struct.pack(">HHHBBHH", transaction, 0, 6, unit, function, address, count)
+    )
+    header = await reader.readexactly(7)
+    _, _, length, _ = struct.unpack(">HHHB", header)
+    pdu = await reader.readexactly(length - 1)
+    writer.close()
+    return pdu
+
+
+def decode(pdu):
+    return list(np.frombuffer(pdu[2:], dtype=">f4"))
+
+
+class TestRegisterMap:
+    def test_layout(self):
+        register_map = RegisterMap(traces(3), units_per_port=2)
+        assert register_map.ports == 2
+        assert register_map.locations == [
+            (0, 1, 0),
+            (0, 1, 2),
+            (0, 2, 0),
+            (0, 2, 2),
+            (1, 1, 0),
+            (1, 1, 2),
+        ]
+        assert register_map.has_unit(1, 1)
+        assert not register_map.has_unit(1, 2)
+
+    def test_update_keeps_missing_values(self):
+        register_map = RegisterMap(traces(2))
+        register_map.update(np.array([1.5, 2.5, 3.5, 4.5]))
+        register_map.update(np.zeros(4), np.array([True, False, False, False]))
+        data = register_map.read(0, 1, 0, 4) + register_map.read(0, 2, 0, 4)
+        assert list(np.frombuffer(data, dtype=">f4")) == [0.0, 2.5, 3.5, 4.5]
+
+
+class TestModbusServer:
+    def test_reads(self, unused_port):
+        register_map = RegisterMap(traces(300))
+        register_map.update(np.arange(600, dtype=float))
+        server = ModbusServer(register_map, "127.0.0.1", unused_port)
+
+        async def scenario():
+            await server.start()
+            try:
+                assert len(server.servers) == 2
+                assert decode(await read(unused_port, 1, 0, 4)) == [0.0, 1.0]
+                assert decode(await read(unused_port, 2, 2, 2, function=4)) == [3.0]
+                # Unit 248 is device 247, served by the second port
+                assert decode(await read(unused_port + 1, 1, 0, 2)) == [494.0]
+                assert await read(unused_port, 1, 4, 2) == bytes(
+                    (0x83, ILLEGAL_DATA_ADDRESS)
+                )
+                assert await read(unused_port + 1, 100, 0, 2) == bytes(
+                    (0x83, GATEWAY_TARGET_FAILED)
+                )
+                # Many clients polling at once
+                polls = await asyncio.gather(
+                    *(read(unused_port, 1 + i % 247, 0, 2) for i in range(500))
+                )
+                assert [decode(pdu) for pdu in polls] == [
+                    [float(2 * (i % 247))] for i in range(500)
+                ]
+            finally:
+                await server.stop()
+
+        asyncio.run(scenario())
+
+
+class TestRegisterUpdater:
+    def test_tick(self):
+        definitions = [
+            trace
+            for trace in read_traces(str(TRACES_PATH))
+            if trace["filename"].startswith("Calama/")
+        ]
+        register_map = RegisterMap(definitions)
+        updater = RegisterUpdater(
+            register_map, traces=definitions, store=TraceStore(str(TRACES_PATH))
+        )
+        updater.load_traces()
+        now = datetime(2024, 1, 1, 12, 0)
+        updater.tick(now)
+        values, found, _ = updater.sample(now)
+        assert found.all()
+        for position, (port, unit, address) in enumerate(register_map.locations):
+            data = register_map.read(port, unit, address, 2)
+            assert np.frombuffer(data, dtype=">f4")[0] == pytest.approx(
+                values[position], rel=1e-6
+            )
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from noise import NoiseBuffer, NoiseEngine, NoiseModel
+
+
+def draw(buffer: NoiseBuffer, size: int) -> np.ndarray:
+    return np.array([buffer.next() for _ in range(size)])
+
+
+class TestNoiseBuffer:
+    @pytest.mark.parametrize("model", list(NoiseModel))
+    def test_seed_is_reproducible(self, model):
+        first = draw(NoiseBuffer(2.0, model, seed=7, block_size=100), 250)
+        second = draw(NoiseBuffer(2.0, model, seed=7, block_size=100), 250)
+        assert np.array_equal(first, second)
+
+    @pytest.mark.parametrize("model", list(NoiseModel))
+    def test_scale(self, model):
+        samples = draw(NoiseBuffer(2.0, model, seed=1), 20000)
+        assert samples.mean() == pytest.approx(0, abs=0.3)
+        # Truncating at 3 sigma barely changes the deviation
+        assert samples.std() == pytest.approx(2.0, rel=0.1)
+
+    def test_bounded(self):
+        samples = draw(NoiseBuffer(1.0, NoiseModel.BOUNDED, seed=1, bound=0.5), 5000)
+        assert np.abs(samples).max() <= 0.5
+
+    @pytest.mark.parametrize("bound", (0, -1.0))
+    def test_bound_must_be_positive(self, bound):
+        with pytest.raises(ValueError, match="bound"):
+            NoiseBuffer(1.0, NoiseModel.BOUNDED, bound=bound)
+
+    def test_tight_bound(self):
+        buffer = NoiseBuffer(1000.0, NoiseModel.BOUNDED, seed=1, bound=1e-6)
+        samples = draw(buffer, 5000)
+        assert np.abs(samples).max() <= 1e-6
+        assert np.unique(samples).size == 5000
+
+    @pytest.mark.parametrize("correlation", (0.0, 0.5, 0.9, 0.01))
+    def test_ar1_correlation(self, correlation):
+        buffer = NoiseBuffer(1.0, NoiseModel.AR1, seed=3, correlation=correlation)
+        samples = draw(buffer, 20000)
+        lag = np.corrcoef(samples[:-1], samples[1:])[0, 1]
+        assert lag == pytest.approx(correlation, abs=0.05)
+
+    def test_ar1_continues_between_blocks(self):
+        buffer = NoiseBuffer(
+            1.0, NoiseModel.AR1, seed=3, correlation=0.99, block_size=10
+        )
+        samples = draw(buffer, 100)
+        # Without carrying the last value each block would restart near zero
+        assert np.abs(np.diff(samples)).max() < 1
+
+
+class TestNoiseEngine:
+    def test_traces_do_not_depend_on_each_other(self):
+        alone = NoiseEngine(seed=42)
+        shared = NoiseEngine(seed=42)
+        shared.register("Calama/PECalama/active_power", 1.0)
+        [shared.next("Calama/PECalama/active_power", 1.0) for _ in range(10)]
+        assert alone.next("Marcona/SEIca/active_power", 1.0) == shared.next(
+            "Marcona/SEIca/active_power", 1.0
+        )
+
+    def test_traces_get_different_noise(self):
+        engine = NoiseEngine(seed=42)
+        assert engine.next("a", 1.0) != engine.next("b", 1.0)
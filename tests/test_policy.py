@@ -0,0 +1,94 @@
+import queue
+from datetime import datetime, timedelta
+
+import numpy as np
+from clock import VirtualClock
+from policy import PublishPolicy
+from scheduler import Scheduler
+from store import TraceStore
+
+
+def check(policy, values, now):
+    values = np.array(values, dtype=np.float64)
+    return policy.check(values, np.ones(len(values), dtype=bool), now).tolist()
+
+
+class TestPublishPolicy:
+    def test_without_policy_always_publishes(self):
+        policy = PublishPolicy([None], [None], [None], [False])
+        assert check(policy, [1.0], 0) == [True]
+        assert check(policy, [1.0], 60) == [True]
+
+    def test_absolute_deadband(self):
+        policy = PublishPolicy([0.5], [None], [None], [False])
+        assert check(policy, [10.0], 0) == [True]
+        assert check(policy, [10.4], 60) == [False]
+        # Compared against the last value sent, not the last one seen
+        assert check(policy, [10.6], 120) == [True]
+        assert check(policy, [10.2], 180) == [False]
+
+    def test_percent_deadband(self):
+        policy = PublishPolicy([None], [10], [None], [False])
+        assert check(policy, [200.0], 0) == [True]
+        assert check(policy, [215.0], 60) == [False]
+        assert check(policy, [179.0], 120) == [True]
+
+    def test_booleans_change_only(self):
+        policy = PublishPolicy([5.0], [None], [None], [True])
+        assert check(policy, [1.0], 0) == [True]
+        assert check(policy, [1.0], 60) == [False]
+        assert check(policy, [0.0], 120) == [True]
+
+    def test_booleans_without_deadband(self):
+        policy = PublishPolicy([None], [None], [300], [True])
+        assert check(policy, [1.0], 0) == [True]
+        assert check(policy, [1.0], 60) == [False]
+        assert check(policy, [0.0], 120) == [True]
+        # max_silence is the heartbeat of a boolean that does not change
+        assert check(policy, [0.0], 420) == [True]
+
+    def test_max_silence(self):
+        policy = PublishPolicy([0.0], [None], [300], [False])
+        assert check(policy, [50.0], 0) == [True]
+        assert check(policy, [50.0], 240) == [False]
+        assert check(policy, [50.0], 300) == [True]
+
+    def test_missing_data_is_not_published(self):
+        policy = PublishPolicy([None, 0.0], [None, None], [None, None], [False, False])
+        found = np.array([True, False])
+        assert policy.check(np.array([1.0, 1.0]), found, 0).tolist() == [True, False]
+        assert np.isnan(policy.last_value[1])
+
+
+class TestSchedulerPolicy:
+    def test_constant_values_are_sent_once(self, tmp_path):
+        rows = [
+            f"2024-01-01 00:{minute:02d}:00,50.0,{minute // 3}" for minute in range(60)
+        ]
+        (tmp_path / "grid.csv").write_text(
+            "timestamp,frequency,power\n" + "\n".join(rows)
+        )
+        traces = [
+            {
+                "name": name,
+                "topic": name,
+                "filename": "grid.csv",
+                "noise_factor": None,
+                "match_timestamp_by": "minute",
+                "target_value": name,
+                "deadband": 0.5,
+            }
+            for name in ("frequency", "power")
+        ]
+        start = datetime(2024, 1, 1)
+        shared_queue = queue.Queue()
+        scheduler = Scheduler(
+            shared_queue,
+            traces=traces,
+            store=TraceStore(str(tmp_path)),
+            clock=VirtualClock(start, start + timedelta(hours=1)),
+        )
+        scheduler.start()
+        # frequency once, power once every 3 minutes
+        assert shared_queue.qsize() == 1 + 20
+        assert scheduler.metrics.snapshot()["suppressed"] == 120 - 21
@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from generic import GridDefinition
+from grids.atlantica import AtlanticaGrid
+from grids.calama import CalamaGrid
+from powerflow import DCPowerFlow, Line, Network
+
+MESH = Network(
+    buses=["A", "B", "C", "D"],
+    lines={
+        "A-B": Line("A", "B", 0.02, 0.002),
+        "B-C": Line("B", "C", 0.03, 0.003),
+        "A-C": Line("A", "C", 0.04, 0.004),
+        "C-D": Line("C", "D", 0.01, 0.001),
+    },
+    slack="A",
+    generators={"G1": "B", "G2": "D"},
+    loads={"L1": "C"},
+)
+
+
+def mismatch(flow):
+    """Injection of each bus minus what its lines take from it"""
+    index = {bus: position for position, bus in enumerate(flow.network.buses)}
+    taken = np.zeros_like(flow.injections)
+    for position, line in enumerate(flow.network.lines.values()):
+        taken[:, index[line.start]] += flow.start[:, position]
+        taken[:, index[line.end]] += flow.end[:, position]
+    return flow.injections - taken
+
+
+class TestDCPowerFlow:
+    def test_radial(self):
+        network = Network(["A", "B"], {"A-B": Line("A", "B", 0.1)}, "A", {"G": "B"})
+        flow = DCPowerFlow(network).solve({"G": np.array([10.0, 20.0])})
+        np.testing.assert_allclose(flow.start[:, 0], [-10, -20])
+        np.testing.assert_allclose(flow.end[:, 0], [10, 20])
+        np.testing.assert_allclose(flow.injections[:, 0], [-10, -20])
+
+    def test_parallel_lines_split_by_reactance(self):
+        network = Network(
+            ["A", "B"],
+            {"1": Line("A", "B", 0.1), "2": Line("A", "B", 0.3)},
+            "A",
+            loads={"L": "B"},
+        )
+        flow = DCPowerFlow(network).solve({}, {"L": np.array([40.0])})
+        np.testing.assert_allclose(flow.flows[0], [30, 10])
+
+    def test_balanced_with_losses(self):
+        rng = np.random.default_rng(1)
+        flow = DCPowerFlow(MESH).solve(
+            {"G1": rng.uniform(0, 50, 100), "G2": rng.uniform(0, 50, 100)},
+            {"L1": rng.uniform(0, 80, 100)},
+        )
+        assert flow.losses.min() > 0
+        np.testing.assert_allclose(flow.start + flow.end, flow.losses)
+        # Every bus balances up to the second order change of the losses
+        assert np.abs(mismatch(flow)).max() < 1e-3 * np.abs(flow.flows).max()
+        np.testing.assert_allclose(flow.injections.sum(axis=1), flow.losses.sum(axis=1))
+
+    def test_buses(self):
+        flow = DCPowerFlow(MESH).solve(
+            {"G1": np.array([30.0]), "G2": np.array([10.0])}, {"L1": np.array([25.0])}
+        )
+        through = flow.buses()
+        # B and D only export their generators, C consumes what gets in
+        assert through["B"][0] == pytest.approx(30)
+        assert through["D"][0] == pytest.approx(10)
+        assert through["C"][0] == pytest.approx(25)
+        # The slack bus gets the surplus through A-B and loops some to C
+        assert through["A"][0] == pytest.approx(flow.lines(flow.start)["A-B"][0] * -1)
+
+    def test_not_connected(self):
+        network = Network(["A", "B", "C"], {"A-B": Line("A", "B", 0.1)}, "A")
+        with pytest.raises(ValueError, match="C"):
+            DCPowerFlow(network)
+
+    def test_unknown_bus(self):
+        network = Network(["A"], {"A-B": Line("A", "B", 0.1)}, "A")
+        with pytest.raises(ValueError, match="unknown bus B"):
+            DCPowerFlow(network)
+
+
+def test_grid_flows_follow_generation():
+    grid = CalamaGrid()
+    times = [datetime(2024, 1, 1) + timedelta(minutes=m) for m in range(0, 1440, 30)]
+    solved = grid.power_flow(times)
+    start, end = solved["active_power_start"], solved["active_power_end"]
+    generation = solved["active_power"]
+    # Everything generated upstream of Calama reaches it through two lines
+    np.testing.assert_allclose(
+        -end["LAS-CAL"] - end["VLV-CAL"],
+        generation["PFVJama"]
+        + generation["PFVSanPedro"]
+        + generation["PEValleDeLosVientos"]
+        - solved["active_power_loss"]["JAM-LAS"]
+        - solved["active_power_loss"]["LAS-CAL"]
+        - solved["active_power_loss"]["VLV-CAL"],
+        atol=1e-4,
+    )
+    np.testing.assert_allclose(
+        start["CAL-NCH"] + start["CAL-SAL"], generation["SECalama"], atol=1e-4
+    )
+
+
+def test_grid_without_network():
+    assert AtlanticaGrid().power_flow([datetime(2024, 1, 1)]) == {}
+
+
+def test_network_without_injections():
+    class NoInjections(CalamaGrid):
+        injections = GridDefinition.injections
+
+    with pytest.raises(TypeError, match="Grid Calama defines a network"):
+        NoInjections().power_flow([datetime(2024, 1, 1)])
@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+from control import ControlServer
+from profiling import Profiler, Profiling, Spans, spans
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestSpans:
+    def test_disabled_records_nothing(self):
+        timings = Spans()
+        with timings("send"):
+            pass
+        assert timings.snapshot() == {}
+
+    def test_enabled(self):
+        timings = Spans(enabled=True)
+        for _ in range(3):
+            with timings("send"):
+                time.sleep(0.001)
+        stats = timings.snapshot(reset=True)["send"]
+        assert stats["count"] == 3
+        assert stats["max_ms"] >= 1
+        assert stats["total_ms"] >= 3
+        assert timings.snapshot() == {}
+
+
+class TestProfiler:
+    def test_capture(self, tmp_path):
+        stop = threading.Event()
+        thread = threading.Thread(target=busy_loop, args=(stop,), name="scheduler")
+        thread.start()
+        try:
+            prefix = str(tmp_path / "profile")
+            Profiler(str(tmp_path)).capture(0.2, prefix)
+        finally:
+            stop.set()
+            thread.join()
+
+        folded = (tmp_path / "profile.folded").read_text().splitlines()
+        assert any(
+            line.startswith("scheduler;") and "busy_loop" in line for line in folded
+        )
+        assert int(folded[0].rsplit(" ", 1)[1]) > 0
+        assert tracemalloc.Snapshot.load(str(tmp_path / "profile.tracemalloc"))
+        assert "busy_loop" in (tmp_path / "profile.txt").read_text()
+        assert not tracemalloc.is_tracing()
+        assert not spans.enabled
+
+    def test_one_capture_at_a_time(self, tmp_path):
+        profiler = Profiler(str(tmp_path))
+        assert profiler.trigger(0.2) is not None
+        assert profiler.trigger(0.2) is None
+
+
+class TestControl:
+    def test_routes(self, tmp_path):
+        profiling = Profiling(directory=str(tmp_path), seconds=0.1)
+        control = ControlServer(0)
+        for path, handler in profiling.routes(Profiler(str(tmp_path))).items():
+            control.route(path, handler)
+        control.start()
+        try:
+            url = f"http://127.0.0.1:{control.port}"
+            with urllib.request.urlopen(f"{url}/profile?seconds=0.1") as response:
+                assert response.status == 202
+                assert json.load(response)["profile"].startswith(str(tmp_path))
+            with urllib.request.urlopen(f"{url}/spans") as response:
+                assert json.load(response) == {}
+        finally:
+            control.stop()
+
+    def test_errors(self):
+        control = ControlServer(0)
+        control.route("/number", lambda query: (200, float(query["value"])))
+        assert control.handle("/number?value=2") == (200, 2.0)
+        assert control.handle("/number?value=x")[0] == 400
+        assert control.handle("/missing")[0] == 404
@@ -0,0 +1,73 @@
+import queue
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+from clock import VirtualClock
+from ratelimit import TokenBucket
+from scheduler import Scheduler
+from store import TraceStore
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+
+class TestVirtualClock:
+    def test_ticks_cover_range(self):
+        start = datetime(2024, 1, 1)
+        clock = VirtualClock(start, start + timedelta(minutes=5))
+        assert list(clock.ticks()) == [start + timedelta(minutes=i) for i in range(5)]
+        assert len(clock) == 5
+
+    def test_speed(self):
+        start = datetime(2024, 1, 1)
+        clock = VirtualClock(start, start + timedelta(minutes=3), speed=600)
+        began = time.monotonic()
+        list(clock.ticks())
+        # 3 minutes at 600x take 0.3 seconds
+        assert time.monotonic() - began == pytest.approx(0.3, abs=0.1)
+
+    def test_invalid_range(self):
+        start = datetime(2024, 1, 1)
+        with pytest.raises(ValueError):
+            VirtualClock(start, start)
+
+
+class TestTokenBucket:
+    def test_rate(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        began = time.monotonic()
+        for _ in range(21):
+            bucket.acquire()
+        assert time.monotonic() - began == pytest.approx(0.2, abs=0.05)
+
+    def test_burst(self):
+        bucket = TokenBucket(rate=1, burst=5)
+        assert all(bucket.try_acquire() for _ in range(5))
+        assert not bucket.try_acquire()
+
+
+class TestReplay:
+    def test_messages_are_stamped_with_virtual_time(self):
+        traces = [
+            {
+                "name": "Calama/PECalama/active_power",
+                "topic": "Calama/PECalama/active_power",
+                "filename": "Calama/active_power.csv",
+                "noise_factor": None,
+                "match_timestamp_by": "hour",
+                "target_value": "PECalama",
+            }
+        ]
+        start = datetime(2024, 3, 1, 10)
+        shared_queue = queue.Queue()
+        scheduler = Scheduler(
+            shared_queue,
+            traces=traces,
+            store=TraceStore(str(TRACES_PATH)),
+            clock=VirtualClock(start, start + timedelta(hours=2)),
+        )
+        scheduler.start()
+        assert shared_queue.qsize() == 120
+        first = shared_queue.get()
+        assert '"timestamp": "2024-03-01T10:00:00"' in first
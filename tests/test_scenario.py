@@ -0,0 +1,243 @@
+import json
+import os
+import queue
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+from bundle import read_bundle
+from clock import VirtualClock
+from compiler import compile_bundle
+from scenario import Overlay, Scenario, parse_event, parse_time
+from scheduler import Scheduler
+from store import TraceStore
+
+TOPICS = [
+    "grid/line/active_power_start",
+    "grid/line/current_r_start",
+    "grid/line/voltage_start",
+    "grid/line/switch_status_start",
+    "grid/line/contingency",
+    "grid/plant/active_power",
+    "other/plant/active_power",
+]
+BOOLEANS = np.array([False, False, False, True, True, False, False])
+
+
+def event(**fields):
+    return parse_event({"at": "2024-01-01T10:00:00", **fields})
+
+
+def at(text):
+    return parse_time(f"2024-01-01T{text}")
+
+
+def values():
+    return np.array([50.0, 80.0, 220.0, 1.0, 0.0, 30.0, 40.0])
+
+
+class TestOverlay:
+    def test_trip(self):
+        overlay = Overlay([event(target="grid/line", action="trip")], TOPICS, BOOLEANS)
+        before = values()
+        overlay.apply(before, None, at("09:59:00"))
+        np.testing.assert_array_equal(before, values())
+
+        tripped = values()
+        overlay.apply(tripped, None, at("10:00:00"))
+        np.testing.assert_array_equal(tripped, [0.0, 0.0, 220.0, 0.0, 1.0, 30.0, 40.0])
+
+    def test_ramp(self):
+        overlay = Overlay(
+            [event(target="grid/plant", action="set", value=0, ramp=600)], TOPICS
+        )
+        ramped = [values(), values(), values()]
+        for row, time in zip(ramped, ("10:00:00", "10:05:00", "10:20:00")):
+            overlay.apply(row, None, at(time))
+        assert [row[5] for row in ramped] == [30.0, 15.0, 0.0]
+        assert ramped[1][6] == 40.0
+
+    def test_until_and_pattern(self):
+        overlay = Overlay(
+            [
+                event(
+                    target="*/plant/active_power",
+                    action="scale",
+                    value=0.5,
+                    until="2024-01-01T11:00:00",
+                )
+            ],
+            TOPICS,
+        )
+        during, after = values(), values()
+        overlay.apply(during, None, at("10:30:00"))
+        overlay.apply(after, None, at("11:00:00"))
+        assert (during[5], during[6]) == (15.0, 20.0)
+        np.testing.assert_array_equal(after, values())
+
+    def test_events_apply_in_order(self):
+        overlay = Overlay(
+            [
+                event(target="grid/plant/active_power", action="set", value=10),
+                event(target="grid", action="scale", value=2, attribute="active_power"),
+            ],
+            TOPICS,
+        )
+        assert len(overlay.layers) == 2
+        row = values()
+        overlay.apply(row, None, at("10:00:00"))
+        assert row[5] == 20.0
+
+    def test_rows_at_once(self):
+        overlay = Overlay(
+            [event(target="grid/line/contingency", action="set", value=1)], TOPICS
+        )
+        table = np.tile(values(), (3, 1))
+        found = np.zeros(table.shape, dtype=bool)
+        overlay.apply(
+            table, found, np.array([at("09:00:00"), at("10:00:00"), at("11:00:00")])
+        )
+        assert table[:, 4].tolist() == [0.0, 1.0, 1.0]
+        assert found[:, 4].tolist() == [False, True, True]
+        assert not found[:, :4].any()
+
+    def test_unmatched(self):
+        overlay = Overlay([event(target="grid/missing", action="trip")], TOPICS)
+        assert len(overlay) == 0
+        assert overlay.unmatched == {"grid/missing"}
+
+
+@pytest.mark.parametrize(
+    ("fields", "message"),
+    (
+        ({"target": "grid", "action": "open"}, "action must be one of"),
+        ({"target": "grid", "action": "trip", "value": 1}, "a trip has no value"),
+        ({"action": "set"}, "needs a target"),
+        (
+            {"target": "grid", "action": "set", "until": "2024-01-01T09:00:00"},
+            "is not after",
+        ),
+        ({"target": "grid", "action": "set", "speed": 2}, "unknown fields speed"),
+    ),
+)
+def test_invalid_events(fields, message):
+    with pytest.raises(ValueError, match=message):
+        event(**fields)
+
+
+def write_scenario(path, events):
+    path.write_text(json.dumps({"events": events}))
+
+
+def test_scenario_is_read_again_when_it_changes(tmp_path):
+    path = tmp_path / "scenario.json"
+    scenario = Scenario(str(path))
+    assert scenario.changed() and scenario.events == []
+    write_scenario(
+        path, [{"at": "2024-01-01T10:00:00", "target": "a", "action": "trip"}]
+    )
+    assert scenario.changed() and len(scenario.events) == 1
+    assert not scenario.changed()
+    # A broken file keeps the events that were running
+    path.write_text("{")
+    os.utime(path, (0, 0))
+    assert not scenario.changed() and len(scenario.events) == 1
+
+
+@pytest.fixture
+def traces_path(tmp_path):
+    (tmp_path / "grid").mkdir()
+    rows = [
+        f"2024-01-01 {hour:02d}:{minute:02d}:00,100,true"
+        for hour in range(24)
+        for minute in range(60)
+    ]
+    (tmp_path / "grid/line.csv").write_text(
+        "timestamp,active_power_start,switch_status_start\n" + "\n".join(rows) + "\n"
+    )
+    traces = [
+        {
+            "name": column,
+            "topic": f"grid/line/{column}",
+            "filename": "grid/line.csv",
+            "noise_factor": None,
+            "match_timestamp_by": "hour",
+            "target_value": column,
+        }
+        for column in ("active_power_start", "switch_status_start")
+    ]
+    (tmp_path / "traces.json").write_text(json.dumps({"traces": traces}))
+    write_scenario(
+        tmp_path / "trip.json",
+        [
+            {
+                "at": "2024-01-01T10:01:00",
+                "until": "2024-01-01T10:03:00",
+                "target": "grid/line",
+                "action": "trip",
+            }
+        ],
+    )
+    return tmp_path
+
+
+def test_scheduler_overlays_scenario(traces_path):
+    with open(traces_path / "traces.json") as f:
+        traces = json.load(f)["traces"]
+    start = datetime(2024, 1, 1, 10)
+    shared_queue = queue.Queue()
+    Scheduler(
+        shared_queue,
+        traces=traces,
+        store=TraceStore(str(traces_path)),
+        clock=VirtualClock(start, start + timedelta(minutes=4)),
+        scenario=Scenario(str(traces_path / "trip.json")),
+    ).start()
+    messages = [json.loads(shared_queue.get()) for _ in range(shared_queue.qsize())]
+    assert [message["value"] for message in messages] == [
+        100.0,
+        True,
+        0.0,
+        False,
+        0.0,
+        100.0,
+        True,
+    ]
+
+
+def test_compile_with_scenario(traces_path):
+    output = str(traces_path / "trip.bundle")
+    compiled = compile_bundle(
+        str(traces_path), output, [str(traces_path / "trip.json")]
+    )
+    assert compiled.errors == [] and compiled.warnings == []
+    trace_file = read_bundle(output)["grid/line.csv"]
+    assert trace_file.values[600:604].tolist() == [
+        [100.0, 1.0],
+        [0.0, 0.0],
+        [0.0, 0.0],
+        [100.0, 1.0],
+    ]
+
+
+def test_compile_event_outside_the_file(traces_path):
+    write_scenario(
+        traces_path / "later.json",
+        [
+            {"at": "2024-03-05T10:01:00", "target": "grid/line", "action": "trip"},
+            {"at": "2024-03-05T10:01:00", "target": "other", "action": "trip"},
+        ],
+    )
+    output = traces_path / "later.bundle"
+    compiled = compile_bundle(
+        str(traces_path), str(output), [str(traces_path / "later.json")]
+    )
+    assert compiled.errors == [
+        f"Scenario {traces_path / 'later.json'}: the event on grid/line at "
+        "2024-03-05T10:01:00 is outside the times written in its trace files, "
+        "date it within them"
+    ]
+    assert compiled.warnings == [
+        f"Scenario {traces_path / 'later.json'}: no trace matches the target other"
+    ]
+    assert not output.exists()
@@ -65,3 +65,115 @@ class TestUtils:
     )
     def test_get_next_tower(self, input_n, expected):
         assert utils.get_next_tower(input_n) == expected
+
+
+class FakeElevationClient:
+    def __init__(self, altitude=100.0):
+        self.altitude = altitude
+        self.calls = 0
+
+    def get_altitude(self, lat, lng):
+        self.calls += 1
+        return self.altitude
+
+
+def record(name, lng, lat, **values):
+    metadata = {"line_height": {"id": f"{name}-height", "value": 35}}
+    for field in utils.UPDATED_METADATA:
+        metadata[field] = {"id": f"{name}-{field}", "value": values.get(field)}
+    return {"id": name, "name": name, "coordinates": [lng, lat], "metadata": metadata}
+
+
+class TestCheckpoint:
+    def test_resume(self, tmp_path):
+        path = str(tmp_path / "checkpoint.json")
+        client = FakeElevationClient()
+        checkpoint = utils.Checkpoint(path)
+        checkpoint.tower(record("CAL-NCH-0", -68.92, -22.42), client)
+        checkpoint.save()
+
+        resumed = utils.Checkpoint(path)
+        assert "CAL-NCH-0" in resumed.segments
+        tower = resumed.tower(resumed.segments["CAL-NCH-0"], client)
+        assert tower.location.alt == 100.0
+        assert tower.next_tower == "CAL-NCH-1"
+        assert client.calls == 1
+
+    def test_finish_keeps_altitudes(self, tmp_path):
+        path = str(tmp_path / "checkpoint.json")
+        checkpoint = utils.Checkpoint(path)
+        checkpoint.tower(record("CAL-NCH-0", -68.92, -22.42), FakeElevationClient())
+        checkpoint.finish()
+
+        resumed = utils.Checkpoint(path)
+        assert resumed.segments == {}
+        assert resumed.altitudes == {"-22.42,-68.92": 100.0}
+
+    def test_written_values_are_not_written_again(self, tmp_path):
+        checkpoint = utils.Checkpoint(str(tmp_path / "checkpoint.json"))
+        client = FakeElevationClient()
+        towers = {
+            name: checkpoint.tower(record(name, -68.92, -22.42), client)
+            for name in ("CAL-NCH-0",)
+        }
+        writes = utils.planned_writes(towers)
+        for write in writes:
+            checkpoint.written(write)
+        checkpoint.save()
+
+        resumed = utils.Checkpoint(checkpoint.path)
+        towers = {
+            name: resumed.tower(segment, client)
+            for name, segment in resumed.segments.items()
+        }
+        assert utils.planned_writes(towers) == []
+
+
+class TestPlannedWrites:
+    def towers(self, tmp_path, **values):
+        client = FakeElevationClient(2270.0)
+        checkpoint = utils.Checkpoint(str(tmp_path / "checkpoint.json"))
+        return {
+            "CAL-NCH-0": checkpoint.tower(
+                record("CAL-NCH-0", -68.921705, -22.428174, **values), client
+            ),
+            "CAL-NCH-1": checkpoint.tower(
+                record(
+                    "CAL-NCH-1",
+                    -68.921585,
+                    -22.427552,
+                    altitude="2270",
+                    distance_to_next_tower="0",
+                    span_length="0",
+                ),
+                client,
+            ),
+        }
+
+    def test_only_differences(self, tmp_path):
+        towers = self.towers(tmp_path, altitude="2270.0", distance_to_next_tower="70")
+        writes = utils.planned_writes(towers)
+        assert [(write.segment, write.name) for write in writes] == [
+            ("CAL-NCH-0", "distance_to_next_tower"),
+            ("CAL-NCH-0", "span_length"),
+        ]
+        assert writes[1].metadata_id == "CAL-NCH-0-span_length"
+        assert float(writes[1].value) == pytest.approx(70.25, 0.05)
+
+    def test_missing_values_are_written(self, tmp_path):
+        writes = utils.planned_writes(self.towers(tmp_path))
+        assert len(writes) == 3
+
+    @pytest.mark.parametrize(
+        ("current", "value", "expected"),
+        (
+            ("10.0", 10.0, False),
+            ("10.004", 10.0, False),
+            ("10.5", 10.0, True),
+            (None, 0, True),
+            ("", 0, True),
+            (0, 0, False),
+        ),
+    )
+    def test_differs(self, current, value, expected):
+        assert utils.differs(current, value) is expected
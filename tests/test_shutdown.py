@@ -0,0 +1,124 @@
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from clock import Clock, VirtualClock
+from ingestor import Ingestor
+from scheduler import Scheduler
+from shutdown import stop
+from spool import Spool
+from store import TraceStore
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+
+def message(i):
+    return json.dumps({"value": i, "topic": f"grid/asset{i % 3}/active_power"})
+
+
+def make_ingestor(client, spool=None):
+    ingestor = Ingestor(queue.Queue(), spool=spool)
+    ingestor.client = client
+    ingestor.on_connect(client, None, None, 0)
+    return ingestor
+
+
+def run_until_stopped(ingestor, timeout):
+    thread = threading.Thread(target=ingestor.start)
+    thread.start()
+    began = time.monotonic()
+    ingestor.stop(timeout)
+    thread.join()
+    return time.monotonic() - began
+
+
+class TestClock:
+    def test_stop_ends_the_wait(self):
+        stopped = threading.Event()
+        ticks = Clock(interval=60).ticks(stopped)
+        next(ticks)
+        threading.Timer(0.1, stopped.set).start()
+        began = time.monotonic()
+        assert list(ticks) == []
+        assert time.monotonic() - began < 1
+
+    def test_stop_a_paced_replay(self):
+        start = datetime(2024, 1, 1)
+        stopped = threading.Event()
+        clock = VirtualClock(start, start + timedelta(hours=1), speed=1)
+        ticks = clock.ticks(stopped)
+        next(ticks)
+        stopped.set()
+        assert list(ticks) == []
+
+
+class TestIngestorStop:
+    def test_publishes_what_is_queued(self, fake_client):
+        ingestor = make_ingestor(fake_client())
+        for i in range(50):
+            ingestor.queue.put(message(i))
+        run_until_stopped(ingestor, timeout=5)
+        assert [sent.data for sent in ingestor.client.published] == [
+            message(i) for i in range(50)
+        ]
+        assert ingestor.client.disconnected
+        assert ingestor.queue.empty()
+
+    def test_bounded_drain_drops_the_rest(self, fake_client):
+        ingestor = make_ingestor(fake_client(delay=0.01))
+        for i in range(1000):
+            ingestor.queue.put(message(i))
+        assert run_until_stopped(ingestor, timeout=0.2) < 1
+        published = len(ingestor.client.published)
+        assert 0 < published < 1000
+        assert ingestor.metrics.snapshot()["dropped"] == 1000 - published
+        # Every message is accounted for, so joining the queue returns
+        ingestor.queue.join()
+
+    def test_bounded_drain_spools_the_rest(self, tmp_path, fake_client):
+        ingestor = make_ingestor(fake_client(delay=0.01), Spool(str(tmp_path)))
+        for i in range(100):
+            ingestor.queue.put(message(i))
+        run_until_stopped(ingestor, timeout=0.1)
+        spool = Spool(str(tmp_path))
+        spooled = []
+        while (data := spool.peek()) is not None:
+            spooled.append(data)
+            spool.commit()
+        assert [sent.data for sent in ingestor.client.published] + spooled == [
+            message(i) for i in range(100)
+        ]
+
+    def test_idle_ingestor_stops_at_once(self, fake_client):
+        ingestor = make_ingestor(fake_client())
+        assert run_until_stopped(ingestor, timeout=5) < 1
+
+
+def test_stop_a_real_time_device(calama_traces, fake_client):
+    traces = calama_traces()
+    shared_queue = queue.Queue()
+    scheduler = Scheduler(
+        shared_queue, traces=traces, store=TraceStore(str(TRACES_PATH))
+    )
+    ingestor = Ingestor(shared_queue)
+    ingestor.client = fake_client()
+    ingestor.on_connect(ingestor.client, None, None, 0)
+    threads = [
+        threading.Thread(target=scheduler.start),
+        threading.Thread(target=ingestor.start),
+    ]
+    for thread in threads:
+        thread.start()
+    # The first tick is sent, then the scheduler waits a minute for the next
+    while not ingestor.client.published:
+        time.sleep(0.01)
+    stopping = threading.Event()
+    stopping.set()
+    began = time.monotonic()
+    stop(scheduler, threads[0], ingestor, threads[1], stopping, timeout=5)
+    assert time.monotonic() - began < 2
+    assert shared_queue.empty()
+    assert ingestor.client.disconnected
@@ -0,0 +1,103 @@
+import json
+import queue
+import urllib.request
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from clock import VirtualClock
+from control import ControlServer
+from ingestor import Delivery, Ingestor
+from scheduler import Scheduler
+from snapshot import LastValues
+from store import TraceStore
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+TOPICS = ["Calama/CAL-NCH/active_power", "Calama/CAL-NCH/switch_status", "Marcona/M1"]
+
+
+def last_values():
+    cache = LastValues()
+    cache.load(TOPICS, np.array([False, True, False]))
+    return cache
+
+
+class TestLastValues:
+    def test_empty_before_the_first_tick(self):
+        assert last_values().snapshot() == (
+            200,
+            {"timestamp": None, "count": 0, "traces": {}},
+        )
+
+    def test_keeps_the_last_published_value(self):
+        cache = last_values()
+        first, second = datetime(2024, 3, 1, 10), datetime(2024, 3, 1, 10, 1)
+        cache.update(first, np.array([1.5, 1.0, 7.0]), np.array([True, True, True]))
+        cache.update(second, np.array([2.5, 0.0, 8.0]), np.array([True, False, False]))
+        status, document = cache.snapshot()
+        assert status == 200
+        assert document["timestamp"] == "2024-03-01T10:01:00"
+        assert document["traces"] == {
+            TOPICS[0]: {"value": 2.5, "timestamp": "2024-03-01T10:01:00"},
+            TOPICS[1]: {"value": True, "timestamp": "2024-03-01T10:00:00"},
+            TOPICS[2]: {"value": 7.0, "timestamp": "2024-03-01T10:00:00"},
+        }
+
+    def test_filters(self):
+        cache = last_values()
+        cache.update(datetime(2024, 3, 1), np.ones(3), np.ones(3, dtype=bool))
+        assert list(cache.snapshot(grid="Calama")[1]["traces"]) == TOPICS[:2]
+        assert list(cache.snapshot(asset="CAL-NCH")[1]["traces"]) == TOPICS[:2]
+        assert cache.snapshot(grid="Marcona")[1]["count"] == 1
+        assert cache.snapshot(grid="Marcona", asset="CAL-NCH")[0] == 404
+        assert cache.snapshot(grid="Nowhere")[0] == 404
+
+    def test_route(self):
+        cache = last_values()
+        cache.update(datetime(2024, 3, 1), np.ones(3), np.ones(3, dtype=bool))
+        control = ControlServer(0)
+        for path, handler in cache.routes().items():
+            control.route(path, handler)
+        control.start()
+        try:
+            url = f"http://127.0.0.1:{control.port}/snapshot?grid=Marcona"
+            with urllib.request.urlopen(url) as response:
+                assert json.load(response)["traces"] == {
+                    "Marcona/M1": {"value": 1.0, "timestamp": "2024-03-01T00:00:00"}
+                }
+        finally:
+            control.stop()
+
+
+def test_scheduler_matches_the_last_messages(calama_traces):
+    traces = calama_traces()
+    start = datetime(2024, 3, 1, 10)
+    shared_queue = queue.Queue()
+    scheduler = Scheduler(
+        shared_queue,
+        traces=traces,
+        store=TraceStore(str(TRACES_PATH)),
+        clock=VirtualClock(start, start + timedelta(minutes=3)),
+    )
+    scheduler.start()
+    last = {}
+    while not shared_queue.empty():
+        message = json.loads(shared_queue.get())
+        last[message["topic"]] = message
+    status, document = scheduler.last_values.snapshot()
+    assert status == 200
+    assert document["count"] == len(traces)
+    for topic, cached in document["traces"].items():
+        assert cached == {
+            "value": last[topic]["value"],
+            "timestamp": last[topic]["timestamp"],
+        }
+
+
+def test_retain(fake_client):
+    ingestor = Ingestor(queue.Queue(), **Delivery(retain=True).options())
+    ingestor.client = fake_client()
+    ingestor.send('{"topic": "a"}', "a")
+    assert [(sent.topic, sent.retain) for sent in ingestor.client.published] == [
+        ("a", True)
+    ]
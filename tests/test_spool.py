@@ -0,0 +1,103 @@
+import json
+import os
+import queue
+import threading
+
+from ingestor import Ingestor
+from spool import Spool
+
+
+def drain(spool):
+    messages = []
+    while (data := spool.peek()) is not None:
+        messages.append(data)
+        spool.commit()
+    return messages
+
+
+def message(i):
+    return json.dumps({"value": i, "topic": f"grid/asset{i % 3}/active_power"})
+
+
+class TestSpool:
+    def test_order(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_bytes=100)
+        for i in range(20):
+            spool.append(message(i))
+        assert len(os.listdir(tmp_path)) > 1
+        assert drain(spool) == [message(i) for i in range(20)]
+        assert not spool
+        assert os.listdir(tmp_path) == []
+
+    def test_peek_without_commit(self, tmp_path):
+        spool = Spool(str(tmp_path))
+        spool.append(message(0))
+        spool.append(message(1))
+        assert spool.peek() == message(0)
+        assert spool.peek() == message(0)
+        spool.commit()
+        assert spool.peek() == message(1)
+
+    def test_survives_restart(self, tmp_path):
+        spool = Spool(str(tmp_path), segment_bytes=100)
+        for i in range(10):
+            spool.append(message(i))
+        assert spool.peek() == message(0)
+        spool.commit()
+        spool.close()
+
+        spool = Spool(str(tmp_path), segment_bytes=100)
+        spool.append(message(10))
+        messages = drain(spool)
+        # Messages of the segment being read when stopping are sent again
+        assert messages[-10:] == [message(i) for i in range(1, 11)]
+        assert set(messages) <= {message(i) for i in range(11)}
+
+    def test_evicts_oldest(self, tmp_path):
+        size = len(message(0)) + 1
+        spool = Spool(str(tmp_path), max_bytes=10 * size, segment_bytes=2 * size)
+        evicted = sum(spool.append(message(i)) for i in range(20))
+        messages = drain(spool)
+        assert evicted + len(messages) == 20
+        assert len(messages) <= 10
+        assert messages == [message(i) for i in range(evicted, 20)]
+
+    def test_truncated_message(self, tmp_path):
+        spool = Spool(str(tmp_path))
+        spool.append(message(0))
+        spool.close()
+        with open(os.path.join(tmp_path, os.listdir(tmp_path)[0]), "ab") as f:
+            f.write(b'{"value": 1, "to')
+        spool = Spool(str(tmp_path))
+        spool.append(message(2))
+        assert drain(spool) == [message(0), message(2)]
+
+
+class TestIngestorSpool:
+    def make_ingestor(self, tmp_path, fake_client):
+        ingestor = Ingestor(queue.Queue(), spool=Spool(str(tmp_path)))
+        ingestor.client = fake_client(connected=False)
+        return ingestor
+
+    def test_no_gaps_across_outage(self, tmp_path, fake_client):
+        ingestor = self.make_ingestor(tmp_path, fake_client)
+        thread = threading.Thread(target=ingestor.start)
+        thread.start()
+        for i in range(5):
+            ingestor.queue.put(message(i))
+        ingestor.queue.join()
+        assert ingestor.client.published == []
+        assert ingestor.metrics.snapshot()["spooled"] == 5
+
+        ingestor.client.connected = True
+        ingestor.on_connect(ingestor.client, None, None, 0)
+        for i in range(5, 10):
+            ingestor.queue.put(message(i))
+        ingestor.queue.join()
+        while ingestor.spool:
+            pass
+        ingestor.stop()
+        thread.join()
+        assert [published.data for published in ingestor.client.published] == [
+            message(i) for i in range(10)
+        ]
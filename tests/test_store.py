@@ -0,0 +1,126 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+from store import Lookup, TimeUnit, TraceStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    # Coarse hourly pattern, every 15 minutes
+    rows = [
+        f"2024-01-01 {hour:02d}:{minute:02d}:00,{hour * 60 + minute},{minute != 30}"
+        for hour in range(24)
+        for minute in (0, 15, 30, 45)
+    ]
+    (tmp_path / "coarse.csv").write_text(
+        "timestamp,ramp,status\n" + "\n".join(rows) + "\n"
+    )
+    return TraceStore(str(tmp_path))
+
+
+def row(store, when, lookup, unit=TimeUnit.HOUR):
+    return store.get("coarse.csv").row(when, unit, Lookup(lookup))
+
+
+class TestPeriodicLookup:
+    def test_exact_only_matches_stored_minutes(self, store):
+        assert row(store, datetime(2025, 6, 1, 10, 15, 40), "exact")[0] == 615
+        assert row(store, datetime(2025, 6, 1, 10, 20), "exact") is None
+
+    @pytest.mark.parametrize(
+        ("lookup", "expected"),
+        (("step", 615), ("nearest", 615), ("linear", 620), ("cubic", 620)),
+    )
+    def test_between_samples(self, store, lookup, expected):
+        values = row(store, datetime(2025, 6, 1, 10, 20), lookup)
+        assert values[0] == pytest.approx(expected)
+
+    def test_booleans_hold_their_value(self, store):
+        values = row(store, datetime(2025, 6, 1, 10, 40), "linear")
+        assert values[1] == 0.0
+        assert row(store, datetime(2025, 6, 1, 10, 50), "cubic")[1] == 1.0
+
+    def test_wraps_around_the_period(self, store):
+        # Between 23:45 (1425) and 00:00 of the next day (0)
+        values = row(store, datetime(2025, 6, 1, 23, 50), "linear")
+        assert values[0] == pytest.approx(1425 - 1425 / 3)
+
+    def test_all_columns_at_once(self, store):
+        trace_file = store.get("coarse.csv")
+        values = trace_file.row(datetime(2025, 6, 1, 1), TimeUnit.HOUR, Lookup.CUBIC)
+        assert values.shape == (len(trace_file.columns),)
+        assert trace_file.record(values) == {"ramp": 60.0, "status": True}
+
+    def test_day_of_week(self, tmp_path):
+        # 2024-01-01 was a Monday
+        (tmp_path / "week.csv").write_text(
+            "timestamp,value\n2024-01-01 00:00:00,1\n2024-01-03 00:00:00,3\n"
+        )
+        trace_file = TraceStore(str(tmp_path)).get("week.csv")
+        wednesday = datetime(2025, 6, 4)
+        values = trace_file.row(wednesday, TimeUnit.DAY_OF_WEEK, Lookup.EXACT)
+        assert values[0] == 3
+        tuesday = datetime(2025, 6, 3)
+        values = trace_file.row(tuesday, TimeUnit.DAY_OF_WEEK, Lookup.INTERPOLATE)
+        assert values[0] == pytest.approx(2)
+
+
+class TestMessages:
+    def definition(self, **fields):
+        return {
+            "name": "ramp",
+            "topic": "grid/asset/ramp",
+            "filename": "coarse.csv",
+            "noise_factor": 0,
+            "match_timestamp_by": "hour",
+            "target_value": "ramp",
+            **fields,
+        }
+
+    def test_message(self, store, tick_messages):
+        when = datetime(2025, 6, 1, 10, 20)
+        (data,) = tick_messages(store, [self.definition(lookup="interpolate")], when)
+        assert data == {
+            "timestamp": when.isoformat(),
+            "ramp": pytest.approx(620),
+            "status": True,
+            "value": pytest.approx(620),
+            "topic": "grid/asset/ramp",
+        }
+
+    def test_invalid_column(self, tmp_path):
+        (tmp_path / "text.csv").write_text("timestamp,value\n2024-01-01,abc\n")
+        with pytest.raises(ValueError):
+            TraceStore(str(tmp_path)).get("text.csv")
+
+    def test_default_lookup_keeps_exact_match(self, store, tick_messages):
+        at = datetime(2025, 6, 1, 10, 20)
+        assert not tick_messages(store, [self.definition()], at)
+        at = datetime(2025, 6, 1, 10, 15)
+        (data,) = tick_messages(store, [self.definition()], at)
+        assert data["value"] == 615
+
+
+class TestCsv:
+    def test_timezones(self, tmp_path):
+        (tmp_path / "tz.csv").write_text(
+            "timestamp,value\n2024-01-01T03:00:00Z,1\n2024-01-01 01:00:00-03:00,2\n"
+        )
+        trace_file = TraceStore(str(tmp_path)).get("tz.csv")
+        # Sorted by the real instant, wall clock as written
+        assert trace_file.values[:, 0].tolist() == [1, 2]
+        assert trace_file.timestamps[1] - trace_file.timestamps[0] == 3600 * 10**9
+        assert trace_file.wall[1] - trace_file.wall[0] == -2 * 3600 * 10**9
+
+    def test_missing_values(self, tmp_path):
+        (tmp_path / "gaps.csv").write_text(
+            "timestamp,value\n2024-01-01 00:00:00,\n2024-01-01 00:01:00,2\n"
+        )
+        values = TraceStore(str(tmp_path)).get("gaps.csv").values[:, 0]
+        assert np.isnan(values[0]) and values[1] == 2
+
+    def test_not_numeric(self, tmp_path):
+        (tmp_path / "text.csv").write_text("timestamp,value\n2024-01-01,on\n")
+        with pytest.raises(ValueError):
+            TraceStore(str(tmp_path)).get("text.csv")
@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+
+import pytest
+from bundle import publish
+from store import TraceStore
+from supervisor import HashRing, ShardBy, Supervisor, partition
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+
+def make_traces(grids: dict[str, int]) -> list[dict]:
+    return [
+        {
+            "name": f"{grid}/Asset{i}/active_power",
+            "topic": f"{grid}/Asset{i}/active_power",
+        }
+        for grid, count in grids.items()
+        for i in range(count)
+    ]
+
+
+class TestPartition:
+    def test_grid_keeps_grids_together(self):
+        traces = make_traces({"Calama": 10, "Marcona": 6, "Atlantica": 3, "Other": 2})
+        shards = partition(traces, 2, ShardBy.GRID)
+        assert sorted(len(shard) for shard in shards) == [10, 11]
+        for shard in shards:
+            grids = {trace["topic"].split("/")[0] for trace in shard}
+            for grid in grids:
+                assert all(
+                    trace in shard
+                    for trace in traces
+                    if trace["topic"].startswith(grid)
+                )
+
+    def test_hash_covers_every_trace_once(self):
+        traces = make_traces({"Calama": 500, "Marcona": 500})
+        shards = partition(traces, 4, ShardBy.HASH)
+        assert sum(len(shard) for shard in shards) == len(traces)
+        assert all(len(shard) > 150 for shard in shards)
+
+    @pytest.mark.parametrize("shard_by", list(ShardBy))
+    def test_more_workers_than_grids(self, shard_by):
+        traces = make_traces({"Calama": 2})
+        shards = partition(traces, 4, shard_by)
+        assert len(shards) == 4
+        assert sum(len(shard) for shard in shards) == 2
+
+
+class TestHashRing:
+    def test_adding_a_node_moves_few_keys(self):
+        keys = [f"Grid/Asset{i}/active_power" for i in range(2000)]
+        before = HashRing(8)
+        after = HashRing(9)
+        moved = sum(before.get(key) != after.get(key) for key in keys)
+        # Ideally 1/9 of the keys move to the new node
+        assert moved < len(keys) * 0.25
+
+
+class TestSharedBundle:
+    def publish(self, path):
+        store = TraceStore(str(TRACES_PATH))
+        store.load(["Calama/active_power.csv"])
+        publish(store, path)
+
+    def test_given_bundle_survives_stop(self, tmp_path):
+        path = str(tmp_path / "traces.bundle")
+        self.publish(path)
+        supervisor = Supervisor(2, bundle_path=path)
+        supervisor.stop()
+        assert os.path.exists(path)
+
+    def test_own_bundle_is_removed(self):
+        supervisor = Supervisor(2)
+        self.publish(supervisor.bundle_path)
+        supervisor.stop()
+        assert not os.path.exists(supervisor.bundle_path)
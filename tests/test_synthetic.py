@@ -0,0 +1,89 @@
+import csv
+from datetime import datetime, timedelta
+
+import numpy as np
+from generic import KIND_INPUT_ATTRIBUTES
+from grids.atlantica import AtlanticaGrid
+from grids.synthetic import SyntheticGrid, synthetic_grids
+from powerflow import DCPowerFlow
+from utils import normalize, normalize_array
+
+
+def read(path):
+    with open(path) as f:
+        rows = list(csv.reader(f))
+    return rows[0], rows[1:]
+
+
+class TestSyntheticGrid:
+    def test_same_seed_same_grid(self):
+        first, second = SyntheticGrid(buses=50, seed=3), SyntheticGrid(buses=50, seed=3)
+        assert first.assets == second.assets
+        assert first.lines == second.lines
+        assert first.assets != SyntheticGrid(buses=50, seed=4).assets
+
+    def test_size(self):
+        grid = SyntheticGrid(buses=100, generators=30, loads=40, batteries=5, seed=1)
+        kinds = list(grid.assets.values())
+        assert kinds.count("Bus") == 100
+        assert kinds.count("Generator") == 30
+        assert kinds.count("Load") == 40
+        assert kinds.count("Battery") == 5
+        assert kinds.count("Line") >= 99
+        # Every bus is reached from the external grid
+        DCPowerFlow(grid.network)
+
+    def test_build(self, tmp_path):
+        grid = SyntheticGrid("Small", buses=20, seed=2)
+        traces = grid.build(str(tmp_path), minutes=90)
+        expected = sum(
+            len(KIND_INPUT_ATTRIBUTES[kind]) for kind in grid.assets.values()
+        )
+        assert len(traces) == expected
+        assert len({trace["topic"] for trace in traces}) == expected
+
+        header, rows = read(tmp_path / "Small/active_power_start.csv")
+        _, end_rows = read(tmp_path / "Small/active_power_end.csv")
+        assert header[1:] == sorted(grid.lines)
+        assert len(rows) == 90
+        start = np.array([row[1:] for row in rows], dtype=float)
+        end = np.array([row[1:] for row in end_rows], dtype=float)
+        # Flows go in at one end and out at the other, minus small losses
+        assert np.abs(start + end).max() < 0.05 * np.abs(start).max()
+
+        constant = {trace["topic"] for trace in traces if "deadband" in trace}
+        assert "Small/SE00001/active_power" not in constant
+        assert "Small/SE00001/reactive_power" not in constant
+        assert "Small/G00000/frequency" in constant
+        assert "Small/G00000/power_set_point" in constant
+
+    def test_grids_differ(self):
+        grids = synthetic_grids(3, buses=30, seed=1)
+        assert [grid.name for grid in grids] == [
+            "Synthetic0",
+            "Synthetic1",
+            "Synthetic2",
+        ]
+        assert grids[0].lines != grids[1].lines
+
+
+def test_normalize_array():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.normal(0, 100, 1000), [0.0, -0.0004, -0.5, 1e5]])
+    expected = [normalize(round(float(value), 3)) for value in values]
+    assert normalize_array(values).tolist() == expected
+    assert normalize_array(np.array([True, False])).tolist() == ["true", "false"]
+
+
+def test_write_rows_unchanged(tmp_path):
+    """Hand written grids keep going through their get_ methods"""
+    grid = AtlanticaGrid()
+    grid.build(str(tmp_path), minutes=3)
+    _, rows = read(tmp_path / "Atlantica/state_of_charge.csv")
+    start = datetime(2024, 1, 1)
+    for index, row in enumerate(rows):
+        when = start + timedelta(minutes=index)
+        assert row == [
+            when.strftime("%Y-%m-%d %H:%M:%S"),
+            grid.get_state_of_charge(when)["BESSMariaElena"],
+        ]
@@ -0,0 +1,158 @@
+import json
+import queue
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pytest
+from clock import VirtualClock
+from scheduler import GroupBy, Scheduler
+from store import TraceStore
+from verifier import Sequences, Verifier, merge, percentile
+
+TRACES_PATH = Path(__file__).resolve().parent.parent / "data/mqtt/traces"
+
+
+def update(sequences, *pairs):
+    topics, numbers = zip(*pairs)
+    sequences.update(np.array(topics), np.array(numbers))
+
+
+class TestSequences:
+    def test_in_order(self):
+        sequences = Sequences(2)
+        update(sequences, (0, 5), (1, 1), (0, 6), (1, 2))
+        update(sequences, (0, 7), (1, 3))
+        assert sequences.received.tolist() == [3, 3]
+        assert sequences.lost.sum() == sequences.duplicates.sum() == 0
+
+    def test_gap_then_late(self):
+        sequences = Sequences(1)
+        update(sequences, (0, 1), (0, 2), (0, 5))
+        assert sequences.lost[0] == 2
+        update(sequences, (0, 3), (0, 6))
+        assert (sequences.lost[0], sequences.reordered[0]) == (1, 1)
+        # 3 already came, 4 is still missing
+        update(sequences, (0, 3))
+        assert (sequences.lost[0], sequences.duplicates[0]) == (1, 1)
+
+    def test_late_in_the_same_batch(self):
+        sequences = Sequences(1)
+        update(sequences, (0, 1), (0, 3), (0, 2), (0, 4))
+        assert sequences.lost[0] == 0
+        assert sequences.reordered[0] == 1
+
+    def test_restart(self):
+        sequences = Sequences(1)
+        update(sequences, (0, 10), (0, 11))
+        update(sequences, (0, 1), (0, 2))
+        assert sequences.restarts[0] == 1
+        assert sequences.duplicates[0] == sequences.lost[0] == 0
+        assert sequences.last[0] == 2
+
+
+@pytest.fixture
+def every_tick(calama_traces):
+    """Traces of Calama sent on every tick"""
+
+    def load(**fields):
+        return calama_traces(**{"deadband": None, "max_silence": 0, **fields})
+
+    return load
+
+
+def payloads(traces, group_by=GroupBy.TRACE, minutes=3):
+    start = datetime(2024, 3, 1, 10)
+    shared_queue = queue.Queue()
+    Scheduler(
+        shared_queue,
+        traces=traces,
+        store=TraceStore(str(TRACES_PATH)),
+        clock=VirtualClock(start, start + timedelta(minutes=minutes)),
+        seed=1,
+        group_by=group_by,
+        stamp=True,
+    ).start()
+    arrival = time.time()
+    return [(arrival, shared_queue.get().encode()) for _ in range(shared_queue.qsize())]
+
+
+def verifier(traces, group_by=GroupBy.TRACE):
+    return Verifier(traces, TraceStore(str(TRACES_PATH)), group_by)
+
+
+class TestVerifier:
+    @pytest.mark.parametrize("group_by", list(GroupBy))
+    def test_everything_matches(self, group_by, every_tick):
+        traces = every_tick()
+        check = verifier(traces, group_by)
+        batch = payloads(traces, group_by)
+        check.process(batch[:10])
+        check.process(batch[10:])
+        report = check.report()
+        assert report["received"] == len(batch)
+        assert report["checked"] == 3 * len(traces)
+        assert report["lost"] == report["duplicates"] == report["mismatched"] == 0
+        assert report["unknown"] == 0
+        assert percentile(np.array(report["histogram"]), 0.99) < 1
+
+    def test_noise_within_tolerance(self, every_tick):
+        traces = every_tick(noise_factor=0.1)
+        check = verifier(traces)
+        check.process(payloads(traces))
+        assert check.report()["mismatched"] == 0
+
+    def test_loss_duplicates_and_wrong_values(self, every_tick):
+        traces = every_tick()
+        check = verifier(traces)
+        batch = payloads(traces)
+        duplicate = batch[len(traces)]
+        batch.append(duplicate)
+        lost = batch.pop(len(traces) + 3)
+        message = json.loads(batch[1][1])
+        message["value"] = "nan" if isinstance(message["value"], bool) else -1e9
+        batch[1] = (batch[1][0], json.dumps(message).encode())
+        check.process(batch)
+        report = check.report()
+        assert report["lost"] == 1
+        assert set(report["topics"]) == {
+            json.loads(lost[1])["topic"],
+            json.loads(duplicate[1])["topic"],
+        }
+        assert report["duplicates"] == 1
+        assert report["mismatched"] >= 1
+        assert message["topic"] in report["traces"]
+
+    def test_unknown_topics(self, every_tick):
+        check = verifier(every_tick())
+        check.process([(time.time(), b'{"topic": "Other/x", "value": 1}')])
+        assert check.report()["unknown"] == 1
+
+    def test_malformed_payloads(self, every_tick):
+        traces = every_tick()
+        check = verifier(traces)
+        batch = payloads(traces)
+        arrival = batch[0][0]
+        topic = traces[0]["topic"]
+        batch[2:2] = [
+            (arrival, b"garbage"),
+            (arrival, json.dumps({"topic": topic, "value": 1}).encode()),
+            (arrival, b"[1, 2]"),
+        ]
+        check.process(batch)
+        report = check.report()
+        assert report["malformed"] == 3
+        assert report["received"] == len(batch) - 3
+        assert report["checked"] == 3 * len(traces)
+        assert report["lost"] == report["mismatched"] == report["unknown"] == 0
+
+
+def test_merge():
+    first = {"seconds": 2, "received": 3, "histogram": [1, 0], "topics": {"a": 1}}
+    second = {"seconds": 5, "received": 4, "histogram": [0, 2], "topics": {"b": 2}}
+    merged = merge([first, second])
+    assert merged["seconds"] == 5
+    assert merged["received"] == 7
+    assert merged["histogram"] == [1, 2]
+    assert merged["topics"] == {"a": 1, "b": 2}
@@ -0,0 +1,217 @@
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable, NamedTuple
+
+import numpy as np
+from generic import GridDefinition
+from grids.atlantica import AtlanticaGrid
+from grids.calama import CalamaGrid
+from grids.finisterrae import FinisTerraeGrid
+from grids.marcona import MarconaGrid
+from grids.synthetic import SyntheticGrid
+from utils import (
+    bess_active_power,
+    bess_soc,
+    normalize,
+    normalize_array,
+    seed_noise,
+    sinusoidal,
+    solar_gaussian,
+)
+
+# Times measured on a reference machine, kept next to this file
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "benchmarks.json"
+)
+# Slower than the baseline by more than this fraction is a regression
+THRESHOLD = 0.25
+# Rounds of every case, the fastest one is kept as the least disturbed
+REPEATS = 5
+BUILD_REPEATS = 3
+# Calls of a function timed together in a round
+CALLS = 2000
+# Minutes of traces built for every grid, and buses of the synthetic grids
+HORIZONS = (60, 6 * 60, 24 * 60)
+SYNTHETIC_BUSES = (50, 200, 500)
+GRIDS: dict[str, Callable[[], GridDefinition]] = {
+    "Marcona": MarconaGrid,
+    "Calama": CalamaGrid,
+    "Atlantica": AtlanticaGrid,
+    "FinisTerrae": FinisTerraeGrid,
+}
+# Low hours, peak hours, charge rate, discharge rate and capacity of a battery
+BESS_SCHEDULE = ([5, 13], [9, 16], 9, 6, 18)
+
+
+class Case(NamedTuple):
+    name: str
+    run: Callable[[], object]
+    calls: int = CALLS
+    repeats: int = REPEATS
+
+
+def call_cases() -> list[Case]:
+    """Functions of utils.py, timed per call"""
+    moment = datetime(2024, 1, 1, 13, 37)
+    table = np.random.default_rng(0).normal(0, 100, (24 * 60, 50))
+    return [
+        Case("sinusoidal", partial(sinusoidal, moment, 10, 50)),
+        Case("solar_gaussian", partial(solar_gaussian, moment, 100)),
+        Case("bess_soc", partial(bess_soc, moment, *BESS_SCHEDULE)),
+        Case("bess_active_power", partial(bess_active_power, moment, *BESS_SCHEDULE)),
+        Case("normalize[float]", partial(normalize, 123.4567)),
+        Case("normalize[bool]", partial(normalize, True)),
+        Case("normalize_array[1440x50]", partial(normalize_array, table), calls=10),
+    ]
+
+
+def build(grid: Callable[[], GridDefinition], minutes: int) -> None:
+    seed_noise(0)
+    with tempfile.TemporaryDirectory() as directory:
+        grid().build(directory, minutes=minutes)
+
+
+def build_cases(
+    horizons: tuple[int, ...] = HORIZONS, buses: tuple[int, ...] = SYNTHETIC_BUSES
+) -> list[Case]:
+    """`GridDefinition.build` of every grid and of synthetic grids, timed per
+    build, from creating the grid to the last csv file written"""
+    cases = [
+        Case(
+            f"build[{name},{minutes}m]", partial(build, grid, minutes), 1, BUILD_REPEATS
+        )
+        for name, grid in GRIDS.items()
+        for minutes in horizons
+    ]
+    for count in buses:
+        grid = partial(SyntheticGrid, f"Synthetic{count}", count, seed=0)
+        cases.extend(
+            Case(
+                f"build[Synthetic,{count} buses,{minutes}m]",
+                partial(build, grid, minutes),
+                1,
+                BUILD_REPEATS,
+            )
+            for minutes in horizons
+        )
+    return cases
+
+
+def measure(case: Case) -> float:
+    """Seconds per call of the fastest round"""
+    best = float("inf")
+    for _ in range(case.repeats):
+        started = time.perf_counter()
+        for _ in range(case.calls):
+            case.run()
+        best = min(best, (time.perf_counter() - started) / case.calls)
+    return best
+
+
+def format_time(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def machine() -> str:
+    processor = platform.processor() or platform.system()
+    return f"{platform.machine()} {processor}, Python {platform.python_version()}"
+
+
+def read_baseline(path: str) -> dict:
+    if not os.path.exists(path):
+        return {"machine": None, "results": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(
+    results: dict[str, float], baseline: dict[str, float], threshold: float = THRESHOLD
+) -> list[tuple[str, float]]:
+    """Cases slower than their baseline by more than `threshold`, with how
+    many times slower"""
+    regressions = []
+    for name, seconds in results.items():
+        reference = baseline.get(name)
+        if reference and seconds / reference > 1 + threshold:
+            regressions.append((name, seconds / reference))
+    return regressions
+
+
+def report(results: dict[str, float], baseline: dict[str, float]) -> None:
+    width = max(len(name) for name in results)
+    for name, seconds in results.items():
+        line = f"{name:<{width}}  {format_time(seconds):>10}"
+        reference = baseline.get(name)
+        if reference:
+            line += f"  {format_time(reference):>10}  {(seconds / reference - 1) * 100:+6.1f}%"
+        print(line)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description="Times the trace generator and compares it with a baseline"
+    )
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument(
+        "--save", action="store_true", help="store the times as the new baseline"
+    )
+    parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    parser.add_argument(
+        "--only",
+        action="append",
+        help="cases containing or matching this pattern, repeatable",
+    )
+    parser.add_argument(
+        "--quick", action="store_true", help="only the shortest horizon and grid"
+    )
+    args = parser.parse_args()
+
+    cases = call_cases() + (
+        build_cases(HORIZONS[:1], SYNTHETIC_BUSES[:1]) if args.quick else build_cases()
+    )
+    if args.only:
+        cases = [
+            case
+            for case in cases
+            if any(
+                pattern in case.name or fnmatch.fnmatchcase(case.name, pattern)
+                for pattern in args.only
+            )
+        ]
+    if not cases:
+        parser.error("no case matches --only")
+    results = {case.name: measure(case) for case in cases}
+
+    stored = read_baseline(args.baseline)
+    if stored["machine"] and stored["machine"] != machine():
+        print(f"The baseline was measured on {stored['machine']}", file=sys.stderr)
+    report(results, stored["results"])
+
+    if args.save:
+        stored["machine"] = machine()
+        stored["results"].update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(stored, f, indent=2)
+            f.write("\n")
+        print(f"Saved {len(results)} times to {args.baseline}")
+        return 0
+
+    regressions = compare(results, stored["results"], args.threshold)
+    for name, ratio in regressions:
+        print(f"Regression: {name} is {ratio:.2f} times slower", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,20 @@
 import json
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 from grids.atlantica import AtlanticaGrid
 from grids.calama import CalamaGrid
 from grids.finisterrae import FinisTerraeGrid
 from grids.marcona import MarconaGrid
+from grids.synthetic import synthetic_grids
+from utils import seed_noise
 
 OUTPUT_DIR = "data/mqtt/traces"
+# Set to get the same traces on every build
+NOISE_SEED = os.getenv("NOISE_SEED")
+# Random grids added for load tests, of SYNTHETIC_BUSES buses each
+SYNTHETIC_GRIDS = int(os.getenv("SYNTHETIC_GRIDS", "0"))
+SYNTHETIC_BUSES = int(os.getenv("SYNTHETIC_BUSES", "500"))
 
 
 def ensure_dir(path):
@@ -20,16 +28,31 @@ def generate_traces_json(traces, output_path="data/mqtt/traces/traces.json"):
         json.dump({"traces": traces}, f, indent=2)
 
 
+def build_grid(grid):
+    return grid.build(output_base_dir=OUTPUT_DIR)
+
+
 def main():
     # Initialize
+    seed_noise(int(NOISE_SEED) if NOISE_SEED else None)
     grids = [MarconaGrid(), CalamaGrid(), AtlanticaGrid(), FinisTerraeGrid()]
+    synthetic = synthetic_grids(
+        SYNTHETIC_GRIDS, SYNTHETIC_BUSES, int(NOISE_SEED) if NOISE_SEED else None
+    )
 
     # Build each grid and collect traces
     all_traces = []
     for grid in grids:
-        traces = grid.build(output_base_dir=OUTPUT_DIR)
+        traces = build_grid(grid)
         all_traces.extend(traces)
         print(f"Built grid {grid.name} with {len(traces)} traces.")
+    # Synthetic grids carry their own random generator, so they can be built
+    # in parallel
+    if synthetic:
+        with ProcessPoolExecutor() as pool:
+            for grid, traces in zip(synthetic, pool.map(build_grid, synthetic)):
+                all_traces.extend(traces)
+                print(f"Built grid {grid.name} with {len(traces)} traces.")
 
     generate_traces_json(all_traces)
     print(f"Wrote traces.json with {len(all_traces)} traces.")
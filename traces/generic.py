@@ -1,8 +1,14 @@
 import os
 from abc import ABC, abstractmethod
 from datetime import datetime, timedelta
+from typing import TextIO
 
-from utils import normalize
+import numpy as np
+from powerflow import DCPowerFlow, Network
+from utils import normalize, normalize_array
+
+# Constant traces are only sent when they change, and at least this often
+CONSTANT_MAX_SILENCE = 15 * 60
 
 KIND_INPUT_ATTRIBUTES: dict[str, list[str]] = {
     "Battery": ["active_power", "reactive_power", "state_of_charge"],
@@ -79,6 +85,36 @@ class GridDefinition(ABC):
             all_attrs.update(self.get_attributes_for_asset(asset))
         return sorted(list(all_attrs))
 
+    @property
+    def network(self) -> Network | None:
+        """Topology of the grid, its flows are solved by a DC power flow"""
+        return None
+
+    def injections(
+        self, times: list[datetime]
+    ) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+        """Generation and load in MW of the assets of `network` at `times`,
+        required by every grid that defines a network"""
+        raise TypeError(f"Grid {self.name} defines a network without injections")
+
+    def power_flow(self, times: list[datetime]) -> dict[str, dict[str, np.ndarray]]:
+        """Values of each attribute and asset at `times` given by the power flow,
+        none for a grid without a network.
+
+        All the timesteps are solved at once, so the flows of the lines, their
+        losses and the power through the buses agree with the generation.
+        """
+        if self.network is None:
+            return {}
+        generation, load = self.injections(times)
+        flow = DCPowerFlow(self.network).solve(generation, load)
+        return {
+            "active_power": {**generation, **load, **flow.buses()},
+            "active_power_start": flow.lines(flow.start),
+            "active_power_end": flow.lines(flow.end),
+            "active_power_loss": flow.lines(flow.losses),
+        }
+
     @classmethod
     def default_value(self, attr: str) -> float | str:
         if "switch_status" in attr:
@@ -113,10 +149,12 @@ class GridDefinition(ABC):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir)
 
+        times = [start_date + step * index for index in range(minutes)]
+        solved = self.power_flow(times)
+
         traces = []
         all_attributes = self.get_all_attributes()
         for attr in all_attributes:
-            method_name = f"get_{attr}"
             filename = os.path.join(output_dir, f"{attr}.csv")
 
             # get assets with the attribute
@@ -128,39 +166,108 @@ class GridDefinition(ABC):
             asset_list = sorted(asset_list)
             if not asset_list:
                 continue
+            series = self.series(attr, times)
             with open(filename, "w") as f:
                 f.write("timestamp," + ",".join(asset_list) + "\n")
-                current = start_date
-                for _ in range(minutes):
-                    merged_values = {}
-                    if hasattr(self, method_name):
-                        method = getattr(self, method_name)
-                        values = method(current)  # {asset: normalized_value}
-                        merged_values.update(values)
-                    row_values = [
-                        merged_values.get(asset, normalize(self.default_value(attr)))
-                        for asset in asset_list
-                    ]
-                    f.write(
-                        f"{current.strftime('%Y-%m-%d %H:%M:%S')},"
-                        + ",".join(row_values)
-                        + "\n"
-                    )
-                    current += step
+                if series is None:
+                    constant = self.write_rows(f, attr, asset_list, times, solved)
+                else:
+                    series = {**series, **solved.get(attr, {})}
+                    constant = self.write_columns(f, attr, asset_list, times, series)
             # Add trace dicts for each asset/attribute
-            for asset in asset_list:
-                traces.append(
-                    {
-                        "name": f"{self.name}/{asset}/{attr}",
-                        "topic": f"{self.name}/{asset}/{attr}",
-                        "filename": f"{self.name}/{attr}.csv",
-                        "noise_factor": None,
-                        "match_timestamp_by": "hour",
-                        "target_value": asset,
-                    }
-                )
+            for asset, is_constant in zip(asset_list, constant):
+                trace = {
+                    "name": f"{self.name}/{asset}/{attr}",
+                    "topic": f"{self.name}/{asset}/{attr}",
+                    "filename": f"{self.name}/{attr}.csv",
+                    "noise_factor": None,
+                    "match_timestamp_by": "hour",
+                    "target_value": asset,
+                }
+                if is_constant:
+                    trace["deadband"] = 0
+                    trace["max_silence"] = CONSTANT_MAX_SILENCE
+                traces.append(trace)
         return traces
 
+    def series(self, attr: str, times: list[datetime]) -> dict[str, np.ndarray] | None:
+        """Values of `attr` of each asset at every time in one go, None to get
+        them from the `get_` method of the attribute one time at a time"""
+        return None
+
+    def write_rows(
+        self,
+        f: TextIO,
+        attr: str,
+        asset_list: list[str],
+        times: list[datetime],
+        solved: dict[str, dict[str, np.ndarray]],
+    ) -> list[bool]:
+        method_name = f"get_{attr}"
+        first_row = None
+        constant = [True] * len(asset_list)
+        for index, current in enumerate(times):
+            merged_values = {}
+            if hasattr(self, method_name):
+                method = getattr(self, method_name)
+                values = method(current)  # {asset: normalized_value}
+                merged_values.update(values)
+            for asset, series in solved.get(attr, {}).items():
+                merged_values[asset] = normalize(float(series[index]))
+            row_values = [
+                merged_values.get(asset, normalize(self.default_value(attr)))
+                for asset in asset_list
+            ]
+            if first_row is None:
+                first_row = row_values
+            constant = [
+                same and value == first
+                for same, value, first in zip(constant, row_values, first_row)
+            ]
+            f.write(
+                f"{current.strftime('%Y-%m-%d %H:%M:%S')},"
+                + ",".join(row_values)
+                + "\n"
+            )
+        return constant
+
+    def write_columns(
+        self,
+        f: TextIO,
+        attr: str,
+        asset_list: list[str],
+        times: list[datetime],
+        series: dict[str, np.ndarray],
+    ) -> list[bool]:
+        """Writes the whole table at once, assets without series get the default"""
+        default = normalize(self.default_value(attr))
+        stamps = [current.strftime("%Y-%m-%d %H:%M:%S") for current in times]
+        constant = [True] * len(asset_list)
+        if not any(asset in series for asset in asset_list):
+            row = ",".join([default] * len(asset_list))
+            f.writelines(f"{stamp},{row}\n" for stamp in stamps)
+            return constant
+
+        table = np.full((len(times), len(asset_list)), default, object)
+        for is_bool in (False, True):
+            positions = [
+                position
+                for position, asset in enumerate(asset_list)
+                if asset in series and (series[asset].dtype == bool) == is_bool
+            ]
+            if not positions:
+                continue
+            values = np.column_stack([series[asset_list[p]] for p in positions])
+            table[:, positions] = normalize_array(values)
+            if not is_bool:
+                values = np.rint(values * 1000)
+            for position, same in zip(positions, (values == values[0]).all(axis=0)):
+                constant[position] = bool(same)
+        f.writelines(
+            f"{stamp},{','.join(row)}\n" for stamp, row in zip(stamps, table.tolist())
+        )
+        return constant
+
     def get_active_power(self, time: datetime) -> dict[str, str]:
         result = {}
         for asset in self.assets:
@@ -1,8 +1,13 @@
 from datetime import datetime
 
+import numpy as np
 from generic import GridDefinition
+from powerflow import Line, Network
 from utils import noise, normalize, solar_gaussian
 
+# Reactive over active power of the lines
+REACTIVE_RATIO = 0.08
+
 
 class CalamaGrid(GridDefinition):
     @property
@@ -37,12 +42,41 @@ class CalamaGrid(GridDefinition):
             "SlackSAL-CHU": "SlackLine",
         }
 
+    @property
+    def network(self) -> Network:
+        return Network(
+            buses=[
+                "SEValleDeLosVientos",
+                "SEJama",
+                "SELasana",
+                "SECalama",
+                "SENuevaChuquicamata",
+                "SESalar",
+                "SEChuquicamata",
+            ],
+            lines={
+                "JAM-LAS": Line("SEJama", "SELasana", 0.05, 0.005),
+                "LAS-CAL": Line("SELasana", "SECalama", 0.04, 0.004),
+                "VLV-CAL": Line("SEValleDeLosVientos", "SECalama", 0.03, 0.003),
+                "CAL-NCH": Line("SECalama", "SENuevaChuquicamata", 0.02, 0.002),
+                "NCH-CHU": Line("SENuevaChuquicamata", "SEChuquicamata", 0.015, 0.0015),
+                "CAL-SAL": Line("SECalama", "SESalar", 0.025, 0.0025),
+                "SAL-CHU": Line("SESalar", "SEChuquicamata", 0.02, 0.002),
+            },
+            # The external grid behind SlackSAL-CHU
+            slack="SEChuquicamata",
+            generators={
+                "PFVJama": "SEJama",
+                "PFVSanPedro": "SELasana",
+                "PEValleDeLosVientos": "SEValleDeLosVientos",
+                "PECalama": "SECalama",
+                "PFVAzabache": "SECalama",
+                "PFVUsya": "SECalama",
+            },
+        )
+
     @staticmethod
-    def power(
-        time: datetime, peak_power: float, end: bool = False, reactive: bool = False
-    ):
-        peak_power *= -0.93 if end else 1
-        peak_power *= 0.08 if reactive else 1
+    def generation(time: datetime, peak_power: float) -> dict[str, float]:
         delta_vlv = -1.4
         delta_aza = 1.3
         delta_cal = 1.7
@@ -58,27 +92,6 @@ class CalamaGrid(GridDefinition):
         pe_vlv = peak_power + delta_vlv - noise((peak_power + delta_vlv) * 0.1)
         pe_calama = peak_power + delta_cal - noise((peak_power + delta_cal) * 0.1)
 
-        # Lines
-        jam_las = pfv_jama - noise(peak_power * 0.1)
-        las_cal = jam_las + pfv_sanpedro - noise(peak_power * 0.1)
-        vlv_cal = pe_vlv - noise((peak_power + delta_vlv) * 0.1)
-        total_cal_chu = las_cal + vlv_cal + pfv_usya + pfv_azabache + pe_calama
-        cal_sal = total_cal_chu / 2 - noise(peak_power * 0.1)
-        sal_chu = cal_sal - noise(peak_power * 0.1)
-        cal_nch = total_cal_chu / 2 - noise(peak_power * 0.1)
-        nch_chu = cal_nch - noise(peak_power * 0.1)
-
-        # Buses
-        se_vlv = pe_vlv - noise((peak_power + delta_vlv) * 0.1)
-        se_jam = jam_las
-        se_las = las_cal
-        se_cal = (
-            pfv_usya + pfv_azabache + pe_calama + las_cal - noise(peak_power * 2 * 0.1)
-        )
-        se_sal = se_cal
-        se_nchu = se_cal
-        se_chu = se_sal + se_nchu
-
         return {
             "PFVJama": pfv_jama,
             "PFVSanPedro": pfv_sanpedro,
@@ -86,69 +99,56 @@ class CalamaGrid(GridDefinition):
             "PFVUsya": pfv_usya,
             "PEValleDeLosVientos": pe_vlv,
             "PECalama": pe_calama,
-            "CAL-NCH": cal_nch,
-            "CAL-SAL": cal_sal,
-            "JAM-LAS": jam_las,
-            "LAS-CAL": las_cal,
-            "NCH-CHU": nch_chu,
-            "SAL-CHU": sal_chu,
-            "VLV-CAL": vlv_cal,
-            "SEValleDeLosVientos": se_vlv,
-            "SEJama": se_jam,
-            "SECalama": se_cal,
-            "SELasana": se_las,
-            "SENuevaChuquicamata": se_nchu,
-            "SEChuquicamata": se_chu,
-            "SESalar": se_sal,
         }
 
-    def get_active_power(self, time: datetime) -> dict[str, str]:
-        result = super().get_active_power(time)
-        result["PFVJama"] = normalize(self.power(time, 10).get("PFVJama", 0.0))
-        result["PFVSanPedro"] = normalize(self.power(time, 10).get("PFVSanPedro", 0.0))
-        result["PFVAzabache"] = normalize(self.power(time, 10).get("PFVAzabache", 0.0))
-        result["PFVUsya"] = normalize(self.power(time, 10).get("PFVUsya", 0.0))
-        result["PEValleDeLosVientos"] = normalize(
-            self.power(time, 10).get("PEValleDeLosVientos", 0.0)
-        )
-        result["PECalama"] = normalize(self.power(time, 10).get("PECalama", 0.0))
-        result["SEValleDeLosVientos"] = normalize(
-            self.power(time, 10).get("SEValleDeLosVientos", 0.0)
-        )
-        result["SEJama"] = normalize(self.power(time, 10).get("SEJama", 0.0))
-        result["SELasana"] = normalize(self.power(time, 10).get("SELasana", 0.0))
-        result["SECalama"] = normalize(self.power(time, 10).get("SECalama", 0.0))
-        result["SENuevaChuquicamata"] = normalize(
-            self.power(time, 10).get("SENuevaChuquicamata", 0.0)
-        )
-        result["SESalar"] = normalize(self.power(time, 10).get("SESalar", 0.0))
-        result["SEChuquicamata"] = normalize(
-            self.power(time, 10).get("SEChuquicamata", 0.0)
-        )
-        return result
+    def injections(
+        self, times: list[datetime]
+    ) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+        generation = [self.generation(time, 10) for time in times]
+        return {
+            asset: np.array([values[asset] for values in generation])
+            for asset in self.network.generators
+        }, {}
+
+    def power_flow(self, times: list[datetime]) -> dict[str, dict[str, np.ndarray]]:
+        solved = super().power_flow(times)
+        for end in ("start", "end"):
+            solved[f"reactive_power_{end}"] = {
+                line: values * REACTIVE_RATIO
+                for line, values in solved[f"active_power_{end}"].items()
+            }
+        return solved
 
     def get_available_active_power(self, time: datetime) -> dict[str, str]:
         result = super().get_available_active_power(time)
-        result["PFVJama"] = normalize(self.power(time, 20).get("PFVJama", 0.0))
-        result["PFVSanPedro"] = normalize(self.power(time, 20).get("PFVSanPedro", 0.0))
-        result["PFVAzabache"] = normalize(self.power(time, 20).get("PFVAzabache", 0.0))
-        result["PFVUsya"] = normalize(self.power(time, 20).get("PFVUsya", 0.0))
+        result["PFVJama"] = normalize(self.generation(time, 20).get("PFVJama", 0.0))
+        result["PFVSanPedro"] = normalize(
+            self.generation(time, 20).get("PFVSanPedro", 0.0)
+        )
+        result["PFVAzabache"] = normalize(
+            self.generation(time, 20).get("PFVAzabache", 0.0)
+        )
+        result["PFVUsya"] = normalize(self.generation(time, 20).get("PFVUsya", 0.0))
         result["PEValleDeLosVientos"] = normalize(
-            self.power(time, 20).get("PEValleDeLosVientos", 0.0)
+            self.generation(time, 20).get("PEValleDeLosVientos", 0.0)
         )
-        result["PECalama"] = normalize(self.power(time, 20).get("PECalama", 0.0))
+        result["PECalama"] = normalize(self.generation(time, 20).get("PECalama", 0.0))
         return result
 
     def get_power_set_point(self, time: datetime) -> dict[str, str]:
         result = super().get_power_set_point(time)
-        result["PFVJama"] = normalize(self.power(time, 11).get("PFVJama", 0.0))
-        result["PFVSanPedro"] = normalize(self.power(time, 11).get("PFVSanPedro", 0.0))
-        result["PFVAzabache"] = normalize(self.power(time, 11).get("PFVAzabache", 0.0))
-        result["PFVUsya"] = normalize(self.power(time, 11).get("PFVUsya", 0.0))
+        result["PFVJama"] = normalize(self.generation(time, 11).get("PFVJama", 0.0))
+        result["PFVSanPedro"] = normalize(
+            self.generation(time, 11).get("PFVSanPedro", 0.0)
+        )
+        result["PFVAzabache"] = normalize(
+            self.generation(time, 11).get("PFVAzabache", 0.0)
+        )
+        result["PFVUsya"] = normalize(self.generation(time, 11).get("PFVUsya", 0.0))
         result["PEValleDeLosVientos"] = normalize(
-            self.power(time, 11).get("PEValleDeLosVientos", 0.0)
+            self.generation(time, 11).get("PEValleDeLosVientos", 0.0)
         )
-        result["PECalama"] = normalize(self.power(time, 11).get("PECalama", 0.0))
+        result["PECalama"] = normalize(self.generation(time, 11).get("PECalama", 0.0))
         return result
 
     def get_frequency(self, time: datetime) -> dict[str, str]:
@@ -162,103 +162,3 @@ class CalamaGrid(GridDefinition):
         result["PEValleDeLosVientos"] = normalize("true")
         result["PECalama"] = normalize("true")
         return result
-
-    def get_active_power_start(self, time: datetime) -> dict[str, str]:
-        result = super().get_active_power_start(time)
-        result["CAL-NCH"] = normalize(
-            self.power(time, 10, end=False).get("CAL-NCH", 0.0)
-        )
-        result["CAL-SAL"] = normalize(
-            self.power(time, 10, end=False).get("CAL-SAL", 0.0)
-        )
-        result["SAL-CHU"] = normalize(
-            self.power(time, 10, end=False).get("SAL-CHU", 0.0)
-        )
-        result["VLV-CAL"] = normalize(
-            self.power(time, 10, end=False).get("VLV-CAL", 0.0)
-        )
-        result["JAM-LAS"] = normalize(
-            self.power(time, 10, end=False).get("JAM-LAS", 0.0)
-        )
-        result["LAS-CAL"] = normalize(
-            self.power(time, 10, end=False).get("LAS-CAL", 0.0)
-        )
-        result["NCH-CHU"] = normalize(
-            self.power(time, 10, end=False).get("NCH-CHU", 0.0)
-        )
-        return result
-
-    def get_active_power_end(self, time: datetime) -> dict[str, str]:
-        result = super().get_active_power_end(time)
-        result["CAL-NCH"] = normalize(
-            self.power(time, 10, end=True).get("CAL-NCH", 0.0)
-        )
-        result["CAL-SAL"] = normalize(
-            self.power(time, 10, end=True).get("CAL-SAL", 0.0)
-        )
-        result["SAL-CHU"] = normalize(
-            self.power(time, 10, end=True).get("SAL-CHU", 0.0)
-        )
-        result["VLV-CAL"] = normalize(
-            self.power(time, 10, end=True).get("VLV-CAL", 0.0)
-        )
-        result["JAM-LAS"] = normalize(
-            self.power(time, 10, end=True).get("JAM-LAS", 0.0)
-        )
-        result["LAS-CAL"] = normalize(
-            self.power(time, 10, end=True).get("LAS-CAL", 0.0)
-        )
-        result["NCH-CHU"] = normalize(
-            self.power(time, 10, end=True).get("NCH-CHU", 0.0)
-        )
-        return result
-
-    def get_reactive_power_start(self, time: datetime) -> dict[str, str]:
-        result = super().get_reactive_power_start(time)
-        result["CAL-NCH"] = normalize(
-            self.power(time, 10, reactive=True, end=False).get("CAL-NCH", 0.0)
-        )
-        result["CAL-SAL"] = normalize(
-            self.power(time, 10, reactive=True, end=False).get("CAL-SAL", 0.0)
-        )
-        result["SAL-CHU"] = normalize(
-            self.power(time, 10, reactive=True, end=False).get("SAL-CHU", 0.0)
-        )
-        result["VLV-CAL"] = normalize(
-            self.power(time, 10, reactive=True, end=False).get("VLV-CAL", 0.0)
-        )
-        result["JAM-LAS"] = normalize(
-            self.power(time, 10, reactive=True, end=False).get("JAM-LAS", 0.0)
-        )
-        result["LAS-CAL"] = normalize(
-            self.power(time, 10, reactive=True, end=False).get("LAS-CAL", 0.0)
-        )
-        result["NCH-CHU"] = normalize(
-            self.power(time, 10, reactive=True, end=False).get("NCH-CHU", 0.0)
-        )
-        return result
-
-    def get_reactive_power_end(self, time: datetime) -> dict[str, str]:
-        result = super().get_reactive_power_end(time)
-        result["CAL-NCH"] = normalize(
-            self.power(time, 10, reactive=True, end=True).get("CAL-NCH", 0.0)
-        )
-        result["CAL-SAL"] = normalize(
-            self.power(time, 10, reactive=True, end=True).get("CAL-SAL", 0.0)
-        )
-        result["SAL-CHU"] = normalize(
-            self.power(time, 10, reactive=True, end=True).get("SAL-CHU", 0.0)
-        )
-        result["VLV-CAL"] = normalize(
-            self.power(time, 10, reactive=True, end=True).get("VLV-CAL", 0.0)
-        )
-        result["JAM-LAS"] = normalize(
-            self.power(time, 10, reactive=True, end=True).get("JAM-LAS", 0.0)
-        )
-        result["LAS-CAL"] = normalize(
-            self.power(time, 10, reactive=True, end=True).get("LAS-CAL", 0.0)
-        )
-        result["NCH-CHU"] = normalize(
-            self.power(time, 10, reactive=True, end=True).get("NCH-CHU", 0.0)
-        )
-        return result
@@ -1,7 +1,12 @@
 from datetime import datetime
 
+import numpy as np
 from generic import GridDefinition
-from utils import noise, normalize, sinusoidal
+from powerflow import Line, Network
+from utils import noise, sinusoidal
+
+# Reactive over active power of the buses
+REACTIVE_RATIO = 0.08
 
 
 class MarconaGrid(GridDefinition):
@@ -25,95 +30,48 @@ class MarconaGrid(GridDefinition):
             "Datacenter2": "Load",
         }
 
-    @staticmethod
-    def power(
-        time: datetime, peak_power: float, end: bool = False, reactive: bool = False
-    ):
-        peak_power *= -0.93 if end else 1
-        peak_power *= 0.08 if reactive else 1
-
-        sine_base = sinusoidal(time, amplitude=3, offset=7)
-        cah_der_base = -1 * (sine_base + noise(1) - 0.1)
-
-        # Lines
-        cah_der_0 = -cah_der_base + 0.5 if end else cah_der_base
-        cah_der_1 = cah_der_0
-        der_ica = cah_der_0 + cah_der_1 + 0.5 if end else -(cah_der_0 + cah_der_1)
+    @property
+    def network(self) -> Network:
+        return Network(
+            buses=["SECahuachi", "SEDerivacion", "SEIca"],
+            lines={
+                "CAH-DER-0": Line("SECahuachi", "SEDerivacion", 0.03, 0.003),
+                "CAH-DER-1": Line("SECahuachi", "SEDerivacion", 0.03, 0.003),
+                "DER-ICA": Line("SEDerivacion", "SEIca", 0.02, 0.002),
+            },
+            # Fed by PoromaExternal
+            slack="SECahuachi",
+            loads={
+                "Datacenter0": "SEDerivacion",
+                "Datacenter1": "SEIca",
+                "Datacenter2": "SEIca",
+            },
+        )
 
-        # Buses
-        se_cah = cah_der_0 + cah_der_1
-        se_der = se_cah - noise(2)
-        se_ica = se_der - noise(1)
+    def injections(
+        self, times: list[datetime]
+    ) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+        total = np.array(
+            [
+                2 * (sinusoidal(time, amplitude=3, offset=7) + noise(1) - 0.1)
+                for time in times
+            ]
+        )
+        return {}, {
+            "Datacenter0": total * 0.2,
+            "Datacenter1": total * 0.5,
+            "Datacenter2": total * 0.3,
+        }
 
-        # Loads
-        total_power = 2 * cah_der_base
-        datacenter0 = total_power * 0.2
-        datacenter1 = total_power * 0.5
-        datacenter2 = total_power * 0.3
-        return {
-            "Datacenter0": datacenter0,
-            "Datacenter1": datacenter1,
-            "Datacenter2": datacenter2,
-            "CAH-DER-0": cah_der_0,
-            "CAH-DER-1": cah_der_1,
-            "DER-ICA": der_ica,
-            "SECahuachi": se_cah,
-            "SEDerivacion": se_der,
-            "SEIca": se_ica,
+    def power_flow(self, times: list[datetime]) -> dict[str, dict[str, np.ndarray]]:
+        solved = super().power_flow(times)
+        solved["reactive_power"] = {
+            bus: solved["active_power"][bus] * REACTIVE_RATIO
+            for bus in self.network.buses
         }
+        return solved
 
     def default_value(self, attr: str) -> float | str:
         if "voltage_start" in attr:
             return 370.0
         return super().default_value(attr)
-
-    def get_active_power(self, time: datetime) -> dict[str, str]:
-        result = super().get_active_power(time)
-        result["Datacenter0"] = normalize(self.power(time, 12).get("Datacenter0", 0.0))
-        result["Datacenter1"] = normalize(self.power(time, 12).get("Datacenter1", 0.0))
-        result["Datacenter2"] = normalize(self.power(time, 12).get("Datacenter2", 0.0))
-        result["SECahuachi"] = normalize(self.power(time, 12).get("SECahuachi", 0.0))
-        result["SEDerivacion"] = normalize(
-            self.power(time, 12).get("SEDerivacion", 0.0)
-        )
-        result["SEIca"] = normalize(self.power(time, 12).get("SEIca", 0.0))
-        return result
-
-    def get_reactive_power(self, time: datetime) -> dict[str, str]:
-        result = super().get_reactive_power(time)
-        result["SECahuachi"] = normalize(
-            self.power(time, 12, reactive=True).get("SECahuachi", 0.0)
-        )
-        result["SEDerivacion"] = normalize(
-            self.power(time, 12, reactive=True).get("SEDerivacion", 0.0)
-        )
-        result["SEIca"] = normalize(
-            self.power(time, 12, reactive=True).get("SEIca", 0.0)
-        )
-        return result
-
-    def get_active_power_start(self, time: datetime) -> dict[str, str]:
-        result = super().get_active_power_start(time)
-        result["CAH-DER-0"] = normalize(
-            self.power(time, 12, end=False).get("CAH-DER-0", 0.0)
-        )
-        result["CAH-DER-1"] = normalize(
-            self.power(time, 12, end=False).get("CAH-DER-1", 0.0)
-        )
-        result["DER-ICA"] = normalize(
-            self.power(time, 12, end=False).get("DER-ICA", 0.0)
-        )
-        return result
-
-    def get_active_power_end(self, time: datetime) -> dict[str, str]:
-        result = super().get_active_power_end(time)
-        result["CAH-DER-0"] = normalize(
-            self.power(time, 12, end=True).get("CAH-DER-0", 0.0)
-        )
-        result["CAH-DER-1"] = normalize(
-            self.power(time, 12, end=True).get("CAH-DER-1", 0.0)
-        )
-        result["DER-ICA"] = normalize(
-            self.power(time, 12, end=True).get("DER-ICA", 0.0)
-        )
-        return result
@@ -0,0 +1,185 @@
+from datetime import datetime
+
+import numpy as np
+from generic import GridDefinition
+from powerflow import Line, Network
+from utils import bess_active_power, bess_soc
+
+# Reactive over active power of every asset and line
+REACTIVE_RATIO = 0.08
+# Lines closing loops, per bus, on top of the tree joining the buses
+MESHING = 0.2
+# A bus hangs from one of this many buses before it, which keeps lines local
+REACH = 8
+# Low hours, peak hours, charge rate, discharge rate and capacity, as the
+# batteries of the other grids
+BESS_SCHEDULE = ([5, 13], [9, 16], 9, 6, 18)
+
+
+class SyntheticGrid(GridDefinition):
+    """Random grid of any size, to load test the platform and the simulator.
+
+    Buses are joined by a random tree of lines plus a few lines closing
+    loops, with the external grid at the first bus. Generators are solar or
+    wind plants, loads follow a daily curve and batteries the schedule of
+    the other grids, each with its own size. The same arguments give the same
+    grid, and every value is computed for all the timesteps at once.
+    """
+
+    def __init__(
+        self,
+        name: str = "Synthetic",
+        buses: int = 500,
+        generators: int | None = None,
+        loads: int | None = None,
+        batteries: int | None = None,
+        meshing: float = MESHING,
+        seed: int | np.random.SeedSequence | None = None,
+    ) -> None:
+        if buses < 2:
+            raise ValueError("A synthetic grid needs at least 2 buses")
+        self._name = name
+        self.rng = np.random.default_rng(seed)
+        rng = self.rng
+
+        self.buses = [f"SE{index:05d}" for index in range(buses)]
+        self.lines: dict[str, Line] = {}
+        ends = [(int(rng.integers(max(0, i - REACH), i)), i) for i in range(1, buses)]
+        for _ in range(int(buses * meshing)):
+            start = int(rng.integers(0, buses - 1))
+            ends.append(
+                (start, int(rng.integers(start + 1, min(start + REACH, buses))))
+            )
+        for start, end in ends:
+            line = f"L{start:05d}-{end:05d}"
+            if line not in self.lines:
+                reactance = float(rng.uniform(0.01, 0.1))
+                self.lines[line] = Line(
+                    self.buses[start], self.buses[end], reactance, reactance / 10
+                )
+
+        def place(prefix: str, count: int) -> dict[str, str]:
+            at = rng.integers(1, buses, count)
+            return {f"{prefix}{i:05d}": self.buses[bus] for i, bus in enumerate(at)}
+
+        self.generators = place("G", buses // 2 if generators is None else generators)
+        self.loads = place("D", buses // 2 if loads is None else loads)
+        self.batteries = place("BESS", buses // 10 if batteries is None else batteries)
+        self.capacity = rng.uniform(5, 50, len(self.generators))
+        self.solar = rng.random(len(self.generators)) < 0.5
+        self.demand = rng.uniform(2, 30, len(self.loads))
+        self.rating = rng.uniform(2, 10, len(self.batteries))
+        self._profiles: tuple[tuple, dict[str, dict[str, np.ndarray]]] | None = None
+        self._assets = {
+            name: "Grid",
+            "External": "ExternalGrid",
+            **{bus: "Bus" for bus in self.buses},
+            **{generator: "Generator" for generator in self.generators},
+            **{load: "Load" for load in self.loads},
+            **{battery: "Battery" for battery in self.batteries},
+            **{line: "Line" for line in self.lines},
+        }
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def assets(self) -> dict[str, str]:
+        return self._assets
+
+    @property
+    def network(self) -> Network:
+        return Network(
+            buses=self.buses,
+            lines=self.lines,
+            slack=self.buses[0],
+            generators={**self.generators, **self.batteries},
+            loads=self.loads,
+        )
+
+    def profiles(self, times: list[datetime]) -> dict[str, dict[str, np.ndarray]]:
+        """Available and produced power of the generators, demand of the loads
+        and power and charge of the batteries, for every time"""
+        key = (times[0], times[-1], len(times))
+        if self._profiles is not None and self._profiles[0] == key:
+            return self._profiles[1]
+        rng = self.rng
+        steps = len(times)
+        hours = np.array([time.hour + time.minute / 60 for time in times])[:, None]
+
+        count = len(self.generators)
+        noon = rng.uniform(12.5, 14.5, count)
+        width = rng.uniform(2, 3, count)
+        sun = np.exp(-((hours - noon) ** 2) / (2 * width**2))
+        phase = rng.uniform(0, 24, count)
+        wind = 0.55 + 0.25 * np.sin(2 * np.pi * (hours + phase) / 24)
+        wind += rng.normal(0, 0.05, (steps, count)).cumsum(axis=0) / np.sqrt(steps)
+        available = self.capacity * np.clip(np.where(self.solar, sun, wind), 0, 1)
+        produced = available * (1 - np.abs(rng.normal(0, 0.02, (steps, count))))
+
+        peak = rng.uniform(17, 21, len(self.loads))
+        curve = 0.75 + 0.25 * np.cos(2 * np.pi * (hours - peak) / 24)
+        demand = self.demand * curve
+        demand *= 1 + rng.normal(0, 0.02, demand.shape)
+
+        schedule = np.array([bess_active_power(time, *BESS_SCHEDULE) for time in times])
+        charge = np.array([bess_soc(time, *BESS_SCHEDULE) for time in times])
+        power = schedule[:, None] / BESS_SCHEDULE[2] * self.rating
+
+        profiles = {
+            "available_active_power": dict(zip(self.generators, available.T)),
+            "power_set_point": {
+                generator: np.full(steps, capacity)
+                for generator, capacity in zip(self.generators, self.capacity)
+            },
+            "generation": {
+                **dict(zip(self.generators, produced.T)),
+                **dict(zip(self.batteries, power.T)),
+            },
+            "load": dict(zip(self.loads, demand.T)),
+            "state_of_charge": {battery: charge for battery in self.batteries},
+        }
+        self._profiles = (key, profiles)
+        return profiles
+
+    def injections(
+        self, times: list[datetime]
+    ) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+        profiles = self.profiles(times)
+        return profiles["generation"], profiles["load"]
+
+    def power_flow(self, times: list[datetime]) -> dict[str, dict[str, np.ndarray]]:
+        solved = super().power_flow(times)
+        solved["reactive_power"] = {
+            asset: values * REACTIVE_RATIO
+            for asset, values in solved["active_power"].items()
+        }
+        for end in ("start", "end"):
+            active = solved[f"active_power_{end}"]
+            solved[f"reactive_power_{end}"] = {
+                line: values * REACTIVE_RATIO for line, values in active.items()
+            }
+            # Amperes of each phase from MW at the voltage of the line end
+            to_amperes = 1000 / (np.sqrt(3) * self.default_value(f"voltage_{end}"))
+            currents = {
+                line: np.abs(values) * to_amperes for line, values in active.items()
+            }
+            for phase in "rst":
+                solved[f"current_{phase}_{end}"] = currents
+        return solved
+
+    def series(self, attr: str, times: list[datetime]) -> dict[str, np.ndarray]:
+        # The power flow gives the rest, others keep their default value
+        return self.profiles(times).get(attr, {})
+
+
+def synthetic_grids(
+    count: int, buses: int = 500, seed: int | None = None
+) -> list[SyntheticGrid]:
+    """`count` different grids named Synthetic0, Synthetic1..."""
+    seeds = np.random.SeedSequence(seed).spawn(count)
+    return [
+        SyntheticGrid(f"Synthetic{index}", buses, seed=grid_seed)
+        for index, grid_seed in enumerate(seeds)
+    ]
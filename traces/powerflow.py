@@ -0,0 +1,167 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Reactances and resistances are per unit on this base
+BASE_MVA = 100.0
+
+
+@dataclass(frozen=True)
+class Line:
+    start: str
+    end: str
+    reactance: float
+    # Only used for the losses, a DC power flow ignores it otherwise
+    resistance: float = 0.0
+
+
+@dataclass(frozen=True)
+class Network:
+    """Topology of a grid, generators and loads are `asset: bus`"""
+
+    buses: list[str]
+    lines: dict[str, Line]
+    # Bus of the external grid, it takes whatever the others do not balance
+    slack: str
+    generators: dict[str, str] = field(default_factory=dict)
+    loads: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class PowerFlow:
+    """Solution of a power flow in MW, one row per timestep"""
+
+    network: Network
+    # Generation minus load of each bus, the slack bus included
+    injections: np.ndarray
+    # Flow from the start to the end of each line, without its losses
+    flows: np.ndarray
+    losses: np.ndarray
+
+    @property
+    def start(self) -> np.ndarray:
+        """Power into each line at its start"""
+        return self.flows + self.losses / 2
+
+    @property
+    def end(self) -> np.ndarray:
+        """Power into each line at its end, start plus end are the losses"""
+        return self.losses / 2 - self.flows
+
+    def lines(self, values: np.ndarray) -> dict[str, np.ndarray]:
+        return dict(zip(self.network.lines, values.T))
+
+    def buses(self) -> dict[str, np.ndarray]:
+        """Power going through each bus, brought by its lines and injection"""
+        index = {bus: position for position, bus in enumerate(self.network.buses)}
+        starts = [index[line.start] for line in self.network.lines.values()]
+        ends = [index[line.end] for line in self.network.lines.values()]
+        through = np.maximum(self.injections, 0)
+        np.add.at(through, (slice(None), starts), np.maximum(-self.start, 0))
+        np.add.at(through, (slice(None), ends), np.maximum(-self.end, 0))
+        return dict(zip(self.network.buses, through.T))
+
+
+class DCPowerFlow:
+    """DC power flow of a network, solved for many timesteps at once.
+
+    Bus angles solve B θ = P, with B the susceptance matrix of the lines and
+    the slack bus as the reference. B is inverted when the network is set up,
+    so solving any number of timesteps is a single matrix product.
+
+    Losses are estimated from the lossless flows, drawn half from each end of
+    their line, and the flows solved again with them.
+    """
+
+    def __init__(self, network: Network, base_mva: float = BASE_MVA) -> None:
+        self.network = network
+        self.base_mva = base_mva
+        self.index = {bus: position for position, bus in enumerate(network.buses)}
+        lines = list(network.lines.values())
+        for name, line in network.lines.items():
+            for bus in (line.start, line.end):
+                if bus not in self.index:
+                    raise ValueError(f"Line {name} ends at unknown bus {bus}")
+            if line.reactance <= 0:
+                raise ValueError(f"Line {name} needs a positive reactance")
+        for asset, bus in {**network.generators, **network.loads}.items():
+            if bus not in self.index:
+                raise ValueError(f"{asset} is at unknown bus {bus}")
+        self.starts = np.array([self.index[line.start] for line in lines], dtype=int)
+        self.ends = np.array([self.index[line.end] for line in lines], dtype=int)
+        self.susceptance = np.array([1 / line.reactance for line in lines])
+        self.resistance = np.array([line.resistance for line in lines])
+        self.slack = self.index[network.slack]
+        self.others = np.delete(np.arange(len(network.buses)), self.slack)
+        self.check_connected()
+
+        size = len(network.buses)
+        susceptance = np.zeros((size, size))
+        np.add.at(susceptance, (self.starts, self.starts), self.susceptance)
+        np.add.at(susceptance, (self.ends, self.ends), self.susceptance)
+        np.add.at(susceptance, (self.starts, self.ends), -self.susceptance)
+        np.add.at(susceptance, (self.ends, self.starts), -self.susceptance)
+        self._inverse = np.linalg.inv(susceptance[np.ix_(self.others, self.others)])
+
+    def check_connected(self) -> None:
+        neighbours: dict[int, list[int]] = {bus: [] for bus in self.index.values()}
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            neighbours[start].append(end)
+            neighbours[end].append(start)
+        reached, pending = {self.slack}, [self.slack]
+        while pending:
+            for bus in neighbours[pending.pop()]:
+                if bus not in reached:
+                    reached.add(bus)
+                    pending.append(bus)
+        isolated = [
+            bus for bus, position in self.index.items() if position not in reached
+        ]
+        if isolated:
+            raise ValueError(f"Buses {', '.join(isolated)} are not connected")
+
+    def injections(
+        self, generation: dict[str, np.ndarray], load: dict[str, np.ndarray]
+    ) -> np.ndarray:
+        series = list(generation.values()) + list(load.values())
+        if not series:
+            raise ValueError("A power flow needs some generation or load")
+        injections = np.zeros((len(series[0]), len(self.index)))
+        for asset, values in generation.items():
+            injections[:, self.index[self.network.generators[asset]]] += values
+        for asset, values in load.items():
+            injections[:, self.index[self.network.loads[asset]]] -= values
+        return injections
+
+    def flows(self, injections: np.ndarray) -> np.ndarray:
+        angles = np.zeros_like(injections)
+        angles[:, self.others] = (
+            injections[:, self.others] / self.base_mva @ self._inverse
+        )
+        return (
+            (angles[:, self.starts] - angles[:, self.ends])
+            * self.susceptance
+            * self.base_mva
+        )
+
+    def losses(self, flows: np.ndarray) -> np.ndarray:
+        return self.resistance * flows**2 / self.base_mva
+
+    def solve(
+        self,
+        generation: dict[str, np.ndarray],
+        load: dict[str, np.ndarray] | None = None,
+    ) -> PowerFlow:
+        """Solves every timestep, generation and load are MW of each asset"""
+        injections = self.injections(generation, load or {})
+        flows = self.flows(injections)
+        losses = self.losses(flows)
+        if losses.any():
+            drawn = np.zeros_like(injections)
+            np.add.at(drawn, (slice(None), self.starts), losses / 2)
+            np.add.at(drawn, (slice(None), self.ends), losses / 2)
+            flows = self.flows(injections - drawn)
+            losses = self.losses(flows)
+        balance = injections[:, self.others].sum(axis=1)
+        injections[:, self.slack] = losses.sum(axis=1) - balance
+        return PowerFlow(self.network, injections, flows, losses)
@@ -33,8 +33,60 @@ def normalize(value: float | str | bool | int) -> str:
         raise ValueError(f"Invalid value type: {type(value)}")
 
 
+_FRACTIONS = np.array([f".{value:03d}" for value in range(1000)], dtype=object)
+
+
+def normalize_array(values: np.ndarray) -> np.ndarray:
+    """Strings of `values` with 3 decimals like `normalize`, for a whole table.
+
+    Only the distinct integer parts are formatted one by one, the decimals
+    come from a table, which is what keeps the build fast for big grids.
+    """
+    if values.dtype == bool:
+        return np.where(values, "true", "false").astype(object)
+    milli = np.rint(np.asarray(values, dtype=float) * 1000).astype(np.int64)
+    magnitude = np.abs(milli)
+    # Integer part and sign in one key, so that -0.5 keeps its sign
+    keys = magnitude // 1000 * 2 + (milli < 0)
+    distinct, positions = np.unique(keys, return_inverse=True)
+    integers = np.array(
+        [f"{'-' if key & 1 else ''}{key >> 1}" for key in distinct.tolist()],
+        dtype=object,
+    )
+    strings = integers[positions].reshape(milli.shape) + _FRACTIONS[magnitude % 1000]
+    return strings
+
+
+class NormalSampler:
+    """Standard normal samples drawn in blocks from a seeded generator"""
+
+    def __init__(self, seed: int | None = None, block_size: int = 65536):
+        self.block_size = block_size
+        self.seed(seed)
+
+    def seed(self, seed: int | None) -> None:
+        self._rng = np.random.default_rng(seed)
+        self._buffer = np.empty(0)
+        self._index = 0
+
+    def next(self) -> float:
+        if self._index >= len(self._buffer):
+            self._buffer = self._rng.standard_normal(self.block_size)
+            self._index = 0
+        value = self._buffer[self._index]
+        self._index += 1
+        return float(value)
+
+
+_noise = NormalSampler()
+
+
+def seed_noise(seed: int | None) -> None:
+    _noise.seed(seed)
+
+
 def noise(peak: float) -> float:
-    return np.random.normal(0, max(peak, 1))
+    return _noise.next() * max(peak, 1)
 
 
 def _in_interval(x: float, start: float, end: float) -> bool: